@@ -0,0 +1,179 @@
+'''
+End-to-end benchmarks against the local fake OneNote API server
+(benchmarks/fakeserver.py): get_structure, load_structure,
+create_tree, --tree rendering and content export.
+
+Run from the repository root:
+    python benchmarks/bench_api.py --pages 20000 --latency 0.02
+    python benchmarks/bench_api.py --save baseline.json
+    python benchmarks/bench_api.py --compare baseline.json
+
+Results are throughputs (entities or pages per second, higher is
+better). With --compare the script exits with status 1 if any result
+is more than --tolerance slower than the baseline.
+'''
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import onenote  # noqa
+import onenotecli  # noqa
+from fakeserver import Account, FakeOneNoteServer  # noqa
+
+TOLERANCE = 0.2
+
+
+def write_session(path):
+    with open(path, 'w') as f:
+        json.dump({'client_id': 'bench', 'client_secret': 'bench',
+                   'redirect_url': 'http://localhost', 'scope': 'bench',
+                   'access_token': 'bench', 'refresh_token': None}, f)
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(args, tmp):
+    account = Account(notebooks=args.notebooks, sections=args.sections,
+                      pages=args.pages, content_size=args.content_size)
+    entities = args.notebooks + args.sections + args.pages
+    ses_file = os.path.join(tmp, 'bench.ses')
+    save_file = os.path.join(tmp, 'bench.db')
+    write_session(ses_file)
+    results = {}
+
+    with FakeOneNoteServer(account, latency=args.latency,
+                           throttle=args.throttle) as server:
+        def client(**kwargs):
+            return onenote.OneNote(ses_file=ses_file, save_file=save_file,
+                                   base_url=server.base_url,
+                                   page_size=args.page_size, **kwargs)
+
+        o = client(workers=args.workers)
+        server.reset_counters()
+        t = best_of(o.get_structure, args.repeat)
+        results['get_structure'] = entities / t
+        print('get_structure: %.2fs, %d requests/run, %.0f entities/s' %
+              (t, server.requests.get('GET', 0) / args.repeat,
+               results['get_structure']))
+
+        loaded = client()
+        t = best_of(loaded.load_structure, args.repeat)
+        results['load_structure'] = entities / t
+        print('load_structure: %.3fs, %.0f entities/s' %
+              (t, results['load_structure']))
+
+        t = best_of(loaded.create_tree, args.repeat)
+        results['create_tree'] = entities / t
+        print('create_tree: %.3fs, %.0f entities/s' %
+              (t, results['create_tree']))
+
+        def render():
+            parsed = onenotecli.make_parser().parse_args(['--tree'])
+            with open(os.devnull, 'w') as out, \
+                    contextlib.redirect_stdout(out):
+                try:
+                    onenotecli.main(parsed, loaded)
+                except SystemExit:
+                    pass
+        t = best_of(render, args.repeat)
+        results['tree'] = entities / t
+        print('--tree: %.3fs, %.0f entities/s' % (t, results['tree']))
+
+        pages = loaded.pages[:args.export_pages]
+        for fmt in ('html', 'md'):
+            def export():
+                directory = tempfile.mkdtemp(dir=tmp)
+                stats = loaded.export(directory, fmt=fmt,
+                                      workers=args.workers)
+                if stats['exported'] != len(pages):
+                    raise RuntimeError('export failed: %s' % stats)
+            loaded.pages, all_pages = pages, loaded.pages
+            try:
+                t = best_of(export, args.repeat)
+            finally:
+                loaded.pages = all_pages
+            results['export_' + fmt] = len(pages) / t
+            print('export %s: %.2fs, %.1f pages/s' %
+                  (fmt, t, results['export_' + fmt]))
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Print the change against the baseline, return names of regressions
+    '''
+    regressions = []
+    print('%-16s %12s %12s %8s' % ('benchmark', 'baseline', 'current',
+                                   'change'))
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            print('%-16s %12s %12.0f' % (name, '-', value))
+            continue
+        change = value / base - 1
+        mark = ''
+        if change < -tolerance:
+            regressions.append(name)
+            mark = ' REGRESSION'
+        print('%-16s %12.0f %12.0f %+7.1f%%%s' %
+              (name, base, value, change * 100, mark))
+    return regressions
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks against a local fake OneNote API')
+    parser.add_argument('--notebooks', type=int, default=10)
+    parser.add_argument('--sections', type=int, default=300)
+    parser.add_argument('--pages', type=int, default=10000)
+    parser.add_argument('--content-size', type=int, default=8 * 1024,
+                        help='bytes of page content')
+    parser.add_argument('--export-pages', type=int, default=500,
+                        help='number of pages exported')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each response')
+    parser.add_argument('--throttle', type=float, default=0.0,
+                        help='fraction of requests answered with 429')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='$top of the listings')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='write results to JSON file')
+    parser.add_argument('--compare', help='baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed slowdown against the baseline')
+    return parser
+
+
+def main():
+    args = make_parser().parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args, tmp)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
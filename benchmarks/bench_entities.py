@@ -0,0 +1,127 @@
+'''
+Benchmark of OEntity memory footprint and load_structure time.
+
+Run from the repository root:
+    python benchmarks/bench_entities.py
+'''
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import dateutil.parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import onenote  # noqa
+
+ENTITIES = 100000
+# dateutil is slow, the legacy entity is measured on a sample
+LEGACY_ENTITIES = 10000
+TIME = '2016-01-01T10:20:30.123Z'
+
+
+class LegacyOEntity(object):
+    '''
+    OEntity as it was before __slots__ and lazy times
+    '''
+    def __init__(self, type, id, name, parent_id, parent_name,
+                 created_time, lastmod_time, children,
+                 parent_entity):
+        self.type = type
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.parent_name = parent_name
+        self.created_time = created_time
+        self.lastmod_time = lastmod_time
+        self.children = children
+        self.parent_entity = parent_entity
+
+
+def make_parents(type, n, parents=0):
+    return [{'type': type, 'id': '%s%d' % (type[0], i),
+             'name': '%s %d' % (type, i),
+             'parent_id': 'n%d' % (i % parents) if parents else None,
+             'parent_name': 'notebook' if parents else None,
+             'created_time': TIME, 'lastmod_time': TIME,
+             'parent_entity': None, 'children': []} for i in range(n)]
+
+
+def make_pages(n):
+    return [{'type': 'page', 'id': 'p%d' % i, 'name': 'page %d' % i,
+             'parent_id': 's%d' % (i % 300), 'parent_name': 'section',
+             'created_time': TIME, 'lastmod_time': TIME,
+             'parent_entity': None, 'children': []} for i in range(n)]
+
+
+def measure(build, pages):
+    start = time.perf_counter()
+    items = [build(p) for p in pages]
+    elapsed = time.perf_counter() - start
+    del items
+
+    tracemalloc.start()
+    items = [build(p) for p in pages]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return items, elapsed, size
+
+
+def legacy(p):
+    return LegacyOEntity(p['type'], p['id'], p['name'], p['parent_id'],
+                         p['parent_name'],
+                         dateutil.parser.parse(p['created_time']),
+                         dateutil.parser.parse(p['lastmod_time']), [], None)
+
+
+def current(p):
+    return onenote.OEntity(p['type'], p['id'], p['name'], p['parent_id'],
+                           p['parent_name'], p['created_time'],
+                           p['lastmod_time'], [], None)
+
+
+def main():
+    pages = make_pages(ENTITIES)
+    print('%-20s %10s %12s %12s' % ('', 'entities', 'build, s',
+                                     'bytes/page'))
+    for title, build, n in (('legacy (dateutil)', legacy, LEGACY_ENTITIES),
+                            ('slots, lazy time', current, ENTITIES)):
+        items, elapsed, size = measure(build, pages[:n])
+        print('%-20s %10d %12.3f %12d' % (title, n, elapsed, size / n))
+
+    start = time.perf_counter()
+    for i in items:
+        i.lastmod_time
+    print('%-20s %10d %12.3f' % ('parse all times', ENTITIES,
+                                 time.perf_counter() - start))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, 'bench.save')
+        with open(json_file, 'w') as f:
+            json.dump({'notebooks': make_parents('notebook', 10),
+                       'sections': make_parents('section', 300, 10),
+                       'pages': pages}, f)
+        db_file = os.path.join(tmp, 'bench.db')
+        onote = onenote.OneNote(ses_file=os.devnull, save_file=json_file)
+        onote.load_structure()
+        onote.save_file = db_file
+        onote.save_structure()
+
+        # all entities, and notebooks only as for -n
+        for title, save_file, types in (
+                ('load_structure json', json_file, None),
+                ('load_structure db', db_file, None),
+                ('  notebooks, json', json_file, ('notebook',)),
+                ('  notebooks, db', db_file, ('notebook',))):
+            onote = onenote.OneNote(ses_file=os.devnull, save_file=save_file)
+            start = time.perf_counter()
+            onote.load_structure(types)
+            print('%-20s %10d %12.3f' % (title, len(onote.entities()),
+                                         time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+'''
+Benchmark of --tree rendering of 100k entities written to a pipe:
+print() per entity (the former onenotecli code) against
+onenotetree.render_tree.
+
+Run from the repository root:
+    python benchmarks/bench_render.py
+'''
+import contextlib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import onenote  # noqa
+import onenotetree  # noqa
+from bench_tree import make_structure  # noqa
+
+PAGES = 100000 - 1000 - 10
+SECTIONS = 1000
+NOTEBOOKS = 10
+
+
+def legacy_render(onote):
+    for i_n, n in enumerate(onote.notebooks, 1):
+        last_n = i_n == len(onote.notebooks)
+        print('%s ' % (chr(0x2514 if last_n else 0x251C) + 2 * chr(0x2500))
+              + n.name)
+        for i_s, s in enumerate(n.children, 1):
+            last_s = i_s == len(n.children)
+            preprefix = 4 * ' ' if last_n else chr(0x2502) + 3 * ' '
+            print('%s ' % (preprefix + chr(0x2514 if last_s else 0x251C) +
+                           2 * chr(0x2500)) + s.name)
+            for i_p, p in enumerate(s.children, 1):
+                isymb = chr(0x2514 if i_p == len(s.children) else 0x251C)
+                if last_n and last_s:
+                    preprefix = 8 * ' '
+                elif last_n:
+                    preprefix = 2 * ' ' + chr(0x2502) + 3 * ' '
+                elif last_s:
+                    preprefix = chr(0x2502) + 7 * ' '
+                else:
+                    preprefix = chr(0x2502) + 3 * ' ' + chr(0x2502) + 4 * ' '
+                print('%s ' % (preprefix + isymb + 2 * chr(0x2500)) + p.name)
+
+
+def drain(fd):
+    while os.read(fd, 1 << 16):
+        pass
+
+
+def timed(func):
+    '''
+    Run func(out) writing to a pipe, return seconds
+    '''
+    r, w = os.pipe()
+    reader = threading.Thread(target=drain, args=(r,))
+    reader.start()
+    out = os.fdopen(w, 'w', encoding='utf-8')
+    start = time.perf_counter()
+    func(out)
+    out.flush()
+    elapsed = time.perf_counter() - start
+    out.close()
+    reader.join()
+    os.close(r)
+    return elapsed
+
+
+def main():
+    onote = onenote.OneNote(ses_file=os.devnull, save_file=os.devnull)
+    make_structure(onote, PAGES, SECTIONS, NOTEBOOKS)
+    onote.create_tree()
+    entities = PAGES + SECTIONS + NOTEBOOKS
+
+    def legacy(out):
+        with contextlib.redirect_stdout(out):
+            legacy_render(onote)
+
+    print('%-24s %10s %14s' % ('renderer', 'ms', 'entities/s'))
+    for name, func in (
+            ('print per entity', legacy),
+            ('render_tree', lambda out: onenotetree.render_tree(out, onote)),
+            ('render_tree depth=2',
+             lambda out: onenotetree.render_tree(out, onote, depth=2))):
+        t = min(timed(func) for _ in range(3))
+        print('%-24s %10.1f %14.0f' % (name, t * 1e3, entities / t))
+
+
+if __name__ == '__main__':
+    main()
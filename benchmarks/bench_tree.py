@@ -0,0 +1,86 @@
+'''
+Benchmark of OneNote.create_tree on synthetic structures.
+
+Run from the repository root:
+    python benchmarks/bench_tree.py
+'''
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import onenote  # noqa
+
+SIZES = [1000, 10000, 100000]
+SECTIONS = 300
+NOTEBOOKS = 10
+# the nested loop is only run on sizes it finishes in reasonable time
+LEGACY_MAX = 10000
+
+
+def make_structure(onote, n_pages, n_sections=SECTIONS,
+                   n_notebooks=NOTEBOOKS):
+    now = datetime(2016, 1, 1)
+    onote.notebooks = [
+        onenote.OEntity('notebook', 'n%d' % i, 'notebook %d' % i, None,
+                        None, now, now, [], None)
+        for i in range(n_notebooks)]
+    onote.sections = [
+        onenote.OEntity('section', 's%d' % i, 'section %d' % i,
+                        'n%d' % (i % n_notebooks), None, now, now, [], None)
+        for i in range(n_sections)]
+    onote.pages = [
+        onenote.OEntity('page', 'p%d' % i, 'page %d' % i,
+                        's%d' % (i % n_sections), None, now, now, [], None)
+        for i in range(n_pages)]
+
+
+def legacy_create_tree(onote):
+    for n in onote.notebooks:
+        n.children = []
+        for s in onote.sections:
+            if s.parent_id == n.id:
+                n.children.append(s)
+                s.parent_entity = n
+
+    for n in onote.sections:
+        n.children = []
+        for s in onote.pages:
+            if s.parent_id == n.id:
+                n.children.append(s)
+                s.parent_entity = n
+
+
+def timeit(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    onote = onenote.OneNote(ses_file=os.devnull, save_file=os.devnull)
+    print('%10s %12s %14s %12s %14s' % ('pages', 'tree, ms', 'us/page',
+                                         'legacy, ms', 'by_name, us'))
+    for size in SIZES:
+        make_structure(onote, size)
+        t_tree = timeit(onote.create_tree)
+        t_lookup = timeit(lambda: [onote.by_name('page %d' % i, 'page')
+                                   for i in range(0, size, 100)])
+        if size <= LEGACY_MAX:
+            legacy = '%12.1f' % (timeit(legacy_create_tree, onote,
+                                        repeat=1) * 1e3)
+        else:
+            legacy = '%12s' % '-'
+        print('%10d %12.1f %14.3f %s %14.3f' %
+              (size, t_tree * 1e3, t_tree * 1e6 / size, legacy,
+               t_lookup * 1e6 / len(range(0, size, 100))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+'''
+Local stand-in for the OneNote API used by the benchmarks.
+
+Serves a synthetic account: paged listings of notebooks, sections and
+pages with @odata.nextLink ($top, $skip, $select, $count and
+"lastModifiedTime gt" $filter are supported), per-notebook and
+per-section listings, page content and page creation. Latency and
+throttling (429 with Retry-After) can be injected.
+
+    with FakeOneNoteServer(Account(pages=10000), latency=0.02) as server:
+        o = onenote.OneNote(base_url=server.base_url, ...)
+'''
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+API_PATH = '/api/v1.0/me/notes/'
+# page size of the listings when $top isn't given (OneNote default)
+DEFAULT_TOP = 20
+MAX_TOP = 100
+# collection of the parents in per-parent listings
+ENTITY_PARENT = {'sections': 'notebooks', 'pages': 'sections'}
+
+# fields returned by OneNote in addition to the ones used by the client
+EXTRA_FIELDS = {
+    'self': 'https://www.onenote.com/api/v1.0/me/notes/%s',
+    'isDefault': False,
+    'userRole': 'Owner',
+    'isShared': False,
+    'createdBy': 'Benchmark User',
+    'lastModifiedBy': 'Benchmark User',
+    'links': {'oneNoteClientUrl': {'href': 'onenote:https://example.com/'},
+              'oneNoteWebUrl': {'href': 'https://example.com/'}},
+}
+
+PARAGRAPH = ('<p>Lorem ipsum dolor sit amet, <b>consectetur</b> adipiscing '
+             'elit, sed do eiusmod tempor incididunt ut labore.</p>\n')
+TABLE_ROW = '<tr><td>cell %d</td><td>%d</td><td>value</td></tr>\n'
+
+
+def iso(t):
+    return t.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class Account(object):
+    '''
+    Synthetic account: notebooks, sections spread over the notebooks
+    and pages spread over the sections. content_size is the approximate
+    size of each page content in bytes.
+    '''
+
+    def __init__(self, notebooks=10, sections=300, pages=10000,
+                 content_size=8 * 1024, seed=0):
+        rnd = random.Random(seed)
+        start = datetime(2016, 1, 1)
+
+        def times():
+            created = start + timedelta(seconds=rnd.randrange(10 ** 7))
+            modified = created + timedelta(seconds=rnd.randrange(10 ** 7))
+            return iso(created), iso(modified)
+
+        self.notebooks = []
+        for i in range(notebooks):
+            created, modified = times()
+            self.notebooks.append({
+                'id': '0-N%08d!1' % i, 'name': 'notebook %d' % i,
+                'createdTime': created, 'lastModifiedTime': modified})
+
+        self.sections = []
+        for i in range(sections):
+            notebook = self.notebooks[i % notebooks]
+            created, modified = times()
+            self.sections.append({
+                'id': '0-S%08d!1' % i, 'name': 'section %d' % i,
+                'createdTime': created, 'lastModifiedTime': modified,
+                'parentNotebook': {'id': notebook['id'],
+                                   'name': notebook['name']}})
+
+        self.pages = []
+        for i in range(pages):
+            section = self.sections[i % sections]
+            created, modified = times()
+            self.pages.append({
+                'id': '0-P%08d!1' % i, 'title': 'page %d' % i,
+                'createdTime': created, 'lastModifiedTime': modified,
+                'parentSection': {'id': section['id'],
+                                  'name': section['name']}})
+
+        self.content_size = content_size
+        self.by_id = {e['id']: e for e in
+                      self.notebooks + self.sections + self.pages}
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def entities(self, kind, parent_id=None):
+        '''
+        Entities of the listing ('notebooks', 'sections' or 'pages'),
+        children of parent_id if given
+        '''
+        items = getattr(self, kind)
+        if parent_id is None:
+            return items
+        parent = 'parentNotebook' if kind == 'sections' else 'parentSection'
+        return [e for e in items if e[parent]['id'] == parent_id]
+
+    def content(self, page):
+        '''
+        Page HTML: paragraphs and a table, about content_size bytes
+        '''
+        parts = ['<html><head><title>%s</title></head><body>\n' %
+                 page['title']]
+        size = len(parts[0])
+        i = 0
+        while size < self.content_size:
+            part = PARAGRAPH if i % 4 else \
+                '<table>\n' + ''.join(TABLE_ROW % (j, j) for j in range(5)) \
+                + '</table>\n'
+            parts.append(part)
+            size += len(part)
+            i += 1
+        parts.append('</body></html>')
+        return ''.join(parts)
+
+    def create_page(self, section_id, body):
+        with self.lock:
+            self.created += 1
+            n = self.created
+        section = self.by_id[section_id]
+        now = iso(datetime.utcnow())
+        return {'id': '0-C%08d!1' % n, 'title': 'created %d' % n,
+                'createdTime': now, 'lastModifiedTime': now,
+                'parentSection': {'id': section['id'],
+                                  'name': section['name']}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        server.count(method)
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.should_throttle():
+            return self.reply(429, {'error': {'code': '20166'}},
+                              {'Retry-After': '0'})
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self.reply(401, {'error': {'code': '40001'}})
+
+        url = urlsplit(self.path)
+        if not url.path.startswith(API_PATH):
+            return self.reply(404, {})
+        parts = url.path[len(API_PATH):].strip('/').split('/')
+        query = dict(parse_qsl(url.query))
+
+        if method == 'POST':
+            if len(parts) == 3 and parts[0] == 'sections' and \
+                    parts[2] == 'pages' and parts[1] in server.account.by_id:
+                return self.reply(201, server.account.create_page(parts[1],
+                                                                  body))
+            return self.reply(404, {})
+
+        if len(parts) == 1 and parts[0] in ('notebooks', 'sections',
+                                            'pages'):
+            return self.listing(parts[0], None, query)
+        if len(parts) == 3 and parts[1] in server.account.by_id:
+            if parts[0] == 'pages' and parts[2] == 'content':
+                page = server.account.by_id[parts[1]]
+                return self.reply(200, server.account.content(page),
+                                  content_type='text/html')
+            if (parts[0], parts[2]) in (('notebooks', 'sections'),
+                                        ('sections', 'pages')):
+                return self.listing(parts[2], parts[1], query)
+        return self.reply(404, {})
+
+    def listing(self, kind, parent_id, query):
+        items = self.server.account.entities(kind, parent_id)
+        flt = query.get('$filter', '')
+        if flt.startswith('lastModifiedTime gt '):
+            since = flt[len('lastModifiedTime gt '):].strip("'")
+            items = [e for e in items if e['lastModifiedTime'] > since]
+
+        top = min(int(query.get('$top', DEFAULT_TOP)), MAX_TOP)
+        skip = int(query.get('$skip', 0))
+        page = items[skip:skip + top]
+        select = query.get('$select')
+        if select:
+            fields = select.split(',')
+            value = [{k: e[k] for k in fields if k in e} for e in page]
+        else:
+            value = [dict(e, **EXTRA_FIELDS) for e in page]
+            for e in value:
+                e['self'] = e['self'] % e['id']
+
+        result = {'@odata.context': 'https://www.onenote.com/api/v1.0/'
+                                    '$metadata#me/notes/' + kind}
+        if query.get('$count') == 'true':
+            result['@odata.count'] = len(items)
+        result['value'] = value
+        if skip + top < len(items):
+            next_query = dict(query, **{'$skip': str(skip + top),
+                                        '$top': str(top)})
+            result['@odata.nextLink'] = '%s%s?%s' % (
+                self.server.base_url,
+                '/'.join(([ENTITY_PARENT[kind], parent_id]
+                          if parent_id else []) + [kind]),
+                urlencode(next_query, safe='$,'))
+        self.reply(200, result)
+
+    def reply(self, status, data, headers=None, content_type=None):
+        if isinstance(data, str):
+            body = data.encode('utf-8')
+        else:
+            body = json.dumps(data).encode('utf-8')
+            content_type = 'application/json'
+        self.server.count_bytes(len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOneNoteServer(ThreadingHTTPServer):
+    '''
+    Threaded HTTP server serving the account on 127.0.0.1.
+    latency - seconds added to each response
+    throttle - fraction of requests answered with 429
+    '''
+    daemon_threads = True
+
+    def __init__(self, account, latency=0.0, throttle=0.0, seed=0):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.account = account
+        self.latency = latency
+        self.throttle = throttle
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.bytes_sent = 0
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d%s' % (self.server_port, API_PATH)
+
+    def count(self, method):
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def count_bytes(self, n):
+        with self.lock:
+            self.bytes_sent += n
+
+    def should_throttle(self):
+        if not self.throttle:
+            return False
+        with self.lock:
+            return self.random.random() < self.throttle
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = {}
+            self.bytes_sent = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
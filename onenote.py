@@ -1,16 +1,40 @@
-import requests
-import dateutil.parser
 import logging
 import json
 import os
-import stat
+import re
 import datetime
-from html2text import html2text
+import time
+from urllib.parse import quote
 from onenoteauth import OneNoteAuth
+from onenotestream import ListingDecoder
+import onenotestore
+import onenoteconvert
+import onenoteexport
+import onenoteimport
+from onenotethrottle import RequestScheduler
+from onenotecontent import ContentCache, CACHE_SIZE_DEFAULT
+import onenoteprefetch
+from onenotestats import RequestInfo, endpoint_label
 
 
 BASE_URL = 'https://www.onenote.com/api/v1.0/me/notes/'
-SAVE_FILE_DEFAULT = '.onenote.save'
+SAVE_FILE_DEFAULT = '.onenote.db'
+LEGACY_SAVE_FILE = '.onenote.save'
+STREAM_CHUNK_SIZE = 64 * 1024
+
+ENTITY_URLS = {'notebook': 'notebooks',
+               'section': 'sections',
+               'page': 'pages'}
+
+# type of children of notebooks and sections
+CHILD_TYPES = {'notebook': 'section',
+               'section': 'page'}
+
+# fields used by entity_from_json
+ENTITY_FIELDS = {
+    'notebook': 'id,name,createdTime,lastModifiedTime',
+    'section': 'id,name,createdTime,lastModifiedTime,parentNotebook',
+    'page': 'id,title,createdTime,lastModifiedTime,parentSection'}
 
 PAGE_TEMPLATE = """<!DOCTYPE html>\
 <html>
@@ -23,7 +47,43 @@ PAGE_TEMPLATE = """<!DOCTYPE html>\
 """
 
 
+ISO_TIME_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)'
+                         r'(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:?\d\d)?$')
+
+
+def parse_time(value):
+    '''
+    Parse time in the fixed ISO 8601 format used by OneNote API
+    (e.g. 2016-01-01T10:20:30.1234567Z). Other formats are passed
+    to dateutil.
+    '''
+    m = ISO_TIME_RE.match(value)
+    if not m:
+        import dateutil.parser
+        return dateutil.parser.parse(value)
+
+    year, month, day, hour, minute, second, frac, tz = m.groups()
+    if tz is None:
+        tzinfo = None
+    elif tz == 'Z':
+        tzinfo = datetime.timezone.utc
+    else:
+        offset = datetime.timedelta(hours=int(tz[1:3]), minutes=int(tz[-2:]))
+        tzinfo = datetime.timezone(-offset if tz[0] == '-' else offset)
+    return datetime.datetime(int(year), int(month), int(day), int(hour),
+                             int(minute), int(second),
+                             int(frac.ljust(6, '0')) if frac else 0, tzinfo)
+
+
 class OEntity(object):
+    '''
+    Notebook, section or page.
+    Times are kept as ISO strings and parsed on first access.
+    Children of a lazy entity are loaded on first access.
+    '''
+    __slots__ = ('type', 'id', 'name', 'parent_id', 'parent_name',
+                 '_created_time', '_lastmod_time', '_children', '_loader',
+                 'parent_entity')
 
     def __init__(self, type, id, name, parent_id, parent_name,
                  created_time, lastmod_time, children,
@@ -33,11 +93,64 @@ class OEntity(object):
         self.name = name
         self.parent_id = parent_id
         self.parent_name = parent_name
-        self.created_time = created_time
-        self.lastmod_time = lastmod_time
-        self.children = children
+        self._created_time = created_time
+        self._lastmod_time = lastmod_time
+        self._children = children
+        self._loader = None
         self.parent_entity = parent_entity
 
+    @property
+    def children(self):
+        if self._children is None:
+            # the loader sets _children unless the request fails
+            return self._loader(self) if self._loader is not None else []
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        self._children = value
+
+    @property
+    def loaded(self):
+        '''
+        False if children are still to be loaded
+        '''
+        return self._children is not None
+
+    def set_lazy(self, loader):
+        '''
+        Get children with loader(entity) on first access
+        '''
+        self._children = None
+        self._loader = loader
+
+    @property
+    def created_time(self):
+        if isinstance(self._created_time, str):
+            self._created_time = parse_time(self._created_time)
+        return self._created_time
+
+    @created_time.setter
+    def created_time(self, value):
+        self._created_time = value
+
+    @property
+    def lastmod_time(self):
+        if isinstance(self._lastmod_time, str):
+            self._lastmod_time = parse_time(self._lastmod_time)
+        return self._lastmod_time
+
+    @lastmod_time.setter
+    def lastmod_time(self, value):
+        self._lastmod_time = value
+
+    @property
+    def lastmod_iso(self):
+        '''
+        lastmod_time as ISO string, without parsing it
+        '''
+        return isotime(self._lastmod_time)
+
     def __repr__(self):
         return self.name
 
@@ -47,48 +160,180 @@ class OEntity(object):
                 'name': self.name,
                 'parent_id': self.parent_id,
                 'parent_name': self.parent_name,
-                'created_time': self.created_time.isoformat(),
-                'lastmod_time': self.lastmod_time.isoformat(),
+                'created_time': isotime(self._created_time),
+                'lastmod_time': isotime(self._lastmod_time),
                 'parent_entity': self.parent_entity.id if
                 self.parent_entity is not None else None,
                 'children': []}
 
 
+def entity_from_json(type, entity):
+    '''
+    Create OEntity from an item of OneNote API listing
+    '''
+    if type == 'notebook':
+        name = entity['name']
+        parent = {'id': None, 'name': None}
+    elif type == 'section':
+        name = entity['name']
+        parent = entity['parentNotebook']
+    else:
+        name = entity['title']
+        parent = entity['parentSection']
+
+    return OEntity(type=type,
+                   id=entity['id'],
+                   name=name,
+                   parent_id=parent['id'],
+                   parent_name=parent['name'],
+                   created_time=entity['createdTime'],
+                   lastmod_time=entity['lastModifiedTime'],
+                   children=[],
+                   parent_entity=None)
+
+
+def entities_from_values(type, values):
+    '''
+    OEntity list from entity lists of listing responses.
+    $skip pages overlap if entities are added during the listing,
+    repeated entities are dropped.
+    '''
+    entities = []
+    seen = set()
+    for value in values:
+        for entity in value:
+            if entity['id'] not in seen:
+                seen.add(entity['id'])
+                entities.append(entity_from_json(type, entity))
+    return entities
+
+
+def merge_entities(items, modified, ids):
+    '''
+    Replace items by their modified versions, append new ones
+    and drop items that are neither in ids nor modified
+    '''
+    modified = {i.id: i for i in modified}
+    merged = [modified.pop(i.id, i) for i in items
+              if i.id in ids or i.id in modified]
+    merged.extend(modified.values())
+    return merged
+
+
+def odata_time(value):
+    '''
+    Format time for OData $filter (UTC, milliseconds)
+    '''
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def entity_row(entity):
+    '''
+    Tuple of entity fields as stored in the structure cache
+    '''
+    return (entity.type, entity.id, entity.name, entity.parent_id,
+            entity.parent_name, isotime(entity._created_time),
+            isotime(entity._lastmod_time))
+
+
+def is_json_file(path):
+    return os.path.splitext(path)[1] in ('.json', '.save')
+
+
+def isotime(value):
+    '''
+    ISO string for a time that may still be unparsed
+    '''
+    return value if isinstance(value, str) else value.isoformat()
+
+
 class OneNote(OneNoteAuth):
-    def __init__(self, save_file=SAVE_FILE_DEFAULT, *args, **kwargs):
+    def __init__(self, save_file=SAVE_FILE_DEFAULT, *args,
+                 workers=1, select=True, page_size=None,
+                 cache_dir=None, cache_size=CACHE_SIZE_DEFAULT,
+                 scheduler=None, base_url=BASE_URL, **kwargs):
         OneNoteAuth.__init__(self, *args, **kwargs)
         self.notebooks = []
         self.sections = []
         self.pages = []
+        self.ids = None
+        self.names = None
+        # the structure has only the loaded parts of the lazy tree
+        self.partial = False
+        # id -> (lastmod_time, children) of notebooks and sections
+        self.subtrees = {}
         self.save_file = save_file
+        self.base_url = base_url
+        self.workers = workers
+        self.select = select
+        self.page_size = page_size
+        self.scheduler = scheduler if scheduler is not None \
+            else RequestScheduler()
+        if cache_dir is not None:
+            self.content_cache = ContentCache(cache_dir, cache_size)
+        else:
+            self.content_cache = None
+        self.prefetcher = None
 
-    def onenote_request(self, url, post=False, body=''):
+    def send(self, url, post=False, body='', stream=False, headers=None):
+        '''
+        Send authorized request, retry once with a new token on 401.
+        Throttled requests are retried by the scheduler.
+        headers - additional request headers.
+        stream - don't read the body; the caller reports reading it to
+        r.request_info and passes it to emit_request() when done.
+        Returns requests.Response or None if there is no token.
+        '''
         logging.info('onenote_request: url=%s' % url)
         token = self.get_token()
         if not token:
             logging.warn('get_token failed')
             return None
 
+        headers = dict(headers or {})
         if post:
-            headers = {'Authorization': 'Bearer %s' % self.get_token(),
-                       'Content-Type': 'application/xhtml+xml'}
-        else:
-            headers = {'Authorization': 'Bearer %s' % self.get_token()}
+            headers['Content-Type'] = 'application/xhtml+xml'
+            body = body.encode('utf-8')
 
-        logging.info('onenote_request: headers=%s' % headers)
-        if post:
-            r = requests.post(url, headers=headers, data=body.encode('utf-8'))
-        else:
-            r = requests.get(url, headers=headers)
-        if r.status_code == 401:
-            self.handle_401()
-            headers = {'Authorization': 'Bearer %s' % self.get_token()}
+        method = 'POST' if post else 'GET'
+        info = RequestInfo(endpoint_label(method, url, self.base_url),
+                           method, url)
+
+        def request():
             if post:
-                r = requests.post(url, headers=headers,
-                                  data=body.encode('utf-8'))
-            else:
-                r = requests.get(url, headers=headers)
+                return info.measure(lambda: self.session.post(
+                    url, headers=headers, data=body), body)
+            return info.measure(lambda: self.session.get(
+                url, headers=headers, stream=stream), stream=stream)
+
+        try:
+            for attempt in range(2):
+                headers['Authorization'] = 'Bearer %s' % token
+                r = self.scheduler.run(request, idempotent=not post)
+                if r.status_code != 401 or attempt:
+                    break
+                r.close()
+                token = self.handle_401(token)
+                if not token:
+                    break
+        except Exception:
+            self.emit_request(info)
+            raise
+
+        if stream:
+            r.request_info = info
+        else:
+            self.emit_request(info)
         logging.info('response=%s' % r)
+        return r
+
+    def onenote_request(self, url, post=False, body=''):
+        r = self.send(url, post=post, body=body)
+        if r is None:
+            return None
+
         try:
             data = r.json()
         except ValueError:
@@ -98,231 +343,616 @@ class OneNote(OneNoteAuth):
 
     def get_url(self, url):
         logging.info("get url")
-        url = BASE_URL + url
+        url = self.base_url + url
         status_code, text = self.onenote_request(url)
         return status_code, text
 
-    def get_notebooks(self):
-        logging.info("get notebooks")
-        self.notebooks = []
-        url = BASE_URL + 'notebooks'
+    def listing_url(self, type, parent=None, **query):
+        '''
+        URL of the listing of notebooks, sections or pages, or of the
+        children of the parent entity.
+        query - OData options without '$' (e.g. filter='...').
+        $select and $top are added according to select and page_size.
+        '''
+        if self.select and 'select' not in query:
+            query['select'] = ENTITY_FIELDS[type]
+        if self.page_size and 'top' not in query:
+            query['top'] = self.page_size
+        url = self.base_url + ENTITY_URLS[type]
+        if parent is not None:
+            url = '%s%s/%s/%s' % (self.base_url, ENTITY_URLS[parent.type],
+                                  parent.id, ENTITY_URLS[type])
+        if query:
+            url += '?' + '&'.join('$%s=%s' % (k, quote(str(v), safe=','))
+                                  for k, v in query.items())
+        return url
+
+    def list_values(self, type, **query):
+        '''
+        Get the entity lists ('value') of all listing responses.
+        With workers > 1 the first response also gives the total count
+        ($count=true) and the remaining pages are requested in parallel
+        by $skip. Returns status code and list of lists of JSON entities.
+        '''
+        parallel = self.workers > 1 and 'skip' not in query
+        first = dict(query, count='true') if parallel else query
+        status_code, text = self.onenote_request(
+            self.listing_url(type, **first))
+        logging.debug("list_values: response=%s" % text)
+        if status_code != 200:
+            return status_code, []
+
+        values = [text['value']]
+        url = text.get('@odata.nextLink')
+        total = text.get('@odata.count')
+        size = len(text['value'])
+        if parallel and url and total is not None and size:
+            urls = [self.listing_url(type, **dict(query, skip=skip, top=size))
+                    for skip in range(size, total, size)]
+            # none if the count isn't above the first page,
+            # the nextLink of the first page is followed then
+            if urls:
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(min(self.workers, len(urls))) as pool:
+                    for status_code, text in pool.map(self.onenote_request,
+                                                      urls):
+                        if status_code != 200:
+                            return status_code, values
+                        values.append(text['value'])
+                # entities added after the count are on the following pages
+                url = text.get('@odata.nextLink')
+
         while url:
             status_code, text = self.onenote_request(url)
-            logging.info("get_notebooks: response=%s" % text)
-            if status_code == 200:
-                for i in range(len(text['value'])):
-                    entity = text['value'][i]
-                    oe = OEntity(
-                        type='notebook',
-                        id=entity['id'],
-                        name=entity['name'],
-                        parent_id=None,
-                        parent_name=None,
-                        created_time=dateutil.parser.parse(entity['createdTime']),  # noqa
-                        lastmod_time=dateutil.parser.parse(entity['lastModifiedTime']),  # noqa
-                        children=[],
-                        parent_entity=None
-                        )
-                    self.notebooks.append(oe)
-
-            if '@odata.nextLink' in text:
-                url = text['@odata.nextLink']
-            else:
-                url = None
+            logging.debug("list_values: response=%s" % text)
+            if status_code != 200:
+                break
+            values.append(text['value'])
+            url = text.get('@odata.nextLink')
 
+        return status_code, values
+
+    def list_entities(self, type, **query):
+        '''
+        Get all entities of the type following @odata.nextLink
+        (see list_values). Returns status code and list of OEntity.
+        '''
+        status_code, values = self.list_values(type, **query)
+        return status_code, entities_from_values(type, values)
+
+    def list_ids(self, type):
+        '''
+        Get set of ids of all entities of the type
+        '''
+        status_code, values = self.list_values(type, select='id')
+        return status_code, set(entity['id'] for value in values
+                                for entity in value)
+
+    def iter_entities(self, type, **query):
+        '''
+        Yield entities of the type as they are decoded from the listing
+        responses. The generator returns status code of the last request.
+        '''
+        url = self.listing_url(type, **query)
+        while url:
+            r = self.send(url, stream=True)
+            if r is None:
+                return None
+            if r.status_code != 200:
+                logging.warning('iter_entities: status_code=%d' %
+                                r.status_code)
+                self.emit_request(r.request_info)
+                r.close()
+                return r.status_code
+
+            info = r.request_info
+            decoder = ListingDecoder()
+            try:
+                with r:
+                    chunks = iter(r.iter_content(
+                        chunk_size=STREAM_CHUNK_SIZE))
+                    while True:
+                        start = time.perf_counter()
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            break
+                        info.add_download(time.perf_counter() - start,
+                                          len(chunk))
+                        for entity in decoder.feed(chunk):
+                            yield entity_from_json(type, entity)
+            finally:
+                self.emit_request(info)
+            for entity in decoder.close():
+                yield entity_from_json(type, entity)
+
+            url = decoder.fields.get('@odata.nextLink')
+
+        return 200
+
+    def iter_notebooks(self, **query):
+        return self.iter_entities('notebook', **query)
+
+    def iter_sections(self, **query):
+        return self.iter_entities('section', **query)
+
+    def iter_pages(self, **query):
+        return self.iter_entities('page', **query)
+
+    def get_notebooks(self):
+        logging.info("get notebooks")
+        self.ids = self.names = None
+        status_code, self.notebooks = self.list_entities('notebook')
         return status_code
 
     def get_sections(self):
         logging.info("get sections")
-        self.sections = []
-        url = BASE_URL + 'sections'
-        while url:
-            status_code, text = self.onenote_request(url)
-            logging.info("get_sections: response=%s" % text)
-            if status_code == 200:
-                for i in range(len(text['value'])):
-                    entity = text['value'][i]
-                    oe = OEntity(
-                        type='section',
-                        id=entity['id'],
-                        name=entity['name'],
-                        parent_id=entity['parentNotebook']['id'],
-                        parent_name=entity['parentNotebook']['name'],
-                        created_time=dateutil.parser.parse(entity['createdTime']),  # noqa
-                        lastmod_time=dateutil.parser.parse(entity['lastModifiedTime']),  # noqa
-                        children=[],
-                        parent_entity=None
-                        )
-                    self.sections.append(oe)
-
-            if '@odata.nextLink' in text:
-                url = text['@odata.nextLink']
-            else:
-                url = None
-
+        self.ids = self.names = None
+        status_code, self.sections = self.list_entities('section')
         return status_code
 
     def get_pages(self):
         logging.info("get pages")
-        self.pages = []
-        url = BASE_URL + 'pages'
-        while url:
-            status_code, text = self.onenote_request(url)
-            logging.info("get_pages", text)
-            logging.info("get_pages: response=%s" % text)
-            if status_code == 200:
-                for i in range(len(text['value'])):
-                    entity = text['value'][i]
-                    logging.info("entity %s" % entity)
-                    oe = OEntity(
-                        type='page',
-                        id=entity['id'],
-                        name=entity['title'],
-                        parent_id=entity['parentSection']['id'],
-                        parent_name=entity['parentSection']['name'],
-                        created_time=dateutil.parser.parse(entity['createdTime']),  # noqa
-                        lastmod_time=dateutil.parser.parse(entity['lastModifiedTime']),  # noqa
-                        children=[],
-                        parent_entity=None
-                        )
-                    self.pages.append(oe)
-
-            if '@odata.nextLink' in text:
-                url = text['@odata.nextLink']
-            else:
-                url = None
-
+        self.ids = self.names = None
+        status_code, self.pages = self.list_entities('page')
         return status_code
 
+    def sync_structure(self):
+        '''
+        Update the loaded structure incrementally: get only entities
+        modified since the last sync and drop the deleted ones.
+        Returns status code of the first failed request or 200.
+        '''
+        logging.info("sync structure")
+        if self.partial:
+            # entities of the lazy tree that aren't loaded would be dropped
+            self.get_structure()
+            return 200
+        updates = {}
+        for type, attr in (('notebook', 'notebooks'),
+                           ('section', 'sections'),
+                           ('page', 'pages')):
+            # ids go first: entities created after the id listing
+            # are still picked up by the modified listing
+            status_code, ids = self.list_ids(type)
+            if status_code != 200:
+                return status_code
+
+            items = getattr(self, attr)
+            if items:
+                since = max(i.lastmod_time for i in items)
+                status_code, modified = self.list_entities(
+                    type, filter='lastModifiedTime gt %s' % odata_time(since))
+            else:
+                status_code, modified = self.list_entities(type)
+            if status_code != 200:
+                return status_code
+            updates[attr] = (modified, ids)
+
+        for attr, (modified, ids) in updates.items():
+            setattr(self, attr, merge_entities(getattr(self, attr),
+                                               modified, ids))
+        self.create_tree()
+        self.save_structure()
+        return 200
+
     def create_tree(self):
-        # for each notebook create list of sections
-        for n in self.notebooks:
-            n.children = []
-            for s in self.sections:
-                if s.parent_id == n.id:
-                    n.children.append(s)
-                    s.parent_entity = n
-
-        # for each section create list of pages
-        for n in self.sections:
-            n.children = []
-            for s in self.pages:
-                if s.parent_id == n.id:
-                    n.children.append(s)
-                    s.parent_entity = n
-
-    def get_structure(self):
-        self.get_notebooks()
-        self.get_sections()
-        self.get_pages()
+        '''
+        Link sections to notebooks and pages to sections
+        and build the id/name indexes
+        '''
+        self.create_index()
+        for parents, children in ((self.notebooks, self.sections),
+                                  (self.sections, self.pages)):
+            by_parent = {}
+            for c in children:
+                by_parent.setdefault(c.parent_id, []).append(c)
+
+            for p in parents:
+                p.children = by_parent.get(p.id, [])
+                for c in p.children:
+                    c.parent_entity = p
+
+    def create_index(self):
+        '''
+        Build dicts of id -> entity and name -> entities for each type
+        '''
+        self.ids = {}
+        self.names = {}
+        for type, items in (('notebook', self.notebooks),
+                            ('section', self.sections),
+                            ('page', self.pages)):
+            ids = self.ids[type] = {}
+            names = self.names[type] = {}
+            for i in items:
+                ids[i.id] = i
+                names.setdefault(i.name, []).append(i)
+
+    def by_id(self, id, type=None):
+        '''
+        Get entity by id. Returns None if it isn't found.
+        '''
+        if self.ids is None:
+            self.create_index()
+        if type is not None:
+            return self.ids[type].get(id)
+        for ids in self.ids.values():
+            if id in ids:
+                return ids[id]
+
+    def by_name(self, name, type=None):
+        '''
+        Get list of entities with the given name
+        '''
+        if self.names is None:
+            self.create_index()
+        if type is not None:
+            return list(self.names[type].get(name, []))
+        items = []
+        for names in self.names.values():
+            items.extend(names.get(name, []))
+        return items
+
+    def get_structure(self, workers=None, lazy=False):
+        '''
+        Get notebooks, sections and pages and build the tree.
+        With workers > 1 the three listings are fetched concurrently.
+        lazy - get only notebooks, see get_lazy_structure.
+        '''
+        if lazy:
+            return self.get_lazy_structure()
+        if workers is None:
+            workers = self.workers
+
+        if workers > 1:
+            # get the token once so that listings don't authorize in parallel
+            if not self.get_token():
+                logging.warning('get_structure: get_token failed')
+                return
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(workers, 3)) as pool:
+                futures = [pool.submit(self.get_notebooks),
+                           pool.submit(self.get_sections),
+                           pool.submit(self.get_pages)]
+                for f in futures:
+                    f.result()
+        else:
+            self.get_notebooks()
+            self.get_sections()
+            self.get_pages()
+        self.partial = False
+        self.subtrees = {}
         self.create_tree()
         self.save_structure()
 
+    def get_lazy_structure(self):
+        '''
+        Get notebooks only. Sections of a notebook and pages of a section
+        are requested when its children are accessed first, and only
+        these are in sections and pages. Children of the structure loaded
+        before are reused while lastmod_time of their parent is unchanged.
+        The partial structure isn't saved.
+        Returns status code of the notebooks listing.
+        '''
+        subtrees = self.loaded_subtrees()
+        status_code = self.get_notebooks()
+        if status_code == 200:
+            self.set_lazy_tree(subtrees, self.load_children)
+        return status_code
+
+    def loaded_subtrees(self):
+        return {p.id: (p.lastmod_time, p._children)
+                for p in self.notebooks + self.sections if p.loaded}
+
+    def set_lazy_tree(self, subtrees, loader=None):
+        '''
+        Make the fetched notebooks lazy, subtrees - cached children.
+        loader - loader of children, None to load them explicitly.
+        '''
+        self.subtrees = subtrees
+        self.sections = []
+        self.pages = []
+        for n in self.notebooks:
+            n.set_lazy(loader)
+        self.partial = True
+        self.create_index()
+
+    def cached_children(self, entity):
+        '''
+        Children cached while lastmod_time of the entity is unchanged
+        '''
+        cached = self.subtrees.get(entity.id)
+        if cached is not None and cached[0] == entity.lastmod_time:
+            return cached[1]
+        return None
+
+    def attach_children(self, entity, children, loader=None):
+        '''
+        Link loaded children to the entity and add them to the structure
+        '''
+        type = CHILD_TYPES[entity.type]
+        self.subtrees[entity.id] = (entity.lastmod_time, children)
+        for c in children:
+            c.parent_entity = entity
+            if type == 'section':
+                c.set_lazy(loader)
+        entity.children = children
+        self.add_entities(type, children)
+        return children
+
+    def load_children(self, entity):
+        '''
+        Get sections of the notebook or pages of the section and add
+        them to the structure. Returns the children, an empty list
+        if the request fails.
+        '''
+        children = self.cached_children(entity)
+        if children is None:
+            logging.info('load children of %s' % entity.id)
+            status_code, children = self.list_entities(
+                CHILD_TYPES[entity.type], parent=entity)
+            if status_code != 200:
+                logging.warning('load_children: status_code=%s' %
+                                status_code)
+                return []
+        return self.attach_children(entity, children, self.load_children)
+
+    def add_entities(self, type, items):
+        '''
+        Add entities to the structure and the id/name indexes
+        '''
+        getattr(self, ENTITY_URLS[type]).extend(items)
+        if self.ids is not None:
+            ids = self.ids[type]
+            names = self.names[type]
+            for i in items:
+                ids[i.id] = i
+                names.setdefault(i.name, []).append(i)
+
     def get_item(self, items, attr, value):
+        for type, coll in (('notebook', self.notebooks),
+                           ('section', self.sections),
+                           ('page', self.pages)):
+            if items is coll:
+                if attr == 'name':
+                    return self.by_name(value, type)
+                if attr == 'id':
+                    item = self.by_id(value, type)
+                    return [item] if item is not None else []
         return [i for i in items if getattr(i, attr) == value]
 
     def get_page_content(self, page):
         '''
-        Get page content in HTML
+        Get page content in HTML.
+        With content cache unchanged pages are served locally.
+        With prefetching the pages predicted to be read next are
+        downloaded to the cache in background.
+        '''
+        prefetcher = self.prefetcher
+        if prefetcher is None:
+            return self.fetch_page_content(page)
+        prefetcher.before_read(page)
+        text = self.fetch_page_content(page)
+        prefetcher.after_read(page)
+        return text
+
+    def fetch_page_content(self, page):
+        '''
+        Get page content in HTML without prefetching
         '''
         logging.info("get page content")
-        url = BASE_URL + 'pages/' + page.id + '/content'
-        status_code, text = self.onenote_request(url)
-        if status_code == 200:
-            return text
+        cache = self.content_cache
+        if cache is not None:
+            text = cache.get(page)
+            if text is not None:
+                return text
+
+        url = self.base_url + 'pages/' + page.id + '/content'
+        headers = {}
+        etag = cache.etag(page.id) if cache is not None else None
+        if etag:
+            headers['If-None-Match'] = etag
+        r = self.send(url, headers=headers)
+        if r is None:
+            return None
+
+        if r.status_code == 304:
+            return cache.revalidate(page)
+        if r.status_code == 200:
+            if cache is not None:
+                cache.put(page, r.text, r.headers.get('ETag'))
+            return r.text
+
+    def start_prefetch(self, mode='siblings',
+                       count=onenoteprefetch.PREFETCH_COUNT,
+                       workers=onenoteprefetch.PREFETCH_WORKERS,
+                       queue_size=onenoteprefetch.PREFETCH_QUEUE_SIZE):
+        '''
+        Prefetch content of pages following the page read in its section
+        (mode 'siblings') or of the most recently modified pages
+        ('recent'), see onenoteprefetch.Prefetcher.
+        Needs the content cache. Returns the prefetcher.
+        '''
+        if self.content_cache is None:
+            raise ValueError('prefetching needs the content cache')
+        self.stop_prefetch()
+        self.prefetcher = onenoteprefetch.Prefetcher(self, mode, count,
+                                                     workers, queue_size)
+        return self.prefetcher
+
+    def stop_prefetch(self):
+        '''
+        Cancel prefetching. Returns its stats or None if it isn't on.
+        '''
+        prefetcher, self.prefetcher = self.prefetcher, None
+        if prefetcher is None:
+            return None
+        return prefetcher.close()
 
     def get_page_content_md(self, page):
         '''
         Get page content in Markdown
         '''
-        logging.info("get page content")
-        url = BASE_URL + 'pages/' + page.id + '/content'
-        status_code, text = self.onenote_request(url)
-        if status_code == 200:
-            return html2text(text)
+        text = self.get_page_content(page)
+        if text is not None:
+            return onenoteconvert.html_to_md(text)
 
-    def save_structure(self):
-        with open(self.save_file, 'w') as f:
-            data = {'notebooks': [i.decode() for i in self.notebooks],
-                    'sections': [i.decode() for i in self.sections],
-                    'pages': [i.decode() for i in self.pages]}
+    def iter_pages_md(self, pages, workers=onenoteconvert.CONVERT_WORKERS,
+                      processes=None):
+        '''
+        Download pages in parallel and convert them to Markdown in a
+        process pool (threads if processes is 0) while the next pages
+        are being downloaded. Yields (page, Markdown or None,
+        conversion seconds) in completion order.
+        '''
+        return onenoteconvert.convert_pages(self, pages, workers, processes)
 
-            json.dump(data, f)
-            os.chmod(self.ses_file, stat.S_IRUSR | stat.S_IWUSR)
+    def export(self, directory, notebook=None, section=None, fmt='md',
+               workers=onenoteexport.EXPORT_WORKERS, processes=None):
+        '''
+        Export pages of the notebook/section (all pages by default)
+        to a directory tree in Markdown ('md') or HTML ('html').
+        Returns export statistics (see onenoteexport.Exporter.run).
+        '''
+        exporter = onenoteexport.Exporter(self, directory, fmt=fmt,
+                                          workers=workers,
+                                          processes=processes)
+        return exporter.run(self.select_pages(notebook, section))
 
-    def load_structure(self):
-        data = None
-        try:
-            with open(self.save_file, 'r') as f:
-                data = json.load(f)
-        except:
-            logging.warning("%s file is missign or hasn't JSON format" %
+    def select_pages(self, notebook=None, section=None):
+        '''
+        Pages of the notebook and/or section given by name
+        '''
+        pages = self.pages
+        if notebook is not None:
+            pages = [p for p in pages if p.parent_entity is not None and
+                     p.parent_entity.parent_name == notebook]
+        if section is not None:
+            pages = [p for p in pages if p.parent_name == section]
+        return pages
+
+    def save_structure(self):
+        '''
+        Save the structure to save_file. Files with .json or .save
+        extension are written in JSON, others are SQLite databases.
+        A partial structure (see get_lazy_structure) isn't saved.
+        '''
+        if self.partial:
+            logging.warning('save_structure: the structure is partial')
+            return
+        if is_json_file(self.save_file):
+            self.export_json(self.save_file)
+        else:
+            onenotestore.save(self.save_file,
+                              (entity_row(i) for i in self.entities()))
+
+    def load_structure(self, types=None):
+        '''
+        Load the structure saved by save_structure.
+        types - entity types to load, e.g. ('notebook',) to list
+        notebooks without building the pages. The structure is partial
+        then and isn't saved.
+        '''
+        if types is not None and set(types) >= set(ENTITY_URLS):
+            types = None
+        if is_json_file(self.save_file):
+            rows = self.read_json(self.save_file)
+            if rows is not None and types is not None:
+                rows = [r for r in rows if r[0] in types]
+        else:
+            rows = onenotestore.load(self.save_file, types)
+            if rows is None and os.path.exists(LEGACY_SAVE_FILE) and \
+                    self.save_file == SAVE_FILE_DEFAULT:
+                logging.info('migrate %s to %s' % (LEGACY_SAVE_FILE,
+                                                   self.save_file))
+                rows = self.read_json(LEGACY_SAVE_FILE)
+                if rows is not None:
+                    onenotestore.save(self.save_file, rows)
+
+        if rows is None:
+            logging.warning("%s file is missign or has wrong format" %
                             self.save_file)
             return None
 
         self.notebooks = []
         self.sections = []
         self.pages = []
-
-        for n in data['notebooks']:
-            oe = OEntity(
-                type='notebook',
-                id=n['id'],
-                name=n['name'],
-                parent_id=None,
-                parent_name=None,
-                created_time=dateutil.parser.parse(n['created_time']),
-                lastmod_time=dateutil.parser.parse(n['lastmod_time']),
-                children=[],
-                parent_entity=None
-                )
-            self.notebooks.append(oe)
-
-        for s in data['sections']:
-            oe = OEntity(
-                type='section',
-                id=s['id'],
-                name=s['name'],
-                parent_id=s['parent_id'],
-                parent_name=s['parent_name'],
-                created_time=dateutil.parser.parse(s['created_time']),
-                lastmod_time=dateutil.parser.parse(s['lastmod_time']),
-                children=[],
-                parent_entity=None
-                )
-            self.sections.append(oe)
-
-        for p in data['pages']:
-            oe = OEntity(
-                type='page',
-                id=p['id'],
-                name=p['name'],
-                parent_id=p['parent_id'],
-                parent_name=p['parent_name'],
-                created_time=dateutil.parser.parse(p['created_time']),
-                lastmod_time=dateutil.parser.parse(p['lastmod_time']),
-                children=[],
-                parent_entity=None
-                )
-            self.pages.append(oe)
+        self.ids = self.names = None
+        self.partial = types is not None
+        self.subtrees = {}
+        items = {'notebook': self.notebooks,
+                 'section': self.sections,
+                 'page': self.pages}
+        for row in rows:
+            items[row[0]].append(OEntity(*row, [], None))
 
         self.create_tree()
         return True
 
+    def entities(self):
+        return self.notebooks + self.sections + self.pages
+
+    def export_json(self, path):
+        '''
+        Save the structure in JSON format
+        '''
+        data = {'notebooks': [i.decode() for i in self.notebooks],
+                'sections': [i.decode() for i in self.sections],
+                'pages': [i.decode() for i in self.pages]}
+        with onenotestore.atomic_path(path) as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+
+    def read_json(self, path):
+        '''
+        Read entity rows from the structure saved in JSON format
+        '''
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return [tuple(i[k] for k in onenotestore.FIELDS)
+                for key in ('notebooks', 'sections', 'pages')
+                for i in data[key]]
+
     def create_page(self, title, section, text):
         logging.info("create_page")
-        # get section id
+        request = self.page_post_args(title, section, text)
+        if request is None:
+            return None
+
+        url, body = request
+        status_code, text = self.onenote_request(url, post=True, body=body)
+
+        return status_code
+
+    def create_pages(self, paths, section,
+                     workers=onenoteimport.IMPORT_WORKERS, processes=None,
+                     state_file=onenoteimport.IMPORT_STATE_FILE,
+                     report=None):
+        '''
+        Create pages in the section from Markdown files
+        (see onenoteimport.Importer.run)
+        '''
+        importer = onenoteimport.Importer(self, section, workers=workers,
+                                          processes=processes,
+                                          state_file=state_file)
+        return importer.run(paths, report=report)
+
+    def page_post_args(self, title, section, text):
+        '''
+        URL and body of the request creating page in the section
+        (None if the section isn't found)
+        '''
         sec = self.get_item(self.sections, 'name', section)
         if not sec:
             logging.info("create_page: section %s isn't found" % section)
             return None
 
-        url = BASE_URL + 'sections/' + sec[0].id + '/pages'
+        url = self.base_url + 'sections/' + sec[0].id + '/pages'
 
         body = PAGE_TEMPLATE % (title,
                                 datetime.datetime.now().isoformat(),
                                 text)
-
-        status_code, text = self.onenote_request(url, post=True, body=body)
-
-        return status_code
+        return url, body
@@ -0,0 +1,157 @@
+'''
+OneNote clients of several accounts sharing one process
+'''
+import logging
+import os
+import threading
+
+import onenote
+from onenoteauth import OneNoteAuth, create_session
+from onenotecontent import CACHE_DIR_DEFAULT
+from onenotethrottle import FairLimiter, SharedScheduler, MAX_CONCURRENCY
+
+ACCOUNTS_DIR_DEFAULT = '.onenote.accounts'
+
+
+def account_files(directory, name):
+    '''
+    Session, structure and content cache files of the account
+    '''
+    if not name or name in ('.', '..') or os.sep in name or \
+            (os.altsep and os.altsep in name):
+        raise ValueError('invalid account name: %r' % name)
+    path = os.path.join(directory, name)
+    return {'ses_file': os.path.join(path, OneNoteAuth.SESSION_FILE),
+            'save_file': os.path.join(path, onenote.SAVE_FILE_DEFAULT),
+            'cache_dir': os.path.join(path, CACHE_DIR_DEFAULT)}
+
+
+class AccountManager(object):
+    '''
+    Keeps OneNote clients of many accounts. Each account has its session
+    (token) file, structure cache and content cache in
+    <directory>/<name>/. The clients share one HTTP session (connection
+    pool) and a global limit of requests in flight that is given to the
+    accounts in turn.
+    options - OneNote arguments for all clients (workers, page_size,
+    cache_size...); cache=False disables the content cache.
+    '''
+
+    def __init__(self, directory=ACCOUNTS_DIR_DEFAULT,
+                 max_concurrency=MAX_CONCURRENCY, session=None, cache=True,
+                 **options):
+        self.directory = directory
+        self.limiter = FairLimiter(max_concurrency)
+        self.cache = cache
+        self.options = options
+        self._session = session
+        self.clients = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        '''
+        HTTP session of all accounts, its pool keeps a connection for
+        each request in flight
+        '''
+        with self._lock:
+            if self._session is None:
+                self._session = create_session(
+                    pool_maxsize=self.limiter.limit)
+            return self._session
+
+    def names(self):
+        '''
+        Names of the accounts with a session file
+        '''
+        try:
+            entries = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(n for n in entries if os.path.exists(
+            account_files(self.directory, n)['ses_file']))
+
+    def scheduler(self, name):
+        return SharedScheduler(self.limiter, name)
+
+    def client_options(self, name):
+        files = account_files(self.directory, name)
+        if not self.cache:
+            files['cache_dir'] = None
+        return dict(self.options, session=self.session,
+                    scheduler=self.scheduler(name), **files)
+
+    def get(self, name):
+        '''
+        OneNote client of the account with its saved structure loaded
+        '''
+        with self._lock:
+            client = self.clients.get(name)
+        if client is not None:
+            return client
+
+        client = onenote.OneNote(**self.client_options(name))
+        client.load_structure()
+        with self._lock:
+            return self.clients.setdefault(name, client)
+
+    def add(self, name, client_id, client_secret, redirect_url, scope):
+        '''
+        Create the account directory and a client with the given
+        credentials, authorize it with authenticate()
+        '''
+        os.makedirs(os.path.dirname(
+            account_files(self.directory, name)['ses_file']),
+            mode=0o700, exist_ok=True)
+        client = onenote.OneNote(client_id=client_id,
+                                 client_secret=client_secret,
+                                 redirect_url=redirect_url, scope=scope,
+                                 **self.client_options(name))
+        with self._lock:
+            self.clients[name] = client
+        return client
+
+    def map(self, func, names=None):
+        '''
+        Call func(client) for the accounts (all by default) in parallel,
+        at most as many accounts at a time as the global limit.
+        Returns dict of account name -> result, or the exception
+        raised by func.
+        '''
+        if names is None:
+            names = self.names()
+        if not names:
+            return {}
+
+        def call(name):
+            try:
+                return func(self.get(name))
+            except Exception as e:
+                logging.exception('account %s failed' % name)
+                return e
+
+        from concurrent.futures import ThreadPoolExecutor
+        workers = min(len(names), self.limiter.limit)
+        with ThreadPoolExecutor(workers) as pool:
+            return dict(zip(names, pool.map(call, names)))
+
+    def update(self, names=None, sync=True):
+        '''
+        Update the structure of the accounts, incrementally with sync.
+        Returns dict of account name -> status code or exception.
+        '''
+        def update(client):
+            if sync and client.notebooks:
+                return client.sync_structure()
+            client.get_structure()
+            return 200
+        return self.map(update, names)
+
+    def close(self):
+        with self._lock:
+            for client in self.clients.values():
+                client.stop_prefetch()
+            self.clients = {}
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -0,0 +1,616 @@
+import asyncio
+import json
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from onenote import OneNote, SAVE_FILE_DEFAULT, STREAM_CHUNK_SIZE, \
+    CHILD_TYPES, entity_from_json, entities_from_values, merge_entities, \
+    odata_time
+import onenoteconvert
+import onenoteexport
+import onenoteimport
+import onenoteprefetch
+from onenotestats import RequestInfo, endpoint_label
+from onenotestream import ListingDecoder
+from onenotethrottle import RETRY_STATUSES
+
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 10
+
+
+class AsyncResponse(object):
+    '''
+    Status, headers and body of a finished aiohttp request.
+    Body of a stream request is read from raw.content.
+    '''
+
+    def __init__(self, status_code, headers, text, raw=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+        # unread aiohttp response of a stream request
+        self.raw = raw
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.release()
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncOneNote(OneNote):
+    '''
+    OneNote client for asyncio.
+    Network methods are coroutines sharing one aiohttp connection pool,
+    structure methods (create_tree, load_structure, by_id, ...) are
+    inherited from OneNote. Use as "async with AsyncOneNote() as o:"
+    or call close() when done.
+    '''
+
+    def __init__(self, save_file=SAVE_FILE_DEFAULT, *args,
+                 http=None, limit=CONNECTION_LIMIT,
+                 limit_per_host=CONNECTION_LIMIT_PER_HOST, **kwargs):
+        if http is None and aiohttp is None:
+            raise ImportError('AsyncOneNote requires aiohttp')
+        OneNote.__init__(self, save_file, *args, **kwargs)
+        self._http = http
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._async_token_lock = None
+        self._slots = None
+        self.in_flight = 0
+
+    @property
+    def http(self):
+        '''
+        aiohttp session, created on first use in the running loop
+        '''
+        if self._http is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host)
+            self._http = aiohttp.ClientSession(connector=connector)
+        return self._http
+
+    async def close(self):
+        await self.stop_prefetch()
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def async_token_lock(self):
+        if self._async_token_lock is None:
+            self._async_token_lock = asyncio.Lock()
+        return self._async_token_lock
+
+    async def get_token_async(self, stale_token=None):
+        '''
+        Get access token. Concurrent callers wait for a single refresh.
+        stale_token - token rejected by the server, it is refreshed
+        unless another caller has already done it.
+        '''
+        token = self.auth_cfg['access_token']
+        if token and stale_token is None and not self.token_expiring():
+            return token
+
+        async with self.async_token_lock:
+            loop = asyncio.get_running_loop()
+            if stale_token is not None:
+                return await loop.run_in_executor(None, self.handle_401,
+                                                  stale_token)
+            return await loop.run_in_executor(None, self.get_token)
+
+    async def send(self, url, post=False, body='', headers=None,
+                   stream=False):
+        '''
+        Send authorized request, retry once with a new token on 401
+        and retry throttled requests. Returns AsyncResponse or None.
+        stream - don't read the body; the caller reads r.raw.content,
+        then calls r.close() and emit_request(r.request_info).
+        '''
+        logging.info('onenote_request: url=%s' % url)
+        token = await self.get_token_async()
+        if not token:
+            logging.warning('get_token failed')
+            return None
+
+        headers = dict(headers or {})
+        if post:
+            headers['Content-Type'] = 'application/xhtml+xml'
+            body = body.encode('utf-8')
+
+        method = 'POST' if post else 'GET'
+        info = RequestInfo(endpoint_label(method, url, self.base_url),
+                           method, url)
+        try:
+            for attempt in range(2):
+                headers['Authorization'] = 'Bearer %s' % token
+                r = await self.run_scheduled(url, post, body, headers, info,
+                                             stream)
+                if r.status_code != 401 or attempt:
+                    break
+                r.close()
+                token = await self.get_token_async(stale_token=token)
+                if not token:
+                    break
+        except BaseException:
+            self.emit_request(info)
+            raise
+
+        if stream:
+            r.request_info = info
+        else:
+            self.emit_request(info)
+        return r
+
+    @property
+    def slots(self):
+        '''
+        Condition guarding the number of requests in flight
+        '''
+        if self._slots is None:
+            self._slots = asyncio.Condition()
+        return self._slots
+
+    async def acquire(self):
+        '''
+        Wait until fewer requests than the scheduler concurrency limit
+        are in flight
+        '''
+        async with self.slots:
+            while self.in_flight >= int(self.scheduler.limit):
+                await self.slots.wait()
+            self.in_flight += 1
+
+    async def release(self):
+        async with self.slots:
+            self.in_flight -= 1
+            self.slots.notify_all()
+
+    async def run_scheduled(self, url, post, body, headers, info=None,
+                            stream=False):
+        '''
+        Send request retrying throttled responses. The number of
+        requests in flight follows the AIMD limit of the scheduler.
+        info - RequestInfo recording attempts, status and sizes;
+        connection phases are not measured for aiohttp requests.
+        stream - return the response of a successful request unread.
+        '''
+        scheduler = self.scheduler
+        attempt = 0
+        while True:
+            if info is not None:
+                info.attempts += 1
+                if post:
+                    info.bytes_out += len(body)
+
+            await self.acquire()
+            try:
+                start = time.perf_counter()
+                if post:
+                    resp = await self.http.post(url, headers=headers,
+                                                data=body)
+                else:
+                    resp = await self.http.get(url, headers=headers)
+                headers_time = time.perf_counter()
+                if stream and resp.status not in RETRY_STATUSES:
+                    r = AsyncResponse(resp.status, resp.headers, None, resp)
+                else:
+                    try:
+                        r = AsyncResponse(resp.status, resp.headers,
+                                          await resp.text())
+                    finally:
+                        resp.release()
+            finally:
+                await self.release()
+
+            if info is not None:
+                info.status = r.status_code
+                info.ttfb += headers_time - start
+                if r.text is not None:
+                    info.add_download(time.perf_counter() - headers_time,
+                                      len(r.text.encode('utf-8')))
+
+            if r.status_code not in RETRY_STATUSES:
+                scheduler.on_success()
+                return r
+
+            scheduler.on_throttle()
+            if not scheduler.should_retry(r, idempotent=not post) or \
+                    attempt >= scheduler.max_retries:
+                return r
+            delay = scheduler.delay(attempt, r)
+            scheduler.record_retry(delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def onenote_request(self, url, post=False, body=''):
+        r = await self.send(url, post=post, body=body)
+        if r is None:
+            return None
+
+        try:
+            data = r.json()
+        except ValueError:
+            data = r.text
+
+        return r.status_code, data
+
+    async def get_url(self, url):
+        return await self.onenote_request(self.base_url + url)
+
+    async def list_values(self, type, **query):
+        '''
+        Get the entity lists of all listing responses, with workers > 1
+        pages after the first are requested concurrently by $skip
+        (see OneNote.list_values)
+        '''
+        parallel = self.workers > 1 and 'skip' not in query
+        first = dict(query, count='true') if parallel else query
+        status_code, text = await self.onenote_request(
+            self.listing_url(type, **first))
+        if status_code != 200:
+            return status_code, []
+
+        values = [text['value']]
+        url = text.get('@odata.nextLink')
+        total = text.get('@odata.count')
+        size = len(text['value'])
+        if parallel and url and total is not None and size:
+            results = await asyncio.gather(*[
+                self.onenote_request(self.listing_url(
+                    type, **dict(query, skip=skip, top=size)))
+                for skip in range(size, total, size)])
+            for status_code, text in results:
+                if status_code != 200:
+                    return status_code, values
+                values.append(text['value'])
+            url = text.get('@odata.nextLink')
+
+        while url:
+            status_code, text = await self.onenote_request(url)
+            if status_code != 200:
+                break
+            values.append(text['value'])
+            url = text.get('@odata.nextLink')
+
+        return status_code, values
+
+    async def list_entities(self, type, **query):
+        status_code, values = await self.list_values(type, **query)
+        return status_code, entities_from_values(type, values)
+
+    async def list_ids(self, type):
+        status_code, values = await self.list_values(type, select='id')
+        return status_code, set(entity['id'] for value in values
+                                for entity in value)
+
+    async def iter_entities(self, type, **query):
+        '''
+        Asynchronous generator of entities decoded from the listing
+        responses as they are received
+        '''
+        url = self.listing_url(type, **query)
+        while url:
+            r = await self.send(url, stream=True)
+            if r is None:
+                return
+            info = r.request_info
+            decoder = ListingDecoder()
+            try:
+                if r.status_code != 200:
+                    logging.warning('iter_entities: status_code=%d' %
+                                    r.status_code)
+                    return
+                while True:
+                    start = time.perf_counter()
+                    chunk = await r.raw.content.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    info.add_download(time.perf_counter() - start,
+                                      len(chunk))
+                    for entity in decoder.feed(chunk):
+                        yield entity_from_json(type, entity)
+            finally:
+                r.close()
+                self.emit_request(info)
+            for entity in decoder.close():
+                yield entity_from_json(type, entity)
+
+            url = decoder.fields.get('@odata.nextLink')
+
+    async def get_notebooks(self):
+        self.ids = self.names = None
+        status_code, self.notebooks = await self.list_entities('notebook')
+        return status_code
+
+    async def get_sections(self):
+        self.ids = self.names = None
+        status_code, self.sections = await self.list_entities('section')
+        return status_code
+
+    async def get_pages(self):
+        self.ids = self.names = None
+        status_code, self.pages = await self.list_entities('page')
+        return status_code
+
+    async def get_structure(self, workers=None, lazy=False):
+        '''
+        Get notebooks, sections and pages concurrently and build the tree
+        '''
+        if lazy:
+            return await self.get_lazy_structure()
+        if not await self.get_token_async():
+            logging.warning('get_structure: get_token failed')
+            return
+        await asyncio.gather(self.get_notebooks(), self.get_sections(),
+                             self.get_pages())
+        self.partial = False
+        self.subtrees = {}
+        self.create_tree()
+        self.save_structure()
+
+    async def get_lazy_structure(self):
+        '''
+        Get notebooks only. Children aren't loaded on attribute access
+        as it can't be awaited, get them with load_children.
+        '''
+        subtrees = self.loaded_subtrees()
+        status_code = await self.get_notebooks()
+        if status_code == 200:
+            self.set_lazy_tree(subtrees)
+        return status_code
+
+    async def load_children(self, entity):
+        children = self.cached_children(entity)
+        if children is None:
+            status_code, children = await self.list_entities(
+                CHILD_TYPES[entity.type], parent=entity)
+            if status_code != 200:
+                logging.warning('load_children: status_code=%s' %
+                                status_code)
+                return []
+        return self.attach_children(entity, children)
+
+    async def sync_structure(self):
+        if self.partial:
+            await self.get_structure()
+            return 200
+        updates = {}
+        for type, attr in (('notebook', 'notebooks'),
+                           ('section', 'sections'),
+                           ('page', 'pages')):
+            status_code, ids = await self.list_ids(type)
+            if status_code != 200:
+                return status_code
+
+            items = getattr(self, attr)
+            if items:
+                since = max(i.lastmod_time for i in items)
+                status_code, modified = await self.list_entities(
+                    type, filter='lastModifiedTime gt %s' % odata_time(since))
+            else:
+                status_code, modified = await self.list_entities(type)
+            if status_code != 200:
+                return status_code
+            updates[attr] = (modified, ids)
+
+        for attr, (modified, ids) in updates.items():
+            setattr(self, attr, merge_entities(getattr(self, attr),
+                                               modified, ids))
+        self.create_tree()
+        self.save_structure()
+        return 200
+
+    async def get_page_content(self, page):
+        '''
+        Get page content in HTML, see OneNote.get_page_content
+        '''
+        prefetcher = self.prefetcher
+        if prefetcher is None:
+            return await self.fetch_page_content(page)
+        await prefetcher.before_read(page)
+        text = await self.fetch_page_content(page)
+        prefetcher.after_read(page)
+        return text
+
+    async def start_prefetch(self, mode='siblings',
+                             count=onenoteprefetch.PREFETCH_COUNT,
+                             workers=onenoteprefetch.PREFETCH_WORKERS,
+                             queue_size=onenoteprefetch.PREFETCH_QUEUE_SIZE):
+        '''
+        Prefetch page content in tasks of the running event loop,
+        see OneNote.start_prefetch
+        '''
+        if self.content_cache is None:
+            raise ValueError('prefetching needs the content cache')
+        await self.stop_prefetch()
+        self.prefetcher = AsyncPrefetcher(
+            self, mode, count, workers, queue_size)
+        return self.prefetcher
+
+    async def stop_prefetch(self):
+        prefetcher, self.prefetcher = self.prefetcher, None
+        if prefetcher is None:
+            return None
+        return await prefetcher.close()
+
+    async def fetch_page_content(self, page):
+        '''
+        Get page content in HTML without prefetching
+        '''
+        cache = self.content_cache
+        if cache is not None:
+            text = cache.get(page)
+            if text is not None:
+                return text
+
+        url = self.base_url + 'pages/' + page.id + '/content'
+        headers = {}
+        etag = cache.etag(page.id) if cache is not None else None
+        if etag:
+            headers['If-None-Match'] = etag
+        r = await self.send(url, headers=headers)
+        if r is None:
+            return None
+
+        if r.status_code == 304:
+            return cache.revalidate(page)
+        if r.status_code == 200:
+            if cache is not None:
+                cache.put(page, r.text, r.headers.get('ETag'))
+            return r.text
+
+    async def get_page_content_md(self, page):
+        text = await self.get_page_content(page)
+        if text is not None:
+            # convert in the default executor not to block the loop
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, onenoteconvert.html_to_md, text)
+
+    async def iter_pages_md(self, pages,
+                            workers=onenoteconvert.CONVERT_WORKERS,
+                            processes=None):
+        '''
+        Download pages, at most workers at a time, and convert them to
+        Markdown in a process pool (default executor if processes is 0)
+        while the next pages are being downloaded. Asynchronously yields
+        (page, Markdown or None, conversion seconds) in completion order.
+        '''
+        loop = asyncio.get_running_loop()
+        procs = None
+        if processes != 0:
+            from concurrent.futures import ProcessPoolExecutor
+            procs = ProcessPoolExecutor(processes)
+        limit = asyncio.Semaphore(workers)
+        pages = iter(pages)
+        jobs = {}
+
+        async def convert(page):
+            async with limit:
+                text = await self.fetch_page_content(page)
+            if text is None:
+                return None, 0.0
+            return await loop.run_in_executor(procs, onenoteconvert.convert,
+                                              text)
+
+        def convert_next():
+            page = next(pages, None)
+            if page is not None:
+                jobs[asyncio.ensure_future(convert(page))] = page
+
+        try:
+            # at most 2 * workers pages downloaded or being converted
+            for _ in range(2 * workers):
+                convert_next()
+            while jobs:
+                done, _ = await asyncio.wait(
+                    list(jobs), return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    page = jobs.pop(f)
+                    convert_next()
+                    try:
+                        text, seconds = f.result()
+                    except Exception:
+                        logging.exception('convert: %s failed' % page.id)
+                        text, seconds = None, 0.0
+                    if text is not None:
+                        logging.info('convert: %s %.3fs' % (page.id, seconds))
+                    yield page, text, seconds
+        finally:
+            for f in jobs:
+                f.cancel()
+            if procs is not None:
+                procs.shutdown(cancel_futures=True)
+
+    async def create_page(self, title, section, text):
+        request = self.page_post_args(title, section, text)
+        if request is None:
+            return None
+
+        url, body = request
+        status_code, text = await self.onenote_request(url, post=True,
+                                                       body=body)
+        return status_code
+
+    async def export(self, directory, notebook=None, section=None,
+                     fmt='md', workers=onenoteexport.EXPORT_WORKERS,
+                     processes=None):
+        exporter = onenoteexport.Exporter(self, directory, fmt=fmt,
+                                          workers=workers,
+                                          processes=processes)
+        return await exporter.run_async(self.select_pages(notebook, section))
+
+    async def create_pages(self, paths, section,
+                           workers=onenoteimport.IMPORT_WORKERS,
+                           processes=None,
+                           state_file=onenoteimport.IMPORT_STATE_FILE,
+                           report=None):
+        importer = onenoteimport.Importer(self, section, workers=workers,
+                                          processes=processes,
+                                          state_file=state_file)
+        return await importer.run_async(paths, report=report)
+
+
+class AsyncPrefetcher(onenoteprefetch.Prefetcher):
+    '''
+    Prefetcher of AsyncOneNote (see onenoteprefetch.Prefetcher),
+    downloads pages in tasks of the running event loop.
+    before_read and close are coroutines.
+    '''
+    Empty = asyncio.QueueEmpty
+    Full = asyncio.QueueFull
+
+    def make_queue(self, size):
+        return asyncio.Queue(size)
+
+    def start(self, workers):
+        loop = asyncio.get_running_loop()
+        return [loop.create_task(self._work()) for _ in range(workers)]
+
+    def new_event(self):
+        return asyncio.Event()
+
+    async def before_read(self, page):
+        with self._lock:
+            event = self._inflight.get(page.id)
+        if event is not None:
+            await event.wait()
+        self._count_read(page)
+
+    async def close(self):
+        self.cancel()
+        for _ in self._workers:
+            await self.queue.put(None)
+        await asyncio.gather(*self._workers)
+        return self.stats()
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            page, event = self._take(item)
+            if event is None:
+                continue
+            try:
+                if self._needed(page):
+                    self._record(page,
+                                 await self.onote.fetch_page_content(page))
+            except Exception:
+                self._failed(page)
+            finally:
+                self._done(page, event)
@@ -1,11 +1,11 @@
-import webbrowser
-import socket
 import json
 import re
-import requests
 import logging
-import os
-import stat
+import threading
+import time
+
+import onenotestore
+from onenotestats import RequestInfo
 
 CODE_URL = 'https://login.live.com/oauth20_authorize.srf?\
 response_type=code&client_id=%s&redirect_url=%s&scope=%s'
@@ -13,6 +13,12 @@ response_type=code&client_id=%s&redirect_url=%s&scope=%s'
 HOST = ''
 PORT = 8085
 
+# refresh access token this many seconds before it expires
+TOKEN_EXPIRY_MARGIN = 300
+
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+
 RESP_200 = """\
 HTTP/1.1 200 OK
 Content-type: text/html
@@ -21,6 +27,30 @@ Content-type: text/html
 """
 
 
+def create_session(pool_connections=POOL_CONNECTIONS,
+                   pool_maxsize=POOL_MAXSIZE, pool_block=False,
+                   keep_alive=True):
+    '''
+    Create HTTP session with a connection pool.
+    pool_connections - number of per-host pools to keep
+    pool_maxsize - max number of connections kept per host
+    pool_block - block when all connections to a host are busy
+    keep_alive - reuse connections between requests
+    '''
+    import requests
+    from onenotehttp import TimedHTTPAdapter
+    session = requests.Session()
+    adapter = TimedHTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
 class OneNoteAuth(object):
     SESSION_FILE = '.onenote.ses'
     SES_KEYS = ['client_id',
@@ -31,19 +61,32 @@ class OneNoteAuth(object):
                 'redirect_url']
 
     def __init__(self, ses_file=SESSION_FILE, client_id=None,
-                 client_secret=None, scope=None, redirect_url=None):
+                 client_secret=None, scope=None, redirect_url=None,
+                 session=None, pool_connections=POOL_CONNECTIONS,
+                 pool_maxsize=POOL_MAXSIZE, pool_block=False,
+                 keep_alive=True, request_hooks=None):
         logging.info('OneNoteAuth __init__: client_id=%s,\
-                     client_secret=%s, scope=%s,\
-                     redirect_url=%s' % (client_id, client_secret,
-                                         scope, redirect_url))
+                     scope=%s, redirect_url=%s' % (client_id, scope,
+                                                   redirect_url))
         self.ses_file = ses_file
+        self._session = session
+        self.pool_cfg = {
+                'pool_connections': pool_connections,
+                'pool_maxsize': pool_maxsize,
+                'pool_block': pool_block,
+                'keep_alive': keep_alive}
         self.auth_cfg = {
                 'client_id': None,
                 'client_secret': None,
                 'scope': None,
                 'access_token': None,
                 'refresh_token': None,
-                'redirect_url': None}
+                'redirect_url': None,
+                'expires_at': None}
+        # guards token refresh and session file writes
+        self.token_lock = threading.RLock()
+        # callables receiving onenotestats.RequestInfo of every request
+        self.request_hooks = list(request_hooks or [])
 
         if client_id and client_secret and scope and redirect_url:
             self.auth_cfg['client_id'] = client_id
@@ -61,6 +104,45 @@ class OneNoteAuth(object):
                 self.auth_cfg['access_token'] = data['access_token']
                 self.auth_cfg['refresh_token'] = data['refresh_token']
                 self.auth_cfg['redirect_url'] = data['redirect_url']
+                self.auth_cfg['expires_at'] = data.get('expires_at')
+
+    @property
+    def session(self):
+        '''
+        HTTP session shared by OAuth and OneNote requests.
+        Created on first use unless given to the constructor.
+        '''
+        if self._session is None:
+            self._session = create_session(**self.pool_cfg)
+        return self._session
+
+    def add_request_hook(self, hook):
+        self.request_hooks.append(hook)
+
+    def remove_request_hook(self, hook):
+        self.request_hooks.remove(hook)
+
+    def emit_request(self, info):
+        info.finish()
+        logging.debug('request: %s' % info)
+        for hook in list(self.request_hooks):
+            try:
+                hook(info)
+            except Exception:
+                logging.exception('request hook %r failed' % hook)
+
+    def token_post(self, payload):
+        '''
+        Post OAuth token request, returns requests.Response
+        '''
+        url = 'https://login.live.com/oauth20_token.srf'
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        info = RequestInfo('POST token', 'POST', url)
+        try:
+            return info.measure(lambda: self.session.post(
+                url, headers=headers, data=payload))
+        finally:
+            self.emit_request(info)
 
     def load_session(self):
         logging.info('load_session')
@@ -77,9 +159,10 @@ class OneNoteAuth(object):
             return data
 
     def save_session(self):
-        with open(self.ses_file, 'w') as f:
-            json.dump(self.auth_cfg, f)
-            os.chmod(self.ses_file, stat.S_IRUSR | stat.S_IWUSR)
+        with self.token_lock:
+            with onenotestore.atomic_path(self.ses_file) as tmp:
+                with open(tmp, 'w') as f:
+                    json.dump(self.auth_cfg, f)
 
     def check_ses_data(self, data):
         for k in self.SES_KEYS:
@@ -88,17 +171,41 @@ class OneNoteAuth(object):
 
         return True
 
+    def token_expiring(self):
+        '''
+        True if the access token expires within TOKEN_EXPIRY_MARGIN
+        '''
+        expires_at = self.auth_cfg['expires_at']
+        return expires_at is not None and \
+            time.time() > expires_at - TOKEN_EXPIRY_MARGIN
+
+    def set_expiry(self, response):
+        if 'expires_in' in response:
+            self.auth_cfg['expires_at'] = time.time() + \
+                float(response['expires_in'])
+        else:
+            self.auth_cfg['expires_at'] = None
+
     def get_token(self):
         logging.info('get_token entry')
-        if self.auth_cfg['access_token']:
-            logging.info('get_token entry: cp0')
-            return self.auth_cfg['access_token']
+        token = self.auth_cfg['access_token']
+        if token and not self.token_expiring():
+            return token
 
-        if self.auth_cfg['refresh_token']:
-            logging.info('get_token entry: cp1')
-            return self.get_refresh_token()
+        # concurrent callers wait here for a single refresh
+        with self.token_lock:
+            token = self.auth_cfg['access_token']
+            if token and not self.token_expiring():
+                return token
+
+            if self.auth_cfg['refresh_token']:
+                logging.info('get_token entry: refresh')
+                return self.get_refresh_token()
+
+            if token:
+                # can't refresh, use the token while it works
+                return token
 
-        else:
             logging.info('get_token entry: authenticate')
             return self.authenticate()
 
@@ -111,8 +218,6 @@ class OneNoteAuth(object):
 
         # get access_token
         logging.info('get access_token')
-        url = 'https://login.live.com/oauth20_token.srf'
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
         payload = {
             'grant_type': 'authorization_code',
             'client_id': self.auth_cfg['client_id'],
@@ -120,20 +225,22 @@ class OneNoteAuth(object):
             'code': code,
             'redirect_url': self.auth_cfg['redirect_url']
             }
-        r = requests.post(url, headers=headers, data=payload)
+        r = self.token_post(payload)
         response = r.json()
-        logging.info('get_token: status_code=%d, response=%s' %
-                     (r.status_code, response))
+        logging.info('get_token: status_code=%d' % r.status_code)
         if r.status_code != 200:
             return None
         if 'refresh_token' in response:
             self.auth_cfg['refresh_token'] = response['refresh_token']
         if 'access_token' in response:
             self.auth_cfg['access_token'] = response['access_token']
+            self.set_expiry(response)
             self.save_session()
             return self.auth_cfg['access_token']
 
     def auth_get_code(self):
+        import socket
+        import webbrowser
         logging.info('auth_get_code entry')
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.bind((HOST, PORT))
@@ -155,22 +262,27 @@ class OneNoteAuth(object):
 
         request_line, _ = request.decode().split('\r\n', 1)
         resp = re.search(r'GET /\?code=([^\s]+) ', request_line)
-        logging.info('auth_get_code: resp=%s' % resp)
+        logging.info('auth_get_code: code received=%s' % bool(resp))
         if resp:
-            logging.info('auth_get_code: code=%s' % resp.group(1))
             return resp.group(1)
         else:
             return None
 
-    def handle_401(self):
-        self.auth_cfg['access_token'] = None
-        self.get_token()
+    def handle_401(self, stale_token=None):
+        '''
+        Refresh the token rejected by the server.
+        stale_token - the rejected token; if another thread has already
+        replaced it, the new token is used without a refresh.
+        '''
+        with self.token_lock:
+            if stale_token is None or \
+                    self.auth_cfg['access_token'] == stale_token:
+                self.auth_cfg['access_token'] = None
+            return self.get_token()
 
     def get_refresh_token(self):
         # get access_token
         self.auth_cfg['access_token'] = None
-        url = 'https://login.live.com/oauth20_token.srf'
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
         payload = {
             'grant_type': 'refresh_token',
             'client_id': self.auth_cfg['client_id'],
@@ -178,7 +290,7 @@ class OneNoteAuth(object):
             'redirect_url': self.auth_cfg['redirect_url'],
             'refresh_token': self.auth_cfg['refresh_token']
             }
-        r = requests.post(url, headers=headers, data=payload)
+        r = self.token_post(payload)
         response = r.json()
         if 'refresh_token' in response:
             self.auth_cfg['refresh_token'] = response['refresh_token']
@@ -187,6 +299,8 @@ class OneNoteAuth(object):
 
         if 'access_token' in response:
             self.auth_cfg['access_token'] = response['access_token']
+            self.set_expiry(response)
+            self.save_session()
         else:
             self.auth_cfg['access_token'] = None
 
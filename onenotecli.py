@@ -1,12 +1,46 @@
 import onenote
+import onenoteaccounts
+import onenotecontent
+import onenoteconvert
+import onenoteexport
+import onenoteimport
+import onenoteprefetch
+import onenotesearch
+import onenotedaemon
+import onenotestats
+import onenotetree
 import argparse
+import contextlib
+import io
+import os
 import sys
-import html2text
 import logging
-import markdown2
 
 
-def main(args):
+def main(args, onote=None):
+    '''
+    Run the command. onote is a OneNote instance with the loaded
+    structure (daemon mode), otherwise it's created from args.
+    '''
+    if not args.stats:
+        return run_command(args, onote)
+
+    stats = onenotestats.RequestStats()
+    try:
+        run_command(args, onote, [stats])
+    finally:
+        if onote is not None:
+            onote.remove_request_hook(stats)
+        sys.stdout.flush()
+        stats.print_summary(sys.stderr)
+        if onote is not None and onote.prefetcher is not None:
+            sys.stderr.write(onote.prefetcher.summary() + '\n')
+
+
+def run_command(args, onote=None, hooks=()):
+    '''
+    Run the command. hooks - request hooks added to the OneNote instance
+    '''
 
     """
     Setup logging
@@ -21,7 +55,12 @@ def main(args):
     """
     Create OneNote instance and provide authorization
     """
-    if args.authorize:
+    if onote is not None:
+        for hook in hooks:
+            onote.add_request_hook(hook)
+        loaded = bool(onote.notebooks) and not args.update and \
+            not onote.partial
+    elif args.authorize:
         if not args.client_id:
             print('--client_id option is needed for authorization')
             exit(1)
@@ -35,22 +74,39 @@ def main(args):
             print('--scope option is needed for authorization')
             exit(1)
 
+        if args.account:
+            os.makedirs(os.path.join(args.accounts_dir, args.account),
+                        mode=0o700, exist_ok=True)
         onote = onenote.OneNote(client_id=args.client_id,
                                 client_secret=args.client_secret,
                                 redirect_url=args.redirect_url,
-                                scope=args.scope)
+                                scope=args.scope,
+                                request_hooks=list(hooks),
+                                **onenote_options(args))
         onote.authenticate()
+        loaded = False
 
     else:
-        onote = onenote.OneNote()
+        onote = onenote.OneNote(request_hooks=list(hooks),
+                                **onenote_options(args))
+        loaded = False if args.update else \
+            onote.load_structure(structure_types(args))
 
     """
     Get some flags from args
     """
-    if args.update:
-        loaded = False
-    else:
-        loaded = onote.load_structure()
+    if args.sync:
+        if loaded:
+            onote.sync_structure()
+        else:
+            onote.get_structure()
+            loaded = True
+
+    if args.export_json:
+        if not loaded:
+            onote.get_structure()
+            loaded = True
+        onote.export_json(args.export_json)
 
     if args.by_time:
         to_sort = 'lastmod_time'
@@ -64,17 +120,42 @@ def main(args):
     Print list of pages
     """
     if args.pages:
-        if not loaded:
-            onote.get_structure()
-
-        for i in sorted(onote.pages, key=lambda x: getattr(x, to_sort)):
+        streaming = not loaded and args.unsorted
+        if streaming:
+            # print pages as they arrive from the server,
+            # sections give notebook names for the long format
+            listed = onote.get_notebooks() == 200 and \
+                onote.get_sections() == 200
+            onote.pages = []
+            onote.create_tree()
+            result = {}
+            pages = iter_with_status(onote.iter_pages(), result)
+        else:
+            if not loaded:
+                onote.get_structure()
+            pages = onote.pages
+            if not args.unsorted:
+                pages = sorted(pages, key=lambda x: getattr(x, to_sort))
+
+        for i in pages:
+            if streaming:
+                onote.pages.append(i)
             if longformat:
+                section = onote.by_id(i.parent_id, 'section')
                 print('%s %s \t[%s] (%s -> %s)' %
                       (i.lastmod_time.strftime('%Y %b %0d %H:%M'), i.id,
-                       i.name, i.parent_entity.parent_name, i.parent_name))
+                       i.name, section.parent_name if section else '',
+                       i.parent_name))
             else:
                 print(i.name)
 
+        if streaming:
+            onote.create_tree()
+            # a failed listing would save a truncated structure
+            if listed and result.get('status') == 200:
+                onote.save_structure()
+                loaded = True
+
     """
     Print list of sections
     """
@@ -95,7 +176,7 @@ def main(args):
     """
     if args.notebooks:
         if not loaded:
-            onote.get_structure()
+            onote.get_structure(lazy=args.lazy)
 
         for i in sorted(onote.notebooks, key=lambda x: getattr(x, to_sort)):
             if longformat:
@@ -115,73 +196,93 @@ def main(args):
             onote.get_structure()
         page = onote.get_item(onote.pages, 'name', args.content)
         if page:
-            if is_html:
-                print(onote.get_page_content(page[0]))
+            text = onote.get_page_content(page[0])
+            if text is None:
+                print("Error: content of page '%s' isn't received" %
+                      args.content)
+            elif is_html:
+                print(text)
             else:
-                print(html2text.html2text(onote.get_page_content(page[0])))
+                # large pages are written chunk by chunk
+                for chunk in onenoteconvert.iter_markdown(text):
+                    sys.stdout.write(chunk)
+                print()
         else:
             print("Error: page '%s' isn't found" % args.content)
 
+    """
+    Search pages by title and cached content
+    """
+    if args.search:
+        if not loaded:
+            onote.get_structure()
+            loaded = True
+        index_file = args.index_file
+        if args.account and index_file == onenotesearch.INDEX_FILE_DEFAULT:
+            index_file = os.path.join(args.accounts_dir, args.account,
+                                      index_file)
+        index = onenotesearch.SearchIndex(index_file)
+        index.update(onote.pages, onote.content_cache)
+        for page_id, title, snippet in index.search(args.search):
+            if longformat:
+                page = onote.by_id(page_id, 'page')
+                print('%s \t[%s] (%s) %s' %
+                      (page_id, title, page.parent_name if page else '',
+                       snippet))
+            else:
+                print(title)
+        index.close()
+
     """
     Print the OneNote  structure in tree-like format
     """
     if args.tree:
+        if not loaded:
+            onote.get_structure(lazy=args.lazy)
+            loaded = not onote.partial
+
+        roots = None
+        if args.root:
+            roots = onenotetree.find_roots(onote, args.root)
+            if not roots:
+                print('Notebook or section %s is not found' % args.root)
+                sys.exit(1)
+        onenotetree.render_tree(sys.stdout, onote, depth=args.depth,
+                                roots=roots)
+
+    """
+    Export pages to a directory tree
+    """
+    if args.export:
         if not loaded:
             onote.get_structure()
+            loaded = True
+        stats = onote.export(args.export, notebook=args.notebook,
+                             section=args.in_section, fmt=args.format,
+                             workers=args.export_workers)
+        print('Exported %d pages (%d unchanged, %d failed) in %.1fs, '
+              '%.1f pages/sec, %.2fs converting' % (
+                  stats['exported'], stats['skipped'], stats['failed'],
+                  stats['seconds'], stats['pages_per_sec'],
+                  stats['convert_seconds']))
 
-        i_n = 0
-        for n in onote.notebooks:
-            i_n += 1
-            if i_n == len(onote.notebooks):
-                last_n = True
-                isymb = chr(0x2514)
-            else:
-                last_n = False
-                isymb = chr(0x251C)
-
-            prefix = '%s ' % (isymb+2*chr(0x2500))
-            line = prefix + n.name
-            print(line)
-
-            i_s = 0
-            for s in n.children:
-                i_s += 1
-                if i_s == len(n.children):
-                    last_s = True
-                    isymb = chr(0x2514)
-                else:
-                    last_s = False
-                    isymb = chr(0x251C)
-
-                if last_n:
-                    preprefix = 4*' '
-                else:
-                    preprefix = chr(0x2502) + 3*' '
-
-                prefix = '%s ' % (preprefix + isymb+2*chr(0x2500))
-                line = prefix + s.name
-                print(line)
-
-                i_p = 0
-                for p in s.children:
-                    i_p += 1
-                    if i_p == len(s.children):
-                        isymb = chr(0x2514)
-                    else:
-                        isymb = chr(0x251C)
-
-                    if last_n and last_s:
-                        preprefix = 8*' '
-                    elif last_n and not last_s:
-                        preprefix = 2*' ' + chr(0x2502) + 3*' '
-                    elif not last_n and last_s:
-                        preprefix = chr(0x2502) + 7*' '
-                    else:
-                        preprefix = chr(0x2502) + 3*' '+chr(0x2502) + 4*' '
-
-                    prefix = '%s ' % (preprefix + isymb+2*chr(0x2500))
-                    line = prefix + p.name
-                    print(line)
+    """
+    Create pages from Markdown files
+    """
+    if args.create_pages:
+        if not args.in_section:
+            print('You should give a section name to create pages in (--in-section=<sec_name>)')  # noqa
+        else:
+            if not loaded:
+                onote.get_structure()
+                loaded = True
+            paths = onenoteimport.find_markdown_files(args.create_pages)
+            stats = onote.create_pages(
+                paths, args.in_section, workers=args.export_workers,
+                report=lambda path, status: print('%s: %s' % (path, status)))
+            print('Created %d pages (%d already created, %d failed) in %.1fs'
+                  % (stats['created'], stats['skipped'], stats['failed'],
+                     stats['seconds']))
 
     """
     Post page
@@ -198,6 +299,7 @@ def main(args):
                 print("Enter page content (press CTRL-D to complete)")
                 data = sys.stdin.read()
             print("Creating page...")
+            import markdown2
             status = onote.create_page(args.create, args.in_section,
                                        markdown2.markdown(data))
             if status == 403:
@@ -211,7 +313,162 @@ def main(args):
     sys.exit(0)
 
 
-if __name__ == '__main__':
+def iter_with_status(gen, result):
+    '''
+    Yield from the generator, store its return value in result['status']
+    '''
+    result['status'] = yield from gen
+
+
+def structure_types(args):
+    '''
+    Entity types the command needs from the saved structure, None for
+    all. Listing notebooks or sections doesn't load the pages.
+    '''
+    if args.pages or args.content or args.search or args.tree or \
+            args.sync or args.export_json or args.export or \
+            args.create_pages or args.create:
+        return None
+    if args.sections:
+        return ('notebook', 'section')
+    if args.notebooks:
+        return ('notebook',)
+    return None
+
+
+def onenote_options(args):
+    options = {'workers': args.workers,
+               'page_size': args.page_size,
+               'select': not args.all_fields,
+               'cache_dir': None if args.no_cache else args.cache_dir,
+               'cache_size': args.cache_size * 1024 * 1024}
+    if args.account:
+        files = onenoteaccounts.account_files(args.accounts_dir,
+                                              args.account)
+        options['ses_file'] = files['ses_file']
+        options['save_file'] = files['save_file']
+        if options['cache_dir'] == onenotecontent.CACHE_DIR_DEFAULT:
+            options['cache_dir'] = files['cache_dir']
+    return options
+
+
+def account_name(value):
+    try:
+        onenoteaccounts.account_files('', value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+class CliDaemon(object):
+    '''
+    Keeps OneNote instances with the loaded structure, token and
+    connection pool between CLI invocations: one for the working
+    directory and one for each --account, sharing the pool.
+    '''
+
+    def __init__(self, args):
+        self.accounts = onenoteaccounts.AccountManager(
+            os.path.abspath(args.accounts_dir))
+        options = self.options(args)
+        options.pop('ses_file', None)
+        options.pop('save_file', None)
+        self.onote = onenote.OneNote(
+            save_file=os.path.abspath(onenote.SAVE_FILE_DEFAULT),
+            ses_file=os.path.abspath(onenote.OneNote.SESSION_FILE),
+            session=self.accounts.session,
+            scheduler=self.accounts.scheduler(None), **options)
+        # save file -> its mtime when the structure was loaded
+        self.mtimes = {}
+        self.reload(self.onote)
+        if args.prefetch:
+            self.onote.start_prefetch(args.prefetch, args.prefetch_count)
+
+    def client(self, args):
+        '''
+        OneNote instance of the account selected by the command
+        '''
+        if not args.account:
+            return self.onote
+        new = args.account not in self.accounts.clients
+        onote = self.accounts.get(args.account)
+        if new:
+            self.mtimes[onote.save_file] = self.save_file_mtime(onote)
+        return onote
+
+    def options(self, args):
+        options = onenote_options(args)
+        if options['cache_dir'] is not None:
+            options['cache_dir'] = os.path.abspath(options['cache_dir'])
+        return options
+
+    def configure(self, args, onote):
+        '''
+        Apply options of the forwarded command line
+        '''
+        options = self.options(args)
+        onote.workers = options['workers']
+        onote.page_size = options['page_size']
+        onote.select = options['select']
+
+        cache = onote.content_cache
+        if options['cache_dir'] is None:
+            onote.content_cache = None
+        elif cache is None or cache.directory != options['cache_dir']:
+            onote.content_cache = onenotecontent.ContentCache(
+                options['cache_dir'], options['cache_size'])
+        else:
+            cache.max_size = options['cache_size']
+
+    def save_file_mtime(self, onote):
+        try:
+            return os.stat(onote.save_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self, onote):
+        '''
+        Load the structure if another process has saved it
+        '''
+        mtime = self.save_file_mtime(onote)
+        if onote.save_file not in self.mtimes or \
+                mtime != self.mtimes[onote.save_file]:
+            onote.load_structure()
+            self.mtimes[onote.save_file] = mtime
+
+    def handle(self, argv, cwd):
+        out = io.StringIO()
+        status = 0
+        prev_cwd = os.getcwd()
+        onote = None
+        try:
+            os.chdir(cwd)
+            with contextlib.redirect_stdout(out), \
+                    contextlib.redirect_stderr(out):
+                try:
+                    args = make_parser().parse_args(argv)
+                    onote = self.client(args)
+                    self.reload(onote)
+                    self.configure(args, onote)
+                    main(args, onote)
+                except SystemExit as e:
+                    status = e.code if isinstance(e.code, int) else 1
+        finally:
+            os.chdir(prev_cwd)
+            if onote is not None:
+                self.mtimes[onote.save_file] = self.save_file_mtime(onote)
+        return status, out.getvalue()
+
+
+def run_in_daemon(args):
+    '''
+    Commands reading stdin or authorizing run in the calling process
+    '''
+    return not (args.no_daemon or args.authorize or
+                (args.create and not args.file))
+
+
+def make_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('-p', '--pages', action='store_true',
                         default=False, help='print the list of pages')
@@ -229,30 +486,108 @@ if __name__ == '__main__':
                         default=False,
                         help='sort by modification time, last first')
 
+    parser.add_argument('-f', dest='unsorted', action='store_true',
+                        default=False,
+                        help='do not sort, print pages as they are received')
+
     parser.add_argument('-c', '--page-content', dest='content', action='store',
                         help='print content of the page')
 
+    parser.add_argument('--search', dest='search', action='store',
+                        help='search pages by title and cached content')
+
+    parser.add_argument('--index-file', dest='index_file', action='store',
+                        default=onenotesearch.INDEX_FILE_DEFAULT,
+                        help='search index file')
+
     parser.add_argument('--html', dest='html', action='store_true',
                         help='print content of the page in HTML format')
 
     parser.add_argument('--tree', dest='tree', action='store_true',
                         help='print OneNote structure in tree-like format')
 
+    parser.add_argument('--depth', dest='depth', action='store',
+                        type=int, default=None,
+                        help='levels of the tree to print '
+                             '(1 - notebooks only)')
+
+    parser.add_argument('--root', dest='root', action='store',
+                        help='print the tree of the notebook or section '
+                             '(name or id)')
+
+    parser.add_argument('--lazy', dest='lazy', action='store_true',
+                        help='with -n and --tree get sections and pages '
+                             'only when they are shown')
+
     parser.add_argument('-u', '--update', dest='update', action='store_true',
                         help='update OneNote structure from server')
 
+    parser.add_argument('--sync', dest='sync', action='store_true',
+                        help='get only changes since the last update')
+
+    parser.add_argument('--workers', dest='workers', action='store',
+                        type=int, default=1,
+                        help='number of parallel requests for --update')
+
+    parser.add_argument('--page-size', dest='page_size', action='store',
+                        type=int,
+                        help='number of entities per listing request')
+
+    parser.add_argument('--all-fields', dest='all_fields',
+                        action='store_true',
+                        help='get all entity fields in listings')
+
+    parser.add_argument('--export-json', dest='export_json', action='store',
+                        help='save OneNote structure to file in JSON format')
+
+    parser.add_argument('--cache-dir', dest='cache_dir', action='store',
+                        default=onenotecontent.CACHE_DIR_DEFAULT,
+                        help='directory of page content cache')
+
+    parser.add_argument('--cache-size', dest='cache_size', action='store',
+                        type=int,
+                        default=onenotecontent.CACHE_SIZE_DEFAULT // 2**20,
+                        help='max size of page content cache in MB')
+
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help='always download page content')
+
     parser.add_argument('--log', dest='loglevel', action='store',
                         help='set loglevel (INFO, DEBUG etc')
 
     parser.add_argument('--create-page', dest='create', action='store',
                         help='create page in secion (--in-section=<sec_name>)')
 
+    parser.add_argument('--create-pages', dest='create_pages',
+                        action='store',
+                        help='create pages from Markdown files '
+                             '(directory or glob, --in-section=<sec_name>)')
+
     parser.add_argument('--in-section', dest='in_section', action='store',
-                        help='section to create page in')
+                        help='section to create page in or to export')
 
     parser.add_argument('--from-file', dest='file', action='store',
                         help='file to create page')
 
+    parser.add_argument('--export', dest='export', action='store',
+                        help='export pages to directory')
+
+    parser.add_argument('--notebook', dest='notebook', action='store',
+                        help='notebook to export (--export)')
+
+    parser.add_argument('--format', dest='format', action='store',
+                        choices=['md', 'html'], default='md',
+                        help='format of exported pages')
+
+    parser.add_argument('--export-workers', dest='export_workers',
+                        action='store', type=int,
+                        default=onenoteexport.EXPORT_WORKERS,
+                        help='number of parallel requests for --export '
+                             'and --create-pages')
+
+    parser.add_argument('--stats', dest='stats', action='store_true',
+                        help='print request timing summary at exit')
+
     parser.add_argument('--auth', dest='authorize', action='store_true',
                         help='run authorization in OneNote Online')
 
@@ -270,5 +605,54 @@ if __name__ == '__main__':
                         help='scope for authorization')
 
 
-    args = parser.parse_args()
+    parser.add_argument('--daemon', dest='daemon', action='store_true',
+                        help='run as a background server keeping the '
+                             'structure and connections warm')
+
+    parser.add_argument('--no-daemon', dest='no_daemon', action='store_true',
+                        help="don't use a running daemon")
+
+    parser.add_argument('--socket', dest='socket', action='store',
+                        default=onenotedaemon.SOCKET_FILE_DEFAULT,
+                        help='daemon socket file')
+
+    parser.add_argument('--account', dest='account', action='store',
+                        type=account_name,
+                        help='use the session, structure and cache of the '
+                             'account in the accounts directory')
+
+    parser.add_argument('--accounts-dir', dest='accounts_dir',
+                        action='store',
+                        default=onenoteaccounts.ACCOUNTS_DIR_DEFAULT,
+                        help='directory of the accounts')
+
+    parser.add_argument('--prefetch', dest='prefetch', action='store',
+                        choices=onenoteprefetch.PREFETCH_MODES,
+                        help='with --daemon download pages likely to be '
+                             'read next to the content cache: the next '
+                             'pages of the section or the recently '
+                             'modified pages')
+
+    parser.add_argument('--prefetch-count', dest='prefetch_count',
+                        action='store', type=int,
+                        default=onenoteprefetch.PREFETCH_COUNT,
+                        help='number of pages to prefetch')
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = make_parser().parse_args()
+    if args.daemon:
+        if args.prefetch and args.no_cache:
+            print('--prefetch needs the content cache')
+            exit(1)
+        daemon = CliDaemon(args)
+        onenotedaemon.serve(args.socket, daemon.handle)
+    elif run_in_daemon(args):
+        result = onenotedaemon.request(args.socket, sys.argv[1:])
+        if result is not None:
+            status, output = result
+            sys.stdout.write(output)
+            sys.exit(status)
     main(args)
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import onenotestore
+
+CACHE_DIR_DEFAULT = '.onenote.cache'
+CACHE_SIZE_DEFAULT = 256 * 1024 * 1024
+# eviction frees space down to this fraction of max_size so that
+# the following puts don't scan the directory again
+EVICT_LOW_WATER = 0.9
+
+
+class ContentCache(object):
+    '''
+    On-disk cache of page content keyed by page id and lastmod_time.
+    Each page is stored as <sha1(id)>.html with a <sha1(id)>.json
+    record of its id, lastmod_time, ETag and size. When the total size
+    exceeds max_size the least recently used pages are removed until
+    it is below EVICT_LOW_WATER of max_size.
+    '''
+
+    def __init__(self, directory=CACHE_DIR_DEFAULT,
+                 max_size=CACHE_SIZE_DEFAULT):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def key(self, page_id):
+        return hashlib.sha1(page_id.encode('utf-8')).hexdigest()
+
+    def path(self, page_id, ext):
+        return os.path.join(self.directory, self.key(page_id) + ext)
+
+    def keys(self):
+        '''
+        Keys of all cached pages
+        '''
+        return set(e.name[:-len('.html')] for e in self._entries())
+
+    def version(self):
+        '''
+        Modification time of the cache directory, changes when pages
+        are added or removed
+        '''
+        return os.stat(self.directory).st_mtime_ns
+
+    def meta(self, page_id):
+        try:
+            with open(self.path(page_id, '.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def etag(self, page_id):
+        meta = self.meta(page_id)
+        return meta.get('etag') if meta else None
+
+    def read(self, page_id):
+        path = self.path(page_id, '.html')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except OSError:
+            return None
+        # mtime is the last use time for LRU eviction
+        os.utime(path)
+        return text
+
+    def has(self, page):
+        '''
+        True if the cached content matches lastmod_time of the page
+        '''
+        meta = self.meta(page.id)
+        return meta is not None and meta['lastmod'] == lastmod_key(page)
+
+    def get(self, page):
+        '''
+        Get cached content if it matches lastmod_time of the page
+        '''
+        if not self.has(page):
+            return None
+        return self.read(page.id)
+
+    def revalidate(self, page):
+        '''
+        Mark cached content as valid for the current lastmod_time
+        (server returned 304 Not Modified)
+        '''
+        meta = self.meta(page.id)
+        if meta is None:
+            return None
+        meta['lastmod'] = lastmod_key(page)
+        self._write_meta(page.id, meta)
+        return self.read(page.id)
+
+    def put(self, page, text, etag=None):
+        data = text.encode('utf-8')
+        old = self.meta(page.id)
+        with onenotestore.atomic_path(self.path(page.id, '.html'),
+                                      durable=False) as tmp:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+        self._write_meta(page.id, {'id': page.id,
+                                   'lastmod': lastmod_key(page),
+                                   'etag': etag,
+                                   'size': len(data)})
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data) - (old['size'] if old else 0)
+            self._evict()
+
+    def remove(self, page_id):
+        with self._lock:
+            self._remove(page_id)
+
+    def _remove(self, page_id):
+        meta = self.meta(page_id)
+        for ext in ('.html', '.json'):
+            try:
+                os.remove(self.path(page_id, ext))
+            except OSError:
+                pass
+        if meta and self._size is not None:
+            self._size -= meta['size']
+
+    def size(self):
+        with self._lock:
+            return self._size_locked()
+
+    def _size_locked(self):
+        if self._size is None:
+            self._size = sum(e.stat().st_size for e in self._entries())
+        return self._size
+
+    def evict(self):
+        '''
+        Remove least recently used pages if the cache exceeds max_size
+        '''
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        if self._size_locked() <= self.max_size:
+            return
+
+        low_water = self.max_size * EVICT_LOW_WATER
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        for e in entries:
+            if self._size <= low_water:
+                break
+            meta = self._read_meta_file(e.path[:-len('.html')] + '.json')
+            logging.info('content cache: evict %s' % e.name)
+            if meta is not None:
+                self._remove(meta['id'])
+            else:
+                self._size -= e.stat().st_size
+                os.remove(e.path)
+
+    def _entries(self):
+        return [e for e in os.scandir(self.directory)
+                if e.name.endswith('.html')]
+
+    def _read_meta_file(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, page_id, meta):
+        with onenotestore.atomic_path(self.path(page_id, '.json'),
+                                      durable=False) as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(meta, f)
+
+
+def lastmod_key(page):
+    '''
+    lastmod_time of the page in a normalized form for comparison
+    '''
+    return page.lastmod_time.isoformat()
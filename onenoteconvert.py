@@ -0,0 +1,156 @@
+'''
+HTML to Markdown conversion of page content.
+Large pages are converted in chunks of block elements, so memory used
+by the converter doesn't grow with the page size.
+'''
+import logging
+import re
+import time
+
+# pages larger than this are converted in chunks of about this size
+CHUNK_SIZE = 256 * 1024
+CONVERT_WORKERS = 8
+
+TAG_RE = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][a-zA-Z0-9:-]*)[^>]*>', re.S)
+BODY_RE = re.compile(r'<body[^>]*>', re.I)
+BODY_END_RE = re.compile(r'</body\s*>', re.I)
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+             'link', 'meta', 'param', 'source', 'track', 'wbr'}
+# a chunk may end after these elements
+BLOCK_TAGS = {'p', 'div', 'table', 'ul', 'ol', 'dl', 'pre', 'blockquote',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# elements that are converted as a whole
+NO_SPLIT_TAGS = {'table', 'ul', 'ol', 'dl', 'pre'}
+
+
+def html_chunks(html, chunk_size=CHUNK_SIZE):
+    '''
+    Yield parts of the page body of about chunk_size characters, cut
+    after block elements at any depth. Elements enclosing the cut
+    (e.g. the <div data-id="_default"> wrapper of OneNote pages) are
+    closed at the end of the chunk and opened again in the next one.
+    Tables and lists aren't cut. Pages up to chunk_size are yielded
+    whole.
+    '''
+    if len(html) <= chunk_size:
+        yield html
+        return
+
+    m = BODY_RE.search(html)
+    start = m.end() if m else 0
+    m = BODY_END_RE.search(html, start)
+    end = m.start() if m else len(html)
+
+    # [(tag name, open tag)] of the elements enclosing the position
+    stack = []
+    no_split = 0
+    prefix = ''
+    cut = start
+    for m in TAG_RE.finditer(html, start, end):
+        tag = m.group(2)
+        if tag is None:
+            # comment
+            continue
+        tag = tag.lower()
+        if not m.group(1):
+            if tag not in VOID_TAGS and not m.group(0).endswith('/>'):
+                stack.append((tag, m.group(0)))
+                no_split += tag in NO_SPLIT_TAGS
+            continue
+
+        # close the element and the unclosed ones inside it
+        names = [name for name, _ in stack]
+        if tag not in names:
+            continue
+        while stack:
+            name, _ = stack.pop()
+            no_split -= name in NO_SPLIT_TAGS
+            if name == tag:
+                break
+        if tag in BLOCK_TAGS and not no_split and \
+                m.end() - cut >= chunk_size:
+            yield prefix + html[cut:m.end()] + ''.join(
+                '</%s>' % name for name, _ in reversed(stack))
+            prefix = ''.join(open_tag for _, open_tag in stack)
+            cut = m.end()
+    if cut < end:
+        yield prefix + html[cut:end]
+
+
+def iter_markdown(html, chunk_size=CHUNK_SIZE):
+    '''
+    Yield Markdown of the page chunk by chunk
+    '''
+    from html2text import html2text
+    for chunk in html_chunks(html, chunk_size):
+        yield html2text(chunk)
+
+
+def html_to_md(html, chunk_size=CHUNK_SIZE):
+    return ''.join(iter_markdown(html, chunk_size))
+
+
+def convert(html, chunk_size=CHUNK_SIZE):
+    '''
+    Convert page to Markdown, returns Markdown and conversion seconds.
+    Runs in worker processes.
+    '''
+    start = time.perf_counter()
+    text = html_to_md(html, chunk_size)
+    return text, time.perf_counter() - start
+
+
+def convert_pages(onote, pages, workers=CONVERT_WORKERS, processes=None):
+    '''
+    Download pages in a pool of threads and convert each one to Markdown
+    in a pool of processes as soon as it is received.
+    Yields (page, Markdown, conversion seconds) in completion order,
+    Markdown is None if the page can't be downloaded or converted.
+    At most 2 * workers pages are downloaded or waiting for conversion.
+    processes - size of the process pool, 0 to convert in threads.
+    '''
+    import inspect
+    if inspect.iscoroutinefunction(onote.fetch_page_content):
+        raise TypeError('convert_pages needs a sync client, use '
+                        'AsyncOneNote.iter_pages_md')
+    from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                    wait, FIRST_COMPLETED)
+    pages = iter(pages)
+    procs = ProcessPoolExecutor(processes) if processes != 0 else None
+    try:
+        with ThreadPoolExecutor(workers) as threads:
+            submit = procs.submit if procs is not None else threads.submit
+            jobs = {}
+
+            def download_next():
+                page = next(pages, None)
+                if page is not None:
+                    jobs[threads.submit(onote.fetch_page_content, page)] = \
+                        ('download', page)
+
+            for _ in range(2 * workers):
+                download_next()
+            while jobs:
+                done, _ = wait(list(jobs), return_when=FIRST_COMPLETED)
+                for f in done:
+                    kind, page = jobs.pop(f)
+                    try:
+                        result = f.result()
+                    except Exception:
+                        logging.exception('convert: %s failed' % page.id)
+                        result = None
+
+                    if kind == 'download' and result is not None:
+                        jobs[submit(convert, result)] = ('convert', page)
+                        continue
+
+                    download_next()
+                    if result is None:
+                        yield page, None, 0.0
+                    else:
+                        text, seconds = result
+                        logging.info('convert: %s %.3fs' % (page.id, seconds))
+                        yield page, text, seconds
+    finally:
+        if procs is not None:
+            procs.shutdown(cancel_futures=True)
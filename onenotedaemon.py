@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import socket
+import stat
+import traceback
+
+SOCKET_FILE_DEFAULT = '.onenote.sock'
+CONNECT_TIMEOUT = 0.5
+RECV_SIZE = 64 * 1024
+
+
+def recv_message(conn):
+    '''
+    Read one newline-terminated JSON message
+    '''
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(RECV_SIZE)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data.decode('utf-8')) if data else None
+
+
+def send_message(conn, message):
+    conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def serve(path, handler):
+    '''
+    Serve requests on Unix socket until interrupted.
+    handler(argv, cwd) returns (exit status, output).
+    Requests are handled one at a time.
+    '''
+    if os.path.exists(path):
+        os.remove(path)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(path)
+    os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+    s.listen(16)
+    logging.info('daemon: listening on %s' % path)
+    try:
+        while True:
+            conn, _ = s.accept()
+            with conn:
+                try:
+                    request = recv_message(conn)
+                    if request is None:
+                        continue
+                    try:
+                        status, output = handler(request['argv'],
+                                                 request['cwd'])
+                    except Exception:
+                        # the client must not run the command again
+                        logging.exception('daemon: request failed')
+                        status, output = 1, traceback.format_exc()
+                    send_message(conn, {'status': status,
+                                        'output': output})
+                except Exception:
+                    logging.exception('daemon: request failed')
+    finally:
+        s.close()
+        os.remove(path)
+
+
+def request(path, argv, cwd=None):
+    '''
+    Run command in the daemon.
+    Returns (exit status, output) or None if no daemon is running.
+    Once the command is sent it isn't run again by the caller, so
+    a lost connection is reported as a failed command.
+    '''
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(CONNECT_TIMEOUT)
+    try:
+        s.connect(path)
+    except OSError:
+        s.close()
+        return None
+
+    with s:
+        s.settimeout(None)
+        send_message(s, {'argv': argv, 'cwd': cwd or os.getcwd()})
+        response = recv_message(s)
+    if response is None:
+        return 1, 'daemon closed the connection\n'
+    return response['status'], response['output']
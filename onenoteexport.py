@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import re
+import time
+
+import onenoteconvert
+import onenotestore
+
+MANIFEST_FILE = '.export.json'
+EXPORT_WORKERS = 8
+# save the manifest after this many written pages
+MANIFEST_SAVE_INTERVAL = 50
+
+UNSAFE_CHARS_RE = re.compile(r'[\x00-\x1f<>:"/\\|?*]')
+
+
+def safe_name(name):
+    '''
+    Make a file name from notebook/section/page name
+    '''
+    name = UNSAFE_CHARS_RE.sub('_', name or '').strip(' .')
+    return name or '_'
+
+
+class Exporter(object):
+    '''
+    Download pages in parallel and write them to
+    <directory>/<notebook>/<section>/<page>.md (or .html).
+    The manifest file in the directory records lastmod_time of the
+    exported pages, so unchanged pages are skipped on the next run.
+    '''
+
+    def __init__(self, onote, directory, fmt='md', workers=EXPORT_WORKERS,
+                 processes=None):
+        self.onote = onote
+        self.directory = directory
+        self.fmt = fmt
+        self.workers = workers
+        self.processes = processes
+        self.manifest_file = os.path.join(directory, MANIFEST_FILE)
+        self.manifest = {}
+        self.used_paths = set()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, 'r') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+        self.used_paths = set(i['path'] for i in self.manifest.values())
+
+    def save_manifest(self):
+        with onenotestore.atomic_path(self.manifest_file) as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(self.manifest, f)
+
+    def page_path(self, page):
+        '''
+        Path of the page file relative to the export directory
+        '''
+        if page.id in self.manifest:
+            return self.manifest[page.id]['path']
+
+        section = page.parent_entity
+        if section is not None:
+            notebook = section.parent_entity
+            parts = [notebook.name if notebook is not None
+                     else section.parent_name, section.name]
+        else:
+            parts = ['_', page.parent_name]
+        parts = [safe_name(i) for i in parts]
+
+        name = safe_name(page.name)
+        path = os.path.join(*parts, '%s.%s' % (name, self.fmt))
+        if path in self.used_paths:
+            # pages with the same title in one section
+            path = os.path.join(*parts, '%s %s.%s' % (
+                name, safe_name(page.id)[-8:], self.fmt))
+        self.used_paths.add(path)
+        return path
+
+    def is_exported(self, page):
+        item = self.manifest.get(page.id)
+        return item is not None and \
+            item['lastmod'] == page.lastmod_time.isoformat() and \
+            os.path.exists(os.path.join(self.directory, item['path']))
+
+    def write(self, page, text):
+        path = self.page_path(page)
+        full_path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with onenotestore.atomic_path(full_path) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(text)
+        self.manifest[page.id] = {'path': path,
+                                  'lastmod': page.lastmod_time.isoformat()}
+
+    def prepare(self, pages):
+        '''
+        Load the manifest. Returns pages to export and initial stats.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        self.load_manifest()
+
+        todo = [p for p in pages if not self.is_exported(p)]
+        stats = {'exported': 0, 'skipped': len(pages) - len(todo),
+                 'failed': 0, 'convert_seconds': 0.0}
+        logging.info('export: %d pages, %d unchanged' %
+                     (len(pages), stats['skipped']))
+        return todo, stats
+
+    def converter(self, todo):
+        '''
+        Process pool converting pages to Markdown or None
+        '''
+        if todo and self.fmt == 'md' and self.processes != 0:
+            from concurrent.futures import ProcessPoolExecutor
+            return ProcessPoolExecutor(self.processes)
+        return None
+
+    def converted(self, page, result, stats):
+        '''
+        Record conversion time, returns the Markdown
+        '''
+        text, seconds = result
+        stats['convert_seconds'] += seconds
+        logging.info('export: %s converted in %.3fs' % (page.id, seconds))
+        return text
+
+    def exported(self, page, text, stats):
+        self.write(page, text)
+        stats['exported'] += 1
+        if stats['exported'] % MANIFEST_SAVE_INTERVAL == 0:
+            self.save_manifest()
+
+    def finish(self, stats, start):
+        stats['seconds'] = time.perf_counter() - start
+        stats['pages_per_sec'] = stats['exported'] / stats['seconds'] \
+            if stats['seconds'] else 0.0
+        return stats
+
+    def run(self, pages):
+        '''
+        Export pages. Returns dict with the numbers of exported, skipped
+        and failed pages, elapsed seconds and pages per second.
+        '''
+        from concurrent.futures import (ThreadPoolExecutor,
+                                        wait, FIRST_COMPLETED)
+        start = time.perf_counter()
+        todo, stats = self.prepare(pages)
+
+        # get the token once so that workers don't authorize in parallel
+        if todo and not self.onote.get_token():
+            stats['failed'] = len(todo)
+            todo = []
+
+        procs = self.converter(todo)
+        try:
+            with ThreadPoolExecutor(self.workers) as threads:
+                jobs = {threads.submit(self.onote.fetch_page_content, p):
+                        ('download', p) for p in todo}
+                pending = set(jobs)
+                while pending:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for f in done:
+                        kind, page = jobs.pop(f)
+                        try:
+                            text = f.result()
+                        except Exception:
+                            logging.exception('export: %s failed' % page.id)
+                            text = None
+                        if text is None:
+                            stats['failed'] += 1
+                            continue
+
+                        if kind == 'download' and self.fmt == 'md':
+                            if procs is not None:
+                                f = procs.submit(onenoteconvert.convert, text)
+                            else:
+                                f = threads.submit(onenoteconvert.convert,
+                                                   text)
+                            jobs[f] = ('convert', page)
+                            pending.add(f)
+                            continue
+                        if kind == 'convert':
+                            text = self.converted(page, text, stats)
+
+                        self.exported(page, text, stats)
+        finally:
+            if procs is not None:
+                procs.shutdown()
+            self.save_manifest()
+
+        return self.finish(stats, start)
+
+    async def run_async(self, pages):
+        '''
+        Export pages with an asyncio client (onenoteasync.AsyncOneNote),
+        at most workers downloads at a time. Returns the same stats
+        as run().
+        '''
+        import asyncio
+        start = time.perf_counter()
+        todo, stats = self.prepare(pages)
+
+        if todo and not await self.onote.get_token_async():
+            stats['failed'] = len(todo)
+            todo = []
+
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(self.workers)
+        procs = self.converter(todo)
+
+        async def export(page):
+            async with limit:
+                text = await self.onote.get_page_content(page)
+            if text is not None and self.fmt == 'md':
+                # default thread pool if there is no process pool
+                result = await loop.run_in_executor(
+                    procs, onenoteconvert.convert, text)
+                text = self.converted(page, result, stats)
+            return text
+
+        jobs = {asyncio.ensure_future(export(p)): p for p in todo}
+        try:
+            pending = set(jobs)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    page = jobs.pop(f)
+                    try:
+                        text = f.result()
+                    except Exception:
+                        logging.exception('export: %s failed' % page.id)
+                        text = None
+                    if text is None:
+                        stats['failed'] += 1
+                    else:
+                        self.exported(page, text, stats)
+        finally:
+            for f in jobs:
+                f.cancel()
+            if procs is not None:
+                procs.shutdown()
+            self.save_manifest()
+
+        return self.finish(stats, start)
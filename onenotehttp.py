@@ -0,0 +1,58 @@
+'''
+HTTP adapter reporting connection setup times to onenotestats.
+Imported by create_session only, it loads requests and urllib3.
+'''
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from onenotestats import add_phase
+
+
+class TimedConnectionMixin(object):
+    def _new_conn(self):
+        # DNS lookup and TCP connect, urllib3 does both in one call
+        start = time.perf_counter()
+        try:
+            return super(TimedConnectionMixin, self)._new_conn()
+        finally:
+            self._connect_time = time.perf_counter() - start
+            add_phase('connect', self._connect_time)
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        self._connect_time = 0.0
+        start = time.perf_counter()
+        try:
+            return super(TimedHTTPSConnection, self).connect()
+        finally:
+            add_phase('tls', max(time.perf_counter() - start -
+                                 self._connect_time, 0.0))
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    '''
+    HTTPAdapter whose connections report connect and TLS handshake
+    times of the request measured by onenotestats.RequestInfo
+    '''
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool}
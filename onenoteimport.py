@@ -0,0 +1,256 @@
+import glob
+import json
+import logging
+import os
+import time
+
+import onenotestore
+
+IMPORT_STATE_FILE = '.onenote.import'
+IMPORT_WORKERS = 8
+
+
+def find_markdown_files(pattern):
+    '''
+    Markdown files in a directory (recursively) or matching a glob
+    '''
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '**', '*.md')
+    return sorted(p for p in glob.glob(pattern, recursive=True)
+                  if os.path.isfile(p))
+
+
+def render_markdown(path):
+    '''
+    Read Markdown file and return page title (file name) and HTML
+    '''
+    import markdown2
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    title = os.path.splitext(os.path.basename(path))[0]
+    return title, markdown2.markdown(text)
+
+
+class Importer(object):
+    '''
+    Create pages from Markdown files: files are rendered in a process
+    pool and uploaded by a bounded pool of threads. The state file records
+    created files (with their mtime), so a repeated run skips them.
+    It's a journal: a line is appended and flushed to disk for each
+    created page, as page creation can't be repeated without making
+    a duplicate. The journal is compacted at the end of the run.
+    '''
+
+    def __init__(self, onote, section, workers=IMPORT_WORKERS,
+                 processes=None, state_file=IMPORT_STATE_FILE):
+        self.onote = onote
+        self.section = section
+        self.workers = workers
+        self.processes = processes
+        self.state_file = state_file
+        self.state = {}
+        self.journal = None
+
+    def load_state(self):
+        '''
+        Rebuild the state from the journal lines, a line cut short by
+        a crash is ignored
+        '''
+        self.state = {}
+        try:
+            with open(self.state_file, 'r') as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(item, dict):
+                continue
+            key = item.pop('key', None)
+            if key is None:
+                # state saved as one object by earlier versions
+                self.state.update(item)
+            else:
+                self.state[key] = item
+
+    def save_state(self):
+        '''
+        Compact the journal to one line per created file
+        '''
+        with onenotestore.atomic_path(self.state_file) as tmp:
+            with open(tmp, 'w') as f:
+                for key, item in self.state.items():
+                    f.write(json.dumps(dict(item, key=key)) + '\n')
+
+    def open_journal(self):
+        fd = os.open(self.state_file, os.O_RDWR | os.O_APPEND | os.O_CREAT,
+                     0o600)
+        self.journal = os.fdopen(fd, 'r+b')
+        size = self.journal.seek(0, os.SEEK_END)
+        if size:
+            self.journal.seek(size - 1)
+            if self.journal.read(1) != b'\n':
+                # end the line cut short, it's ignored when loaded
+                self.journal.write(b'\n')
+
+    def write_journal(self, key, item):
+        if self.journal is None:
+            self.open_journal()
+        line = json.dumps(dict(item, key=key)) + '\n'
+        self.journal.write(line.encode('utf-8'))
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def close_journal(self, compact):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+            if compact:
+                self.save_state()
+
+    def state_key(self, path):
+        return '%s:%s' % (self.section, os.path.abspath(path))
+
+    def is_created(self, path):
+        item = self.state.get(self.state_key(path))
+        return item is not None and item['mtime'] == os.path.getmtime(path)
+
+    def upload(self, title, html):
+        return self.onote.create_page(title, self.section, html)
+
+    def prepare(self, paths, report=None):
+        '''
+        Load the state. Returns files to import and initial stats.
+        '''
+        self.load_state()
+        stats = {'created': 0, 'skipped': 0, 'failed': 0}
+
+        todo = []
+        for path in paths:
+            if self.is_created(path):
+                stats['skipped'] += 1
+                if report:
+                    report(path, 'skipped')
+            else:
+                todo.append(path)
+        return todo, stats
+
+    def uploaded(self, path, status, stats, report=None):
+        if status in (200, 201):
+            stats['created'] += 1
+            key = self.state_key(path)
+            self.state[key] = {'mtime': os.path.getmtime(path),
+                               'status': status}
+            self.write_journal(key, self.state[key])
+        else:
+            stats['failed'] += 1
+        if report:
+            report(path, status)
+
+    def finish(self, paths, stats, start):
+        stats['failed'] += len(paths) - sum(stats.values())
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+
+    def run(self, paths, report=None):
+        '''
+        Create pages from the files.
+        report(path, status) is called for each file, status is the HTTP
+        status code, 'skipped' or None if the page can't be created.
+        Returns dict with the numbers of created, skipped and failed files.
+        '''
+        from concurrent.futures import (ThreadPoolExecutor,
+                                        ProcessPoolExecutor,
+                                        wait, FIRST_COMPLETED)
+        start = time.perf_counter()
+        todo, stats = self.prepare(paths, report)
+
+        # get the token once so that uploads don't authorize in parallel
+        if todo and not self.onote.get_token():
+            todo = []
+
+        procs = ProcessPoolExecutor(self.processes) \
+            if todo and self.processes != 0 else None
+        try:
+            with ThreadPoolExecutor(self.workers) as threads:
+                render = procs.submit if procs is not None \
+                    else threads.submit
+                jobs = {render(render_markdown, p): ('render', p)
+                        for p in todo}
+                pending = set(jobs)
+                while pending:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for f in done:
+                        kind, path = jobs.pop(f)
+                        try:
+                            result = f.result()
+                        except Exception:
+                            logging.exception('import: %s failed' % path)
+                            result = None
+
+                        if kind == 'render' and result is not None:
+                            f = threads.submit(self.upload, *result)
+                            jobs[f] = ('upload', path)
+                            pending.add(f)
+                            continue
+
+                        self.uploaded(path, result, stats, report)
+        finally:
+            if procs is not None:
+                procs.shutdown()
+            self.close_journal(compact=True)
+
+        return self.finish(paths, stats, start)
+
+    async def run_async(self, paths, report=None):
+        '''
+        Create pages with an asyncio client (onenoteasync.AsyncOneNote),
+        at most workers uploads at a time. Same results as run().
+        '''
+        import asyncio
+        from concurrent.futures import ProcessPoolExecutor
+        start = time.perf_counter()
+        todo, stats = self.prepare(paths, report)
+
+        if todo and not await self.onote.get_token_async():
+            todo = []
+
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(self.workers)
+        procs = ProcessPoolExecutor(self.processes) \
+            if todo and self.processes != 0 else None
+
+        async def create(path):
+            # default thread pool if there is no process pool
+            title, html = await loop.run_in_executor(procs, render_markdown,
+                                                     path)
+            async with limit:
+                return await self.onote.create_page(title, self.section,
+                                                    html)
+
+        jobs = {asyncio.ensure_future(create(p)): p for p in todo}
+        try:
+            pending = set(jobs)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    path = jobs.pop(f)
+                    try:
+                        result = f.result()
+                    except Exception:
+                        logging.exception('import: %s failed' % path)
+                        result = None
+                    self.uploaded(path, result, stats, report)
+        finally:
+            for f in jobs:
+                f.cancel()
+            if procs is not None:
+                procs.shutdown()
+            self.close_journal(compact=True)
+
+        return self.finish(paths, stats, start)
@@ -0,0 +1,234 @@
+'''
+Background prefetching of page content into the content cache
+'''
+import heapq
+import logging
+import queue
+import threading
+
+from onenotecontent import lastmod_key
+
+PREFETCH_MODES = ('siblings', 'recent')
+PREFETCH_COUNT = 4
+PREFETCH_WORKERS = 2
+PREFETCH_QUEUE_SIZE = 32
+
+
+class Prefetcher(object):
+    '''
+    Download pages that are likely to be read next into the content
+    cache of the OneNote instance in background threads.
+    mode - 'siblings': count pages following the page read in its
+    section, 'recent': count most recently modified pages.
+    At most queue_size pages wait for download, others are dropped.
+    '''
+    Empty = queue.Empty
+    Full = queue.Full
+
+    def __init__(self, onote, mode='siblings', count=PREFETCH_COUNT,
+                 workers=PREFETCH_WORKERS, queue_size=PREFETCH_QUEUE_SIZE):
+        if mode not in PREFETCH_MODES:
+            raise ValueError('unknown prefetch mode: %s' % mode)
+        self.onote = onote
+        self.mode = mode
+        self.count = count
+        self.queue = self.make_queue(queue_size)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._queued = set()
+        # page id -> event set when its download is finished
+        self._inflight = {}
+        # page id -> (lastmod, size) of prefetched pages not read yet
+        self._unread = {}
+        self.counters = {'reads': 0, 'hits': 0, 'prefetched': 0,
+                         'prefetched_bytes': 0, 'wasted_bytes': 0,
+                         'failed': 0, 'dropped': 0, 'cancelled': 0}
+        self._workers = self.start(workers)
+
+    def make_queue(self, size):
+        return queue.Queue(size)
+
+    def start(self, workers):
+        threads = [threading.Thread(target=self._work, daemon=True)
+                   for _ in range(workers)]
+        for t in threads:
+            t.start()
+        return threads
+
+    def before_read(self, page):
+        '''
+        Wait for the page if it's being prefetched and count the read
+        '''
+        with self._lock:
+            event = self._inflight.get(page.id)
+        if event is not None:
+            event.wait()
+        self._count_read(page)
+
+    def _count_read(self, page):
+        with self._lock:
+            self.counters['reads'] += 1
+            unread = self._unread.pop(page.id, None)
+            if unread is not None:
+                lastmod, size = unread
+                if lastmod == lastmod_key(page):
+                    self.counters['hits'] += 1
+                else:
+                    # modified after it was prefetched
+                    self.counters['wasted_bytes'] += size
+
+    def after_read(self, page):
+        '''
+        Schedule prefetching of the pages predicted to be read next
+        '''
+        self.schedule(self.predict(page))
+
+    def predict(self, page):
+        if self.mode == 'recent':
+            return heapq.nlargest(self.count, self.onote.pages,
+                                  key=lambda p: p.lastmod_time)
+
+        section = page.parent_entity
+        if section is None:
+            return []
+        siblings = section.children
+        for i, p in enumerate(siblings):
+            if p.id == page.id:
+                return siblings[i + 1:i + 1 + self.count]
+        return []
+
+    def schedule(self, pages):
+        '''
+        Queue pages that aren't cached. Returns number of queued pages.
+        '''
+        cache = self.onote.content_cache
+        if cache is None:
+            return 0
+        count = 0
+        for page in pages:
+            with self._lock:
+                if page.id in self._queued or page.id in self._inflight or \
+                        page.id in self._unread:
+                    continue
+            if cache.has(page):
+                continue
+            with self._lock:
+                try:
+                    self.queue.put_nowait((self._generation, page))
+                except self.Full:
+                    self.counters['dropped'] += 1
+                    continue
+                self._queued.add(page.id)
+            count += 1
+        return count
+
+    def cancel(self):
+        '''
+        Drop queued pages, downloads in progress are completed
+        '''
+        with self._lock:
+            self._generation += 1
+            self.counters['cancelled'] += len(self._queued)
+            self._queued.clear()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except self.Empty:
+                break
+            if item is None:
+                # keep the stop request of close()
+                self.queue.put_nowait(item)
+                break
+
+    def close(self, timeout=None):
+        '''
+        Cancel prefetching and stop the threads. Returns stats().
+        '''
+        self.cancel()
+        for _ in self._workers:
+            self.queue.put(None)
+        for t in self._workers:
+            t.join(timeout)
+        return self.stats()
+
+    def stats(self):
+        '''
+        Counters, hit_rate (hits per read) and wasted_bytes including
+        prefetched pages that haven't been read
+        '''
+        with self._lock:
+            stats = dict(self.counters)
+            stats['wasted_bytes'] += sum(size for _, size
+                                         in self._unread.values())
+        stats['hit_rate'] = stats['hits'] / stats['reads'] \
+            if stats['reads'] else 0.0
+        return stats
+
+    def summary(self):
+        stats = self.stats()
+        stats['hit_rate'] *= 100
+        return ('prefetch: %(reads)d reads, %(hits)d hits '
+                '(%(hit_rate).0f%%), %(prefetched)d pages prefetched '
+                '(%(prefetched_bytes)d bytes, %(wasted_bytes)d wasted), '
+                '%(failed)d failed, %(dropped)d dropped, '
+                '%(cancelled)d cancelled' % stats)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            page, event = self._take(item)
+            if event is None:
+                continue
+            try:
+                if self._needed(page):
+                    self._record(page, self.onote.fetch_page_content(page))
+            except Exception:
+                self._failed(page)
+            finally:
+                self._done(page, event)
+
+    def _take(self, item):
+        '''
+        Start prefetching of a queued page. Returns the page and its
+        event, or None for the event if prefetching was cancelled.
+        '''
+        generation, page = item
+        with self._lock:
+            self._queued.discard(page.id)
+            if generation != self._generation:
+                return page, None
+            event = self._inflight[page.id] = self.new_event()
+        return page, event
+
+    def new_event(self):
+        return threading.Event()
+
+    def _needed(self, page):
+        cache = self.onote.content_cache
+        if cache is None or cache.has(page):
+            return False
+        logging.info('prefetch: %s' % page.id)
+        return True
+
+    def _record(self, page, text):
+        with self._lock:
+            if text is None:
+                self.counters['failed'] += 1
+                return
+            size = len(text.encode('utf-8'))
+            self.counters['prefetched'] += 1
+            self.counters['prefetched_bytes'] += size
+            self._unread[page.id] = (lastmod_key(page), size)
+
+    def _failed(self, page):
+        logging.exception('prefetch: %s failed' % page.id)
+        with self._lock:
+            self.counters['failed'] += 1
+
+    def _done(self, page, event):
+        with self._lock:
+            del self._inflight[page.id]
+        event.set()
+
@@ -0,0 +1,151 @@
+import html
+import os
+import re
+import sqlite3
+
+INDEX_FILE_DEFAULT = '.onenote.idx'
+INDEX_VERSION = 1
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS docs (
+        rowid INTEGER PRIMARY KEY,
+        id TEXT UNIQUE NOT NULL,
+        lastmod TEXT,
+        has_body INTEGER NOT NULL)''',
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(
+        title, body, tokenize='unicode61 remove_diacritics 2')''',
+    '''CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value)''']
+
+# title matches weigh more than body matches
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+SKIP_RE = re.compile(r'<(head|script|style)\b.*?</\1\s*>', re.S | re.I)
+TAG_RE = re.compile(r'<[^>]+>')
+SPACE_RE = re.compile(r'\s+')
+
+
+def html_to_text(text):
+    '''
+    Plain text of page HTML for indexing
+    '''
+    text = SKIP_RE.sub(' ', text)
+    text = TAG_RE.sub(' ', text)
+    return SPACE_RE.sub(' ', html.unescape(text)).strip()
+
+
+def fts_query(query):
+    '''
+    FTS5 query matching all words of the query
+    '''
+    return ' '.join('"%s"' % w.replace('"', '""') for w in query.split())
+
+
+class SearchIndex(object):
+    '''
+    SQLite FTS5 index of page titles and cached page content.
+    update() indexes pages whose lastmod_time changed since the last
+    update and pages whose content appeared in the content cache.
+    '''
+
+    def __init__(self, path=INDEX_FILE_DEFAULT):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, INDEX_VERSION):
+            self.conn.close()
+            os.remove(path)
+            self.conn = sqlite3.connect(path)
+        for sql in SCHEMA:
+            self.conn.execute(sql)
+        self.conn.execute('PRAGMA user_version=%d' % INDEX_VERSION)
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key=?',
+                                (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?,?)',
+                          (key, value))
+
+    def put(self, page, body=None, lastmod=None):
+        '''
+        Index page title and content HTML (if given)
+        '''
+        if lastmod is None:
+            lastmod = page.lastmod_iso
+        row = self.conn.execute('SELECT rowid FROM docs WHERE id=?',
+                                (page.id,)).fetchone()
+        if row:
+            self.conn.execute('DELETE FROM fts WHERE rowid=?', row)
+            self.conn.execute('UPDATE docs SET lastmod=?, has_body=? '
+                              'WHERE rowid=?',
+                              (lastmod, body is not None, row[0]))
+            rowid = row[0]
+        else:
+            rowid = self.conn.execute(
+                'INSERT INTO docs (id, lastmod, has_body) VALUES (?,?,?)',
+                (page.id, lastmod, body is not None)).lastrowid
+        self.conn.execute('INSERT INTO fts (rowid, title, body) '
+                          'VALUES (?,?,?)',
+                          (rowid, page.name,
+                           html_to_text(body) if body is not None else ''))
+
+    def update(self, pages, cache=None):
+        '''
+        Bring the index up to date with the pages and the content cache.
+        Returns the number of (re)indexed pages.
+        '''
+        indexed = {i: (lastmod, has_body) for i, lastmod, has_body in
+                   self.conn.execute('SELECT id, lastmod, has_body '
+                                     'FROM docs')}
+        cache_version = str(cache.version()) if cache is not None else None
+        cache_changed = cache_version != self.get_meta('cache_version')
+        cached_keys = cache.keys() if cache is not None and \
+            cache_changed else set()
+
+        count = 0
+        with self.conn:
+            for page in pages:
+                lastmod = page.lastmod_iso
+                item = indexed.pop(page.id, None)
+                if item is not None and item[0] == lastmod:
+                    # unchanged page, index content that appeared in cache
+                    if item[1] or not cached_keys or \
+                            cache.key(page.id) not in cached_keys:
+                        continue
+                    body = cache.get(page)
+                    if body is None:
+                        continue
+                else:
+                    body = cache.get(page) if cache is not None else None
+                self.put(page, body, lastmod)
+                count += 1
+
+            for page_id in indexed:
+                row = self.conn.execute('SELECT rowid FROM docs WHERE id=?',
+                                        (page_id,)).fetchone()
+                self.conn.execute('DELETE FROM fts WHERE rowid=?', row)
+                self.conn.execute('DELETE FROM docs WHERE rowid=?', row)
+
+            self.set_meta('cache_version', cache_version)
+        return count
+
+    def search(self, query, limit=20):
+        '''
+        Pages matching all words of the query, best first.
+        Returns list of (page id, title, snippet).
+        '''
+        return self.conn.execute(
+            '''SELECT docs.id, fts.title,
+                      snippet(fts, 1, '[', ']', '...', 12)
+               FROM fts JOIN docs ON docs.rowid = fts.rowid
+               WHERE fts MATCH ?
+               ORDER BY bm25(fts, ?, ?) LIMIT ?''',
+            (fts_query(query), TITLE_WEIGHT, BODY_WEIGHT, limit)).fetchall()
@@ -0,0 +1,182 @@
+import threading
+import time
+from datetime import timedelta
+
+from urllib.parse import urlsplit
+
+# path segments kept in endpoint labels, other segments are ids
+ENDPOINT_WORDS = {'notebooks', 'sections', 'pages', 'sectionGroups',
+                  'content', 'oauth20_token.srf'}
+
+# connection phases reported by the instrumented HTTP adapter
+PHASES = ('connect', 'tls', 'ttfb', 'download')
+
+_local = threading.local()
+
+
+def endpoint_label(method, url, base_url=''):
+    '''
+    Short request label with ids replaced by {id},
+    e.g. "GET pages/{id}/content"
+    '''
+    if base_url and url.startswith(base_url):
+        path = urlsplit(url[len(base_url):]).path
+    else:
+        path = urlsplit(url).path.rsplit('/', 1)[-1]
+    segments = [s if s in ENDPOINT_WORDS else '{id}'
+                for s in path.split('/') if s]
+    return '%s %s' % (method, '/'.join(segments))
+
+
+def add_phase(phase, seconds):
+    '''
+    Add time spent in a connection phase to the request
+    measured in the current thread
+    '''
+    info = getattr(_local, 'info', None)
+    if info is not None:
+        setattr(info, phase, getattr(info, phase) + seconds)
+
+
+class RequestInfo(object):
+    '''
+    Timing and size of one logical request, including its retries.
+    Times are in seconds: connect (DNS lookup and TCP connect), tls,
+    ttfb (request sent to response headers), download (response body)
+    and elapsed (whole request).
+    '''
+    __slots__ = ('label', 'method', 'url', 'status', 'attempts',
+                 'bytes_out', 'bytes_in', 'connect', 'tls', 'ttfb',
+                 'download', 'elapsed', '_start')
+
+    def __init__(self, label, method, url):
+        self.label = label
+        self.method = method
+        self.url = url
+        self.status = None
+        self.attempts = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.connect = 0.0
+        self.tls = 0.0
+        self.ttfb = 0.0
+        self.download = 0.0
+        self.elapsed = 0.0
+        self._start = time.perf_counter()
+
+    @property
+    def retries(self):
+        return max(self.attempts - 1, 0)
+
+    def measure(self, call, body=None, stream=False):
+        '''
+        Run call() sending body and returning requests.Response,
+        recording one attempt. The body of a stream response is read
+        by the caller, which reports it with add_download().
+        '''
+        self.attempts += 1
+        if body:
+            self.bytes_out += len(body)
+        setup = self.connect + self.tls
+        _local.info = self
+        start = time.perf_counter()
+        try:
+            r = call()
+        finally:
+            _local.info = None
+        total = time.perf_counter() - start
+
+        # requests measures time from sending to parsed headers
+        elapsed = getattr(r, 'elapsed', None)
+        if isinstance(elapsed, timedelta):
+            headers = min(elapsed.total_seconds(), total)
+        else:
+            headers = total
+        # connection setup of this attempt only
+        setup = self.connect + self.tls - setup
+        self.ttfb += max(headers - setup, 0.0)
+        if not stream:
+            self.download += total - headers
+            content = getattr(r, 'content', None)
+            if isinstance(content, bytes):
+                self.bytes_in += len(content)
+        self.status = r.status_code
+        return r
+
+    def add_download(self, seconds, nbytes):
+        '''
+        Record reading nbytes of a stream response body
+        '''
+        self.download += seconds
+        self.bytes_in += nbytes
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._start
+        return self
+
+    def __repr__(self):
+        return '<RequestInfo %s status=%s retries=%d %.1fms>' % (
+            self.label, self.status, self.retries, self.elapsed * 1000)
+
+
+class RequestStats(object):
+    '''
+    Request hook aggregating RequestInfo records per endpoint label
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def __call__(self, info):
+        with self.lock:
+            e = self.endpoints.get(info.label)
+            if e is None:
+                e = self.endpoints[info.label] = dict(
+                    requests=0, errors=0, retries=0, bytes_in=0,
+                    bytes_out=0, elapsed=0.0,
+                    **dict((p, 0.0) for p in PHASES))
+            e['requests'] += 1
+            if info.status is None or info.status >= 400:
+                e['errors'] += 1
+            e['retries'] += info.retries
+            e['bytes_in'] += info.bytes_in
+            e['bytes_out'] += info.bytes_out
+            e['elapsed'] += info.elapsed
+            for p in PHASES:
+                e[p] += getattr(info, p)
+
+    def total(self):
+        with self.lock:
+            return sum(e['elapsed'] for e in self.endpoints.values())
+
+    def summary(self):
+        '''
+        Table lines: one per endpoint sorted by total time,
+        average times in milliseconds
+        '''
+        header = '%-28s %6s %5s %5s %10s %9s %8s %8s %7s %7s %7s %8s' % (
+            'endpoint', 'reqs', 'err', 'retry', 'bytes_in', 'bytes_out',
+            'total_s', 'avg_ms', 'conn_ms', 'tls_ms', 'ttfb_ms', 'down_ms')
+        lines = [header]
+        with self.lock:
+            endpoints = sorted(self.endpoints.items(),
+                               key=lambda i: -i[1]['elapsed'])
+            for label, e in endpoints:
+                n = e['requests']
+                lines.append(
+                    '%-28s %6d %5d %5d %10d %9d %8.2f %8.1f %7.1f %7.1f '
+                    '%7.1f %8.1f' % (
+                        label, n, e['errors'], e['retries'], e['bytes_in'],
+                        e['bytes_out'], e['elapsed'],
+                        e['elapsed'] * 1000 / n,
+                        e['connect'] * 1000 / n, e['tls'] * 1000 / n,
+                        e['ttfb'] * 1000 / n, e['download'] * 1000 / n))
+        return lines
+
+    def print_summary(self, out):
+        lines = self.summary()
+        with self.lock:
+            count = sum(e['requests'] for e in self.endpoints.values())
+        lines.append('%d requests, %.2fs total' % (count, self.total()))
+        out.write('\n'.join(lines) + '\n')
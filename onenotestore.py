@@ -0,0 +1,116 @@
+import contextlib
+import logging
+import os
+import sqlite3
+import stat
+from urllib.parse import quote
+
+STORE_VERSION = 1
+
+# entity fields in the order of OEntity constructor arguments
+FIELDS = ('type', 'id', 'name', 'parent_id', 'parent_name',
+          'created_time', 'lastmod_time')
+
+SCHEMA = '''CREATE TABLE entities (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    parent_id TEXT,
+    parent_name TEXT,
+    created_time TEXT,
+    lastmod_time TEXT)'''
+
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def fsync(path):
+    '''
+    Flush file or directory to disk
+    '''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_path(path, durable=True):
+    '''
+    Yield temporary file name in the directory of path.
+    On success the file replaces path, readable by the owner only.
+    durable - flush the file to disk before replacing path,
+    not needed for data that can be fetched again.
+    '''
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.',
+                               dir=directory)
+    os.close(fd)
+    try:
+        yield tmp
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IWUSR)
+        if durable:
+            fsync(tmp)
+        os.replace(tmp, path)
+        if durable:
+            # directories can't be opened on some platforms
+            with contextlib.suppress(OSError):
+                fsync(directory)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def save(path, rows):
+    '''
+    Save entity rows (tuples of FIELDS) to SQLite file atomically
+    '''
+    with atomic_path(path) as tmp:
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute('PRAGMA journal_mode=OFF')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(SCHEMA)
+            conn.executemany('INSERT INTO entities VALUES (?,?,?,?,?,?,?)',
+                             rows)
+            conn.execute('PRAGMA user_version=%d' % STORE_VERSION)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def load(path, types=None):
+    '''
+    Load entity rows from SQLite file, of the given entity types
+    (e.g. ('notebook',)) or all.
+    Returns None if the file is missing, broken or has another version.
+    '''
+    if not os.path.exists(path):
+        return None
+
+    try:
+        conn = sqlite3.connect('file:%s?mode=ro' %
+                               quote(os.path.abspath(path)), uri=True)
+    except sqlite3.Error:
+        logging.warning("%s can't be opened" % path)
+        return None
+
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != STORE_VERSION:
+            logging.warning('%s has version %d, %d expected' %
+                            (path, version, STORE_VERSION))
+            return None
+        conn.execute('PRAGMA mmap_size=%d' % MMAP_SIZE)
+        query = 'SELECT %s FROM entities' % ','.join(FIELDS)
+        if types is not None:
+            query += ' WHERE type IN (%s)' % ','.join('?' * len(types))
+        return conn.execute(query + ' ORDER BY rowid',
+                            tuple(types or ())).fetchall()
+    except sqlite3.Error:
+        logging.warning("%s isn't a structure cache" % path)
+        return None
+    finally:
+        conn.close()
@@ -0,0 +1,113 @@
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+
+class ListingDecoder(object):
+    '''
+    Incremental decoder of OneNote API listing responses
+    ({"@odata.context": ..., "value": [...], "@odata.nextLink": ...}).
+    feed() returns items of the "value" array decoded so far,
+    the other top-level fields are collected in self.fields.
+    '''
+
+    def __init__(self, key='value'):
+        self.key = key
+        self.fields = {}
+        self.buf = ''
+        self.pos = 0
+        self.state = 'start'
+        self.current_key = None
+        self.done = False
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    def feed(self, data):
+        if isinstance(data, bytes):
+            data = self._utf8.decode(data)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return list(self._parse())
+
+    def close(self):
+        '''
+        Check that the whole response was decoded
+        '''
+        items = self.feed(self._utf8.decode(b'', final=True))
+        if not self.done:
+            raise ValueError('incomplete listing response')
+        return items
+
+    def _skip(self, chars=WHITESPACE):
+        while self.pos < len(self.buf) and self.buf[self.pos] in chars:
+            self.pos += 1
+        return self.pos < len(self.buf)
+
+    def _value(self):
+        '''
+        Decode the next JSON value or return None if it's incomplete
+        '''
+        try:
+            value, end = self._decoder.raw_decode(self.buf, self.pos)
+        except ValueError:
+            return None
+        if end == len(self.buf) and not isinstance(value, (dict, list, str)):
+            # a number or a literal may continue in the next chunk
+            return None
+        self.pos = end
+        return (value,)
+
+    def _expect(self, char):
+        if self.buf[self.pos] != char:
+            raise ValueError('unexpected %r at %d, %r expected' %
+                             (self.buf[self.pos], self.pos, char))
+        self.pos += 1
+
+    def _parse(self):
+        while not self.done and self._skip():
+            if self.state == 'start':
+                self._expect('{')
+                self.state = 'key'
+
+            elif self.state == 'key':
+                if self.buf[self.pos] == '}':
+                    self.pos += 1
+                    self.done = True
+                    return
+                if self.buf[self.pos] == ',':
+                    self.pos += 1
+                    continue
+                key = self._value()
+                if key is None:
+                    return
+                self.current_key = key[0]
+                self.state = 'colon'
+
+            elif self.state == 'colon':
+                self._expect(':')
+                self.state = 'field'
+
+            elif self.state == 'field':
+                if self.current_key == self.key:
+                    self._expect('[')
+                    self.state = 'items'
+                    continue
+                value = self._value()
+                if value is None:
+                    return
+                self.fields[self.current_key] = value[0]
+                self.state = 'key'
+
+            elif self.state == 'items':
+                if self.buf[self.pos] == ']':
+                    self.pos += 1
+                    self.state = 'key'
+                    continue
+                if self.buf[self.pos] == ',':
+                    self.pos += 1
+                    continue
+                item = self._value()
+                if item is None:
+                    return
+                yield item[0]
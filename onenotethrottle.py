@@ -0,0 +1,209 @@
+import collections
+import logging
+import random
+import threading
+import time
+
+RETRY_STATUSES = (429, 503, 504)
+# statuses meaning that the request wasn't processed, safe to retry
+# requests that aren't idempotent (e.g. page creation)
+NOT_PROCESSED_STATUSES = (429,)
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60.0
+MAX_CONCURRENCY = 16
+
+
+class RequestScheduler(object):
+    '''
+    Retry throttled requests (429, 503, 504) and limit the number of
+    requests in flight.
+    Delay before a retry is Retry-After of the response or exponential
+    backoff with full jitter. Requests that aren't idempotent are retried
+    on 429 only: a 503 or 504 may come after the request was processed.
+    The concurrency limit follows AIMD: it grows by 1/limit on each
+    successful request and is halved on throttling.
+    '''
+
+    def __init__(self, max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE,
+                 backoff_max=BACKOFF_MAX, max_concurrency=MAX_CONCURRENCY,
+                 min_concurrency=1, decrease=0.5,
+                 sleep=time.sleep, random=random.random):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease = decrease
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.retries = 0
+        self.throttled = 0
+        self.throttled_time = 0.0
+        self._sleep = sleep
+        self._random = random
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            if self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1.0 / self.limit)
+                self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            self.throttled += 1
+            self.limit = max(self.min_concurrency,
+                             self.limit * self.decrease)
+
+    def record_retry(self, delay):
+        with self._cond:
+            self.retries += 1
+            self.throttled_time += delay
+
+    def delay(self, attempt, response):
+        '''
+        Seconds to wait before the retry number attempt (from 0)
+        '''
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return self._random() * backoff
+
+    def should_retry(self, response, idempotent=True):
+        statuses = RETRY_STATUSES if idempotent else NOT_PROCESSED_STATUSES
+        return response.status_code in statuses
+
+    def run(self, send, idempotent=True):
+        '''
+        Call send() until the response isn't throttled or retries
+        are exhausted. Returns the last response.
+        idempotent - False for requests that mustn't be repeated
+        if the server may have processed them (POST).
+        '''
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                r = send()
+            finally:
+                self.release()
+
+            if r is None or r.status_code not in RETRY_STATUSES:
+                self.on_success()
+                return r
+
+            self.on_throttle()
+            if not self.should_retry(r, idempotent):
+                return r
+            if attempt >= self.max_retries:
+                logging.warning('request throttled, %d retries failed' %
+                                attempt)
+                return r
+
+            delay = self.delay(attempt, r)
+            logging.info('request throttled (%d), retry in %.1fs' %
+                         (r.status_code, delay))
+            r.close()
+            self.record_retry(delay)
+            self._sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        with self._cond:
+            return {'retries': self.retries,
+                    'throttled': self.throttled,
+                    'throttled_time': self.throttled_time,
+                    'concurrency_limit': self.limit}
+
+
+class FairLimiter(object):
+    '''
+    Global limit of requests in flight shared by several accounts.
+    Free slots are given to the waiting accounts in turn, so an account
+    with many queued requests doesn't hold up the others.
+    '''
+
+    def __init__(self, limit=MAX_CONCURRENCY):
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        # accounts with waiting requests in the order of their turns
+        self._turns = collections.deque()
+        self._waiting = {}
+
+    def acquire(self, account):
+        with self._cond:
+            waiting = self._waiting.get(account, 0)
+            if not waiting:
+                self._turns.append(account)
+            self._waiting[account] = waiting + 1
+            while self.in_flight >= self.limit or \
+                    self._turns[0] != account:
+                self._cond.wait()
+            self.in_flight += 1
+            self._turns.popleft()
+            self._waiting[account] -= 1
+            if self._waiting[account]:
+                self._turns.append(account)
+            else:
+                del self._waiting[account]
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+class SharedScheduler(RequestScheduler):
+    '''
+    Scheduler of one account under the global limit of a FairLimiter.
+    Retries and the AIMD limit are per account, as throttling is.
+    '''
+
+    def __init__(self, limiter, account, **kwargs):
+        RequestScheduler.__init__(self, **kwargs)
+        self.limiter = limiter
+        self.account = account
+
+    def acquire(self):
+        RequestScheduler.acquire(self)
+        self.limiter.acquire(self.account)
+
+    def release(self):
+        self.limiter.release()
+        RequestScheduler.release(self)
+
+
+def retry_after_seconds(response):
+    '''
+    Retry-After header of the response in seconds or None
+    '''
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
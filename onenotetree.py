@@ -0,0 +1,98 @@
+'''
+Text rendering of the notebook/section/page tree
+'''
+BRANCH = chr(0x251C) + 2 * chr(0x2500) + ' '
+LAST = chr(0x2514) + 2 * chr(0x2500) + ' '
+PIPE = chr(0x2502) + 3 * ' '
+SPACE = 4 * ' '
+
+# lines written to the stream at once
+WRITE_BATCH = 1024
+
+
+def tree_lines(items, depth=None):
+    '''
+    Yield lines of the tree of items and their children, depth-first.
+    depth - number of levels to render (None for all).
+    Children are only accessed when their level is rendered.
+    '''
+    if depth is not None and depth < 1:
+        return
+    # [entities, next index, prefix of their lines, level]
+    stack = [[items, 0, '', 1]]
+    while stack:
+        top = stack[-1]
+        items, i, prefix, level = top
+        if i == len(items):
+            stack.pop()
+            continue
+        top[1] = i + 1
+
+        item = items[i]
+        last = i == len(items) - 1
+        yield prefix + (LAST if last else BRANCH) + item.name
+        if depth is None or level < depth:
+            children = item.children
+            if children:
+                stack.append([children, 0, prefix + (SPACE if last else PIPE),
+                              level + 1])
+
+
+def subtree_lines(root, depth=None):
+    '''
+    Yield the root name and the tree of its children
+    '''
+    yield root.name
+    yield from tree_lines(root.children,
+                          None if depth is None else depth - 1)
+
+
+def write_lines(out, lines, batch=WRITE_BATCH):
+    '''
+    Write lines to the stream in batches, returns number of lines
+    '''
+    count = 0
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == batch:
+            out.write('\n'.join(chunk) + '\n')
+            count += batch
+            chunk = []
+    if chunk:
+        out.write('\n'.join(chunk) + '\n')
+        count += len(chunk)
+    return count
+
+
+def render_tree(out, onote, depth=None, roots=None):
+    '''
+    Write the tree of all notebooks, or of the given notebooks and
+    sections (roots), to the stream. depth - number of levels under
+    which entities are rendered; the root is the first level.
+    Returns number of lines written.
+    '''
+    if roots is None:
+        return write_lines(out, tree_lines(onote.notebooks, depth))
+    count = 0
+    for root in roots:
+        count += write_lines(out, subtree_lines(root, depth))
+    return count
+
+
+def find_roots(onote, name):
+    '''
+    Notebooks and sections with the name or id
+    '''
+    roots = onote.by_name(name, 'notebook') + onote.by_name(name, 'section')
+    if not roots and onote.partial:
+        # load sections of the lazy tree
+        for n in onote.notebooks:
+            n.children
+        roots = onote.by_name(name, 'section')
+    if not roots:
+        for type in ('notebook', 'section'):
+            item = onote.by_id(name, type)
+            if item is not None:
+                roots.append(item)
+    return roots
@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+import unittest
+
+import onenoteaccounts
+from benchmarks.fakeserver import Account, FakeOneNoteServer
+
+
+class AccountManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        ses_data = {'client_id': 't_id',
+                    'client_secret': 't_secret',
+                    'redirect_url': 't_redir',
+                    'scope': 't_scope',
+                    'access_token': '123',
+                    'refresh_token': '456'}
+        for name in ('work', 'home'):
+            files = onenoteaccounts.account_files(self.tmp.name, name)
+            os.makedirs(os.path.dirname(files['ses_file']))
+            with open(files['ses_file'], 'w') as f:
+                json.dump(ses_data, f)
+        os.makedirs(os.path.join(self.tmp.name, 'empty'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_update(self):
+        """
+        accounts are updated in parallel over one connection pool,
+        each into its own structure file
+        """
+        account = Account(notebooks=2, sections=4, pages=30)
+        with FakeOneNoteServer(account) as server:
+            manager = onenoteaccounts.AccountManager(
+                self.tmp.name, max_concurrency=2, cache=False,
+                base_url=server.base_url)
+            self.assertEqual(manager.names(), ['home', 'work'])
+            self.assertEqual(manager.update(), {'home': 200, 'work': 200})
+            work, home = manager.get('work'), manager.get('home')
+            self.assertIs(work.session, home.session)
+            self.assertIsNot(work.scheduler, home.scheduler)
+            self.assertEqual(manager.limiter.in_flight, 0)
+            manager.close()
+
+        self.assertEqual(len(work.pages), 30)
+        # notebooks, sections and two pages of pages for each account
+        self.assertEqual(server.requests['GET'], 2 * 4)
+        for name in ('work', 'home'):
+            files = onenoteaccounts.account_files(self.tmp.name, name)
+            self.assertTrue(os.path.exists(files['save_file']))
+
+        # the saved structures are loaded by a new manager
+        manager = onenoteaccounts.AccountManager(self.tmp.name)
+        self.assertEqual(len(manager.get('home').pages), 30)
+
+    def test_account_name(self):
+        for name in ('', '..', 'a/b'):
+            with self.assertRaises(ValueError):
+                onenoteaccounts.account_files(self.tmp.name, name)
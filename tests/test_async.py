@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+import onenoteasync
+from onenotethrottle import RequestScheduler
+
+TEST_SES_FILE = 'test.ses'
+
+
+def page(n):
+    return {'id': 'p%d' % n, 'title': 'page %d' % n,
+            'parentSection': {'id': 's0', 'name': 'section'},
+            'createdTime': '2016-01-01T00:00:00Z',
+            'lastModifiedTime': '2016-02-01T00:00:00Z'}
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class AsyncOneNoteTestCase(unittest.TestCase):
+    def setUp(self):
+        ses_data = {'client_id': 't_id',
+                    'client_secret': 't_secret',
+                    'redirect_url': 't_redir',
+                    'scope': 't_scope',
+                    'access_token': '123',
+                    'refresh_token': '456'}
+        with open(TEST_SES_FILE, 'w') as f:
+            json.dump(ses_data, f)
+        self.requests = []
+        self.throttle_first = True
+        self.active = self.max_active = 0
+
+    def tearDown(self):
+        os.remove(TEST_SES_FILE)
+
+    async def fake_server(self):
+        async def listing(request):
+            self.requests.append(request.path_qs)
+            kind = request.match_info['kind']
+            if kind == 'pages' and 'skip' not in request.query:
+                return web.json_response({
+                    'value': [page(0), page(1)],
+                    '@odata.nextLink': str(request.url.with_query(skip=2))})
+            if kind == 'pages':
+                return web.json_response({'value': [page(2)]})
+            if kind == 'sections':
+                return web.json_response({'value': [{
+                    'id': 's0', 'name': 'section',
+                    'parentNotebook': {'id': 'n0', 'name': 'notebook'},
+                    'createdTime': '2016-01-01T00:00:00Z',
+                    'lastModifiedTime': '2016-02-01T00:00:00Z'}]})
+            return web.json_response({'value': [{
+                'id': 'n0', 'name': 'notebook',
+                'createdTime': '2016-01-01T00:00:00Z',
+                'lastModifiedTime': '2016-02-01T00:00:00Z'}]})
+
+        async def content(request):
+            self.requests.append(request.path_qs)
+            if request.headers['Authorization'] != 'Bearer 123':
+                return web.Response(status=401)
+            if self.throttle_first and len(self.requests) == 1:
+                return web.Response(status=429, headers={'Retry-After': '0'})
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            await asyncio.sleep(0.01)
+            self.active -= 1
+            return web.Response(text='<p>%s</p>' % request.match_info['id'],
+                                content_type='text/html')
+
+        async def create(request):
+            self.requests.append(request.path_qs)
+            await request.read()
+            return web.Response(status=201)
+
+        app = web.Application()
+        app.router.add_get('/notes/pages/{id}/content', content)
+        app.router.add_get('/notes/{kind}', listing)
+        app.router.add_post('/notes/sections/{id}/pages', create)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return runner, 'http://127.0.0.1:%d/notes/' % port
+
+    def test_get_structure(self):
+        """
+        get_structure fetches listings concurrently and follows nextLink
+        """
+        async def run():
+            runner, base_url = await self.fake_server()
+            try:
+                async with onenoteasync.AsyncOneNote(
+                        ses_file=TEST_SES_FILE, save_file=os.devnull,
+                        base_url=base_url, select=False) as o:
+                    o.save_structure = lambda: None
+                    await o.get_structure()
+                    streamed = [p.name async for p in o.iter_pages()]
+                    return o, streamed
+            finally:
+                await runner.cleanup()
+
+        o, streamed = asyncio.run(run())
+        self.assertEqual([p.name for p in o.pages],
+                         ['page 0', 'page 1', 'page 2'])
+        self.assertEqual(streamed, ['page 0', 'page 1', 'page 2'])
+        self.assertEqual(o.notebooks[0].children, o.sections)
+        self.assertEqual(o.sections[0].children, o.pages)
+
+    def test_get_page_content_retry(self):
+        """
+        throttled content request is retried
+        """
+        async def run():
+            runner, base_url = await self.fake_server()
+            try:
+                async with onenoteasync.AsyncOneNote(
+                        ses_file=TEST_SES_FILE, save_file=os.devnull,
+                        base_url=base_url) as o:
+                    p = onenoteasync.entity_from_json('page', page(0))
+                    return o, await o.get_page_content(p)
+            finally:
+                await runner.cleanup()
+
+        o, text = asyncio.run(run())
+        self.assertEqual(text, '<p>p0</p>')
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(o.scheduler.stats()['retries'], 1)
+
+    def test_concurrency_limit(self):
+        """
+        requests in flight are limited by the scheduler
+        """
+        self.throttle_first = False
+
+        async def run():
+            runner, base_url = await self.fake_server()
+            try:
+                async with onenoteasync.AsyncOneNote(
+                        ses_file=TEST_SES_FILE, save_file=os.devnull,
+                        base_url=base_url, cache_dir=None,
+                        scheduler=RequestScheduler(max_concurrency=2)) as o:
+                    pages = [onenoteasync.entity_from_json('page', page(i))
+                             for i in range(6)]
+                    return await asyncio.gather(
+                        *[o.get_page_content(p) for p in pages])
+            finally:
+                await runner.cleanup()
+
+        texts = asyncio.run(run())
+        self.assertEqual(texts[5], '<p>p5</p>')
+        self.assertEqual(self.max_active, 2)
+
+    def test_export_and_create_pages(self):
+        """
+        export and create_pages are coroutines of the async client
+        """
+        self.throttle_first = False
+
+        async def run(tmp):
+            runner, base_url = await self.fake_server()
+            try:
+                async with onenoteasync.AsyncOneNote(
+                        ses_file=TEST_SES_FILE, save_file=os.devnull,
+                        base_url=base_url, select=False,
+                        cache_dir=None) as o:
+                    o.save_structure = lambda: None
+                    await o.get_structure()
+                    exported = await o.export(os.path.join(tmp, 'out'),
+                                              fmt='html', processes=0)
+                    created = await o.create_pages(
+                        [md], 'section', processes=0,
+                        state_file=os.path.join(tmp, 'state'))
+                    return exported, created
+            finally:
+                await runner.cleanup()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            md = os.path.join(tmp, 'note.md')
+            with open(md, 'w') as f:
+                f.write('# note')
+            exported, created = asyncio.run(run(tmp))
+            with open(os.path.join(tmp, 'out', 'notebook', 'section',
+                                   'page 2.html')) as f:
+                self.assertEqual(f.read(), '<p>p2</p>')
+
+        self.assertEqual(exported['exported'], 3)
+        self.assertEqual(created['created'], 1)
+        self.assertIn('/notes/sections/s0/pages', self.requests)
+
+    def test_iter_pages_md(self):
+        """
+        pages are downloaded and converted by the async client
+        """
+        self.throttle_first = False
+
+        async def run():
+            runner, base_url = await self.fake_server()
+            try:
+                async with onenoteasync.AsyncOneNote(
+                        ses_file=TEST_SES_FILE, save_file=os.devnull,
+                        base_url=base_url, cache_dir=None) as o:
+                    pages = [onenoteasync.entity_from_json('page', page(i))
+                             for i in range(5)]
+                    return [(p.id, text) async for p, text, _ in
+                            o.iter_pages_md(pages, workers=2, processes=0)]
+            finally:
+                await runner.cleanup()
+
+        results = asyncio.run(run())
+        self.assertEqual(sorted(results),
+                         [('p%d' % i, 'p%d\n\n' % i) for i in range(5)])
+        self.assertEqual(self.max_active, 2)
+
+    def test_prefetch(self):
+        """
+        reading a page prefetches the next pages in tasks,
+        reading them doesn't make requests
+        """
+        self.throttle_first = False
+
+        async def run(tmp):
+            runner, base_url = await self.fake_server()
+            try:
+                async with onenoteasync.AsyncOneNote(
+                        ses_file=TEST_SES_FILE, save_file=os.devnull,
+                        base_url=base_url, select=False,
+                        cache_dir=os.path.join(tmp, 'cache')) as o:
+                    o.save_structure = lambda: None
+                    await o.get_structure()
+                    prefetcher = await o.start_prefetch(count=2)
+                    del self.requests[:]
+                    await o.get_page_content(o.pages[0])
+                    for _ in range(1000):
+                        if prefetcher.stats()['prefetched'] == 2:
+                            break
+                        await asyncio.sleep(0.01)
+                    prefetched = len(self.requests)
+                    texts = [await o.get_page_content(p) for p in o.pages[1:]]
+                    return prefetched, texts, await o.stop_prefetch()
+            finally:
+                await runner.cleanup()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            prefetched, texts, stats = asyncio.run(run(tmp))
+        self.assertEqual(prefetched, 3)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(texts, ['<p>p1</p>', '<p>p2</p>'])
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['reads'], 3)
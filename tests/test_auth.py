@@ -23,7 +23,7 @@ class OneNoteAuthTestCase(unittest.TestCase):
         os.remove(TEST_SES_FILE)
 
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     @mock.patch('onenote.OneNote.auth_get_code')
     def test_create_instance_with_auth(self, mock_get_code, mock_post):
         """
@@ -80,7 +80,7 @@ class OneNoteAuthTestCase(unittest.TestCase):
         self.assertEqual(ses_data['refresh_token'], t_refresh_token)
 
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     @mock.patch('onenote.OneNote.auth_get_code')
     def test_create_instance_wo_auth(self, mock_get_code, mock_post):
         """
@@ -134,8 +134,50 @@ class OneNoteAuthTestCase(unittest.TestCase):
         self.assertEqual(ses_data['refresh_token'], t_refresh_token)
 
 
+    @mock.patch('requests.Session.post')
+    def test_refresh_expiring_token(self, mock_post):
+        """
+        token close to expiry is refreshed once for concurrent callers
+        """
+        import threading
+        import time
+
+        ses_data = {'client_id' : 't_id',
+                    'client_secret' : 't_secret',
+                    'redirect_url' : 't_redir',
+                    'scope' : 't_scope',
+                    'access_token' : 'old',
+                    'refresh_token' : '456',
+                    'expires_at' : time.time() + 10}
+        with open(TEST_SES_FILE,'w') as f:
+           json.dump(ses_data,f)
 
+        def post(*args, **kwargs):
+            time.sleep(0.05)
+            resp = mock.Mock()
+            resp.status_code = 200
+            resp.json.return_value = {'access_token' : 'new',
+                                      'refresh_token' : '789',
+                                      'expires_in' : 3600}
+            return resp
+        mock_post.side_effect = post
 
+        o = onenote.OneNote(ses_file = TEST_SES_FILE)
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(o.get_token()))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(tokens, ['new'] * 8)
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(o.handle_401('old'), 'new')
+        self.assertEqual(mock_post.call_count, 1)
 
-
-
+        with open(TEST_SES_FILE,'r') as f:
+            ses_data = json.load(f)
+        self.assertEqual(ses_data['access_token'], 'new')
+        self.assertEqual(ses_data['refresh_token'], '789')
+        self.assertGreater(ses_data['expires_at'], time.time() + 3000)
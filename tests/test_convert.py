@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+
+import onenote
+import onenoteconvert
+
+T = '2016-01-01T00:00:00Z'
+
+
+def page(id):
+    return onenote.OEntity('page', id, id, 's0', 'Section', T, T, [], None)
+
+
+class ConvertTestCase(unittest.TestCase):
+    def test_chunks(self):
+        """
+        large pages are cut after block elements, enclosing elements
+        are closed and opened again
+        """
+        body = ''.join('<div><p>para %d<br/></p><!-- </div> --></div>' % i
+                       for i in range(100))
+        html = '<html><head><title>T</title></head><body>%s</body></html>' \
+            % body
+        self.assertEqual(list(onenoteconvert.html_chunks(html)), [html])
+
+        chunks = list(onenoteconvert.html_chunks(html, chunk_size=200))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(chunks[0], body[:len(chunks[0])])
+        for chunk in chunks:
+            self.assertTrue(chunk.startswith('<div>'))
+            self.assertTrue(chunk.endswith('</div>'))
+
+        md = onenoteconvert.html_to_md(html, chunk_size=200)
+        self.assertEqual(md.split(), onenoteconvert.html_to_md(html).split())
+
+    def test_onenote_wrapper(self):
+        """
+        pages wrapped in one <div data-id="_default"> are cut inside it,
+        the wrapper is opened again in each chunk; tables aren't cut
+        """
+        wrapper = '<div data-id="_default" style="position:absolute;' \
+            'left:48px;top:115px;width:624px">'
+        body = ''.join('<p>para %d</p><table><tr><td>a%d</td></tr>'
+                       '<tr><td>b%d</td></tr></table>' % (i, i, i)
+                       for i in range(100))
+        html = '<html><head><title>T</title></head><body>%s%s</div>' \
+            '</body></html>' % (wrapper, body)
+
+        chunks = list(onenoteconvert.html_chunks(html, chunk_size=300))
+        self.assertGreater(len(chunks), 10)
+        for chunk in chunks:
+            self.assertTrue(chunk.startswith(wrapper))
+            self.assertTrue(chunk.endswith('</div>'))
+            self.assertEqual(chunk.count('<table>'),
+                             chunk.count('</table>'))
+
+        md = onenoteconvert.html_to_md(html, chunk_size=300)
+        self.assertEqual(md.split(), onenoteconvert.html_to_md(html).split())
+
+    def test_convert_pages(self):
+        """
+        pages are downloaded and converted while others are downloaded,
+        failed downloads are yielded with None
+        """
+        onote = mock.Mock()
+        onote.fetch_page_content.side_effect = \
+            lambda p: None if p.id == 'p3' else '<h1>%s</h1>' % p.id
+        pages = [page('p%d' % i) for i in range(10)]
+
+        results = list(onenoteconvert.convert_pages(onote, pages, workers=2,
+                                                    processes=0))
+        self.assertEqual(sorted(p.id for p, _, _ in results),
+                         sorted(p.id for p in pages))
+        for p, text, seconds in results:
+            if p.id == 'p3':
+                self.assertIsNone(text)
+            else:
+                self.assertEqual(text.strip(), '# %s' % p.id)
+                self.assertGreater(seconds, 0)
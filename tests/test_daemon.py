@@ -0,0 +1,128 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import onenote
+import onenotecli
+import onenotedaemon
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        ses_data = {'client_id': 't_id',
+                    'client_secret': 't_secret',
+                    'redirect_url': 't_redir',
+                    'scope': 't_scope',
+                    'access_token': '123',
+                    'refresh_token': '456'}
+        with open(onenote.OneNote.SESSION_FILE, 'w') as f:
+            json.dump(ses_data, f)
+
+        o = onenote.OneNote()
+        t = '2016-01-01T00:00:00Z'
+        o.notebooks = [onenote.OEntity('notebook', 'n%d' % i, 'nb%d' % i,
+                                       None, None, t, t, [], None)
+                       for i in range(2)]
+        o.save_structure()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_daemon(self):
+        """
+        daemon runs commands with the warm structure over Unix socket
+        and reloads the structure saved by another process
+        """
+        args = onenotecli.make_parser().parse_args(['--no-cache'])
+        daemon = onenotecli.CliDaemon(args)
+        self.assertEqual(daemon.handle(['-n'], self.tmp.name),
+                         (0, 'nb0\nnb1\n'))
+
+        sock = os.path.join(self.tmp.name, 's.sock')
+        self.assertIsNone(onenotedaemon.request(sock, ['-n']))
+        thread = threading.Thread(target=onenotedaemon.serve,
+                                  args=(sock, daemon.handle), daemon=True)
+        thread.start()
+        for i in range(100):
+            if os.path.exists(sock):
+                break
+            time.sleep(0.01)
+
+        o = onenote.OneNote()
+        o.load_structure()
+        o.notebooks[0].name = 'renamed'
+        o.save_structure()
+        self.assertEqual(onenotedaemon.request(sock, ['-n']),
+                         (0, 'nb1\nrenamed\n'))
+        status, output = onenotedaemon.request(sock, ['--bad-option'])
+        self.assertEqual(status, 2)
+        self.assertIn('unrecognized arguments', output)
+
+    def test_handler_error(self):
+        """
+        a failed command is reported, not run again by the client
+        """
+        def handler(argv, cwd):
+            raise RuntimeError('boom')
+
+        sock = os.path.join(self.tmp.name, 's.sock')
+        thread = threading.Thread(target=onenotedaemon.serve,
+                                  args=(sock, handler), daemon=True)
+        thread.start()
+        for i in range(100):
+            if os.path.exists(sock):
+                break
+            time.sleep(0.01)
+
+        status, output = onenotedaemon.request(sock, ['-n'])
+        self.assertEqual(status, 1)
+        self.assertIn('RuntimeError: boom', output)
+
+    def test_forwarded_options(self):
+        """
+        options of the forwarded command line are applied per request
+        """
+        args = onenotecli.make_parser().parse_args(['--no-cache'])
+        daemon = onenotecli.CliDaemon(args)
+        self.assertIsNone(daemon.onote.content_cache)
+
+        daemon.handle(['-n', '--workers', '4', '--cache-dir', 'c'],
+                      self.tmp.name)
+        self.assertEqual(daemon.onote.workers, 4)
+        self.assertEqual(daemon.onote.content_cache.directory,
+                         os.path.join(os.path.realpath(self.tmp.name), 'c'))
+
+        daemon.handle(['-n', '--no-cache'], self.tmp.name)
+        self.assertEqual(daemon.onote.workers, 1)
+        self.assertIsNone(daemon.onote.content_cache)
+
+    def test_account(self):
+        """
+        --account selects the structure of the account in the daemon
+        """
+        o = onenote.OneNote()
+        o.load_structure()
+        o.notebooks = o.notebooks[:1]
+        o.save_file = os.path.join('.onenote.accounts', 'work',
+                                   onenote.SAVE_FILE_DEFAULT)
+        os.makedirs(os.path.dirname(o.save_file))
+        o.save_structure()
+
+        args = onenotecli.make_parser().parse_args(['--no-cache'])
+        daemon = onenotecli.CliDaemon(args)
+        self.assertEqual(daemon.handle(['-n', '--account', 'work'],
+                                       self.tmp.name), (0, 'nb0\n'))
+        self.assertEqual(daemon.handle(['-n'], self.tmp.name),
+                         (0, 'nb0\nnb1\n'))
+        self.assertIs(daemon.accounts.get('work').session,
+                      daemon.onote.session)
+        status, output = daemon.handle(['-n', '--account', '../x'],
+                                       self.tmp.name)
+        self.assertEqual(status, 2)
@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import onenote
+
+TEST_SES_FILE = 'test.ses'
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        ses_data = {'client_id': 't_id',
+                    'client_secret': 't_secret',
+                    'redirect_url': 't_redir',
+                    'scope': 't_scope',
+                    'access_token': '123',
+                    'refresh_token': '456'}
+        with open(TEST_SES_FILE, 'w') as f:
+            json.dump(ses_data, f)
+
+        self.o = onenote.OneNote(ses_file=TEST_SES_FILE)
+        t = '2016-01-01T00:00:00Z'
+        self.o.notebooks = [onenote.OEntity('notebook', 'n0', 'Notebook',
+                                            None, None, t, t, [], None)]
+        self.o.sections = [onenote.OEntity('section', 's0', 'Work/Home',
+                                           'n0', 'Notebook', t, t, [], None)]
+        self.o.pages = [onenote.OEntity('page', 'p%d' % i, 'Page', 's0',
+                                        'Work/Home', t, t, [], None)
+                        for i in range(3)]
+        self.o.create_tree()
+
+    def tearDown(self):
+        os.remove(TEST_SES_FILE)
+
+    @mock.patch('onenote.OneNote.fetch_page_content')
+    def test_export(self, mock_fetch_page_content):
+        """
+        export writes notebook/section/page tree and skips unchanged pages
+        """
+        mock_fetch_page_content.side_effect = \
+            lambda page: '<p>%s</p>' % page.id
+
+        with tempfile.TemporaryDirectory() as tmp:
+            stats = self.o.export(tmp, notebook='Notebook', processes=0)
+            self.assertEqual(stats['exported'], 3)
+            self.assertEqual(stats['failed'], 0)
+            self.assertGreater(stats['convert_seconds'], 0)
+
+            section_dir = os.path.join(tmp, 'Notebook', 'Work_Home')
+            files = sorted(os.listdir(section_dir))
+            self.assertEqual(len(files), 3)
+            self.assertIn('Page.md', files)
+            with open(os.path.join(section_dir, 'Page.md')) as f:
+                self.assertIn(f.read().strip(), ['p0', 'p1', 'p2'])
+
+            self.o.pages[1].lastmod_time = '2016-02-01T00:00:00Z'
+            stats = self.o.export(tmp, fmt='md', processes=0)
+            self.assertEqual(stats['exported'], 1)
+            self.assertEqual(stats['skipped'], 2)
+            self.assertEqual(mock_fetch_page_content.call_count, 4)
+            self.assertEqual(len(os.listdir(section_dir)), 3)
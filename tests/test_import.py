@@ -0,0 +1,110 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import onenote
+import onenoteimport
+
+TEST_SES_FILE = 'test.ses'
+
+
+class ImportTestCase(unittest.TestCase):
+    def setUp(self):
+        ses_data = {'client_id': 't_id',
+                    'client_secret': 't_secret',
+                    'redirect_url': 't_redir',
+                    'scope': 't_scope',
+                    'access_token': '123',
+                    'refresh_token': '456'}
+        with open(TEST_SES_FILE, 'w') as f:
+            json.dump(ses_data, f)
+
+    def tearDown(self):
+        os.remove(TEST_SES_FILE)
+
+    @mock.patch('onenote.OneNote.create_page')
+    def test_create_pages(self, mock_create_page):
+        """
+        pages are created from Markdown files, created files are skipped
+        on the next run
+        """
+        mock_create_page.side_effect = \
+            lambda title, section, html: 500 if title == 'bad' else 201
+
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'notes', 'sub'))
+            for name in ('a', 'sub/b', 'bad'):
+                with open(os.path.join(tmp, 'notes', name + '.md'), 'w') as f:
+                    f.write('# %s\n* item' % name)
+
+            paths = onenoteimport.find_markdown_files(
+                os.path.join(tmp, 'notes'))
+            self.assertEqual(len(paths), 3)
+
+            o = onenote.OneNote(ses_file=TEST_SES_FILE)
+            state_file = os.path.join(tmp, 'state')
+            report = mock.Mock()
+            save_state = onenoteimport.Importer.save_state
+            with mock.patch.object(onenoteimport.Importer, 'save_state',
+                                   autospec=True,
+                                   side_effect=save_state) as save:
+                stats = o.create_pages(paths, 'Work', processes=0,
+                                       state_file=state_file, report=report)
+            # compacted once at the end
+            self.assertEqual(save.call_count, 1)
+            self.assertEqual((stats['created'], stats['failed']), (2, 1))
+            mock_create_page.assert_any_call(
+                'a', 'Work', '<h1>a</h1>\n\n<ul>\n<li>item</li>\n</ul>\n')
+            report.assert_any_call(
+                os.path.join(tmp, 'notes', 'bad.md'), 500)
+
+            stats = o.create_pages(paths, 'Work', processes=0,
+                                   state_file=state_file)
+            self.assertEqual((stats['created'], stats['skipped'],
+                              stats['failed']), (0, 2, 1))
+            self.assertEqual(mock_create_page.call_count, 4)
+
+    @mock.patch('onenote.OneNote.create_page')
+    def test_journal(self, mock_create_page):
+        """
+        each created page is in the state file when it's reported,
+        a line cut short by a crash is ignored
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for name in ('a', 'b', 'c'):
+                paths.append(os.path.join(tmp, name + '.md'))
+                with open(paths[-1], 'w') as f:
+                    f.write('# %s' % name)
+            state_file = os.path.join(tmp, 'state')
+            with open(state_file, 'w') as f:
+                f.write('{"key": "Work:%s", "mt' % paths[0])
+            journaled = []
+
+            def report(path, status):
+                with open(state_file) as f:
+                    journaled.append(f.read().count('"status"'))
+
+            mock_create_page.return_value = 201
+            o = onenote.OneNote(ses_file=TEST_SES_FILE)
+            stats = o.create_pages(paths, 'Work', processes=0,
+                                   state_file=state_file, report=report)
+            self.assertEqual(stats['created'], 3)
+            self.assertEqual(journaled, [1, 2, 3])
+
+            # compacted
+            with open(state_file) as f:
+                lines = [json.loads(line) for line in f]
+            self.assertEqual(sorted(line['key'] for line in lines),
+                             ['Work:%s' % p for p in paths])
+
+            # state file of earlier versions
+            with open(state_file, 'w') as f:
+                json.dump({'Work:%s' % paths[0]: {
+                    'mtime': os.path.getmtime(paths[0]),
+                    'status': 201}}, f)
+            stats = o.create_pages(paths, 'Work', processes=0,
+                                   state_file=state_file)
+            self.assertEqual((stats['created'], stats['skipped']), (2, 1))
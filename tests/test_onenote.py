@@ -1,6 +1,7 @@
 import unittest
 import json
 import os
+import tempfile
 import onenote
 from datetime import datetime
 from unittest import mock
@@ -67,8 +68,368 @@ class OneNoteTestCase(unittest.TestCase):
         r_status = o.get_pages()
 
         # check results
-        mock_onenote_request.assert_called_once_with('https://www.onenote.com/api/v1.0/me/notes/pages')
+        mock_onenote_request.assert_called_once_with('https://www.onenote.com/api/v1.0/me/notes/pages?$select=id,title,createdTime,lastModifiedTime,parentSection')
         self.assertEqual(r_status,t_status)
         self.assertEqual(o.pages[0].name,'p0_title')
         self.assertEqual(o.pages[1].name,'p1_title')
         self.assertEqual(o.pages[2].name,'p2_title')
+
+
+    @mock.patch('onenote.OneNote.onenote_request')
+    def test_listing_page_size(self, mock_onenote_request):
+        """
+        listings request only the used fields with the given page size
+        """
+        mock_onenote_request.return_value = (200, {'value': []})
+
+        o = onenote.OneNote(ses_file = TEST_SES_FILE, page_size = 100)
+        o.get_notebooks()
+
+        mock_onenote_request.assert_called_once_with('https://www.onenote.com/api/v1.0/me/notes/notebooks?$select=id,name,createdTime,lastModifiedTime&$top=100')
+
+
+    def test_injected_session(self):
+        """
+        onenote_request uses the session given to the constructor
+        """
+        session = mock.Mock()
+        resp = mock.Mock()
+        resp.status_code = 200
+        resp.json.return_value = {'value': []}
+        session.get.return_value = resp
+
+        o = onenote.OneNote(ses_file = TEST_SES_FILE, session = session)
+        r = o.onenote_request('https://example.com/notes')
+
+        session.get.assert_called_once_with('https://example.com/notes',
+                headers={'Authorization': 'Bearer 123'}, stream=False)
+        self.assertEqual(r, (200, {'value': []}))
+        self.assertIs(o.session, session)
+
+
+    @mock.patch('onenote.OneNote.save_structure')
+    @mock.patch('onenote.OneNote.onenote_request')
+    def test_get_structure_concurrent(self, mock_onenote_request, mock_save):
+        """
+        get_structure with several workers fetches all listings
+        """
+        base = 'https://www.onenote.com/api/v1.0/me/notes/'
+        notebook = {'id': 'n0_id', 'name': 'n0',
+                    'createdTime': datetime(2016,1,1).isoformat(),
+                    'lastModifiedTime': datetime(2016,2,1).isoformat()}
+        section = {'id': 'p0_id', 'name': 's0',
+                   'parentNotebook': {'id': 'n0_id', 'name': 'n0'},
+                   'createdTime': datetime(2016,1,1).isoformat(),
+                   'lastModifiedTime': datetime(2016,2,1).isoformat()}
+        responses = {base + 'notebooks': (200, {'value': [notebook]}),
+                     base + 'sections': (200, {'value': [section]}),
+                     base + 'pages': (200, {'value': [TestPage('p0').data]})}
+        # with several workers the first request asks for the count
+        mock_onenote_request.side_effect = \
+            lambda url: responses[url.replace('?$count=true', '')]
+
+        o = onenote.OneNote(ses_file = TEST_SES_FILE, workers = 3,
+                            select = False)
+        o.get_structure()
+
+        self.assertEqual(mock_onenote_request.call_count, 3)
+        self.assertEqual(o.notebooks[0].children, o.sections)
+        self.assertEqual(o.sections[0].children, o.pages)
+        self.assertIs(o.pages[0].parent_entity, o.sections[0])
+        mock_save.assert_called_once_with()
+
+
+    def test_create_tree_index(self):
+        """
+        create_tree links entities and builds id/name indexes
+        """
+        now = datetime(2016,1,1)
+        o = onenote.OneNote(ses_file = TEST_SES_FILE)
+        o.notebooks = [onenote.OEntity('notebook', 'n0', 'nb', None, None,
+                                       now, now, [], None)]
+        o.sections = [onenote.OEntity('section', 's%d' % i, 'sec', 'n0',
+                                      'nb', now, now, [], None)
+                      for i in range(2)]
+        o.pages = [onenote.OEntity('page', 'p%d' % i, 'page%d' % i,
+                                   's%d' % (i % 2), 'sec', now, now, [], None)
+                   for i in range(4)]
+        o.create_tree()
+
+        self.assertEqual(o.notebooks[0].children, o.sections)
+        self.assertEqual(o.sections[1].children, [o.pages[1], o.pages[3]])
+        self.assertIs(o.pages[2].parent_entity, o.sections[0])
+        self.assertIs(o.by_id('p3'), o.pages[3])
+        self.assertIsNone(o.by_id('p3', 'section'))
+        self.assertEqual(o.by_name('sec', 'section'), o.sections)
+        self.assertEqual(o.get_item(o.pages, 'name', 'page2'), [o.pages[2]])
+        self.assertEqual(o.get_item(o.pages, 'name', 'nothing'), [])
+
+
+    def test_parse_time(self):
+        """
+        parse_time handles OneNote API timestamps like dateutil
+        """
+        import dateutil.parser
+        for value in ['2016-01-01T10:20:30Z',
+                      '2016-01-01T10:20:30.123Z',
+                      '2016-01-01T10:20:30.1234567Z',
+                      '2016-01-01T10:20:30+03:00',
+                      '2016-01-01T10:20:30',
+                      'Jan 1 2016 10:20']:
+            self.assertEqual(onenote.parse_time(value),
+                             dateutil.parser.parse(value))
+
+    def test_entity_lazy_time(self):
+        """
+        OEntity keeps the raw time string until it is accessed
+        """
+        e = onenote.OEntity('page', 'p0', 'page', None, None,
+                            '2016-01-01T00:00:00Z', '2016-02-01T00:00:00Z',
+                            [], None)
+        self.assertFalse(hasattr(e, '__dict__'))
+        self.assertEqual(e.decode()['lastmod_time'], '2016-02-01T00:00:00Z')
+        self.assertEqual(e.lastmod_time.month, 2)
+        self.assertEqual(e.decode()['lastmod_time'],
+                         '2016-02-01T00:00:00+00:00')
+
+
+    @mock.patch('onenote.OneNote.save_structure')
+    @mock.patch('onenote.OneNote.onenote_request')
+    def test_sync_structure(self, mock_onenote_request, mock_save):
+        """
+        sync_structure merges modified pages and drops deleted ones
+        """
+        base = 'https://www.onenote.com/api/v1.0/me/notes/'
+        o = onenote.OneNote(ses_file = TEST_SES_FILE, select = False)
+        o.pages = [onenote.entity_from_json('page', TestPage(n).data)
+                   for n in ('p0', 'p1', 'p2')]
+        p1 = TestPage('p1').data
+        p1['title'] = 'p1_renamed'
+        p1['lastModifiedTime'] = datetime(2016,3,1).isoformat()
+        since = '2016-02-01T00%3A00%3A00.000Z'
+        responses = {
+            base + 'notebooks?$select=id': (200, {'value': []}),
+            base + 'notebooks': (200, {'value': []}),
+            base + 'sections?$select=id': (200, {'value': []}),
+            base + 'sections': (200, {'value': []}),
+            base + 'pages?$select=id': (200, {'value': [
+                {'id': 'p1_id'}, {'id': 'p2_id'}, {'id': 'p3_id'}]}),
+            base + 'pages?$filter=lastModifiedTime%20gt%20' + since:
+                (200, {'value': [p1, TestPage('p3').data]}),
+            }
+        mock_onenote_request.side_effect = lambda url: responses[url]
+
+        self.assertEqual(o.sync_structure(), 200)
+        self.assertEqual([p.name for p in o.pages],
+                         ['p1_renamed', 'p2_title', 'p3_title'])
+        mock_save.assert_called_once_with()
+
+
+    def test_iter_pages_streaming(self):
+        """
+        iter_pages yields pages decoded from chunks and follows nextLink
+        """
+        base = 'https://www.onenote.com/api/v1.0/me/notes/'
+        bodies = {
+            base + 'pages': {'value': [TestPage('p0').data,
+                                       TestPage('p1').data],
+                             '@odata.nextLink': base + 'pages?$skip=2'},
+            base + 'pages?$skip=2': {'value': [TestPage('p2').data]}}
+
+        def get(url, headers, stream):
+            data = json.dumps(bodies[url]).encode('utf-8')
+            resp = mock.MagicMock()
+            resp.status_code = 200
+            resp.iter_content.return_value = [data[i:i + 10]
+                                              for i in range(0, len(data), 10)]
+            return resp
+
+        session = mock.Mock()
+        session.get.side_effect = get
+        o = onenote.OneNote(ses_file = TEST_SES_FILE, session = session,
+                            select = False)
+
+        pages = o.iter_pages()
+        self.assertEqual(next(pages).name, 'p0_title')
+        self.assertEqual(session.get.call_count, 1)
+        self.assertEqual([p.name for p in pages], ['p1_title', 'p2_title'])
+        self.assertEqual(session.get.call_count, 2)
+
+
+    def test_structure_cache(self):
+        """
+        structure saved to SQLite is loaded back, JSON cache is migrated
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = os.path.join(tmp, 'test #1?%.db')
+            json_file = os.path.join(tmp, 'test.save')
+            o = onenote.OneNote(ses_file = TEST_SES_FILE, save_file = db_file)
+            o.sections = [onenote.OEntity('section', 'p0_id', 's0', None,
+                                          None, '2016-01-01T00:00:00Z',
+                                          '2016-01-01T00:00:00Z', [], None)]
+            o.pages = [onenote.entity_from_json('page', TestPage(n).data)
+                       for n in ('p0', 'p1')]
+            o.save_structure()
+            o.export_json(json_file)
+
+            o = onenote.OneNote(ses_file = TEST_SES_FILE, save_file = db_file)
+            self.assertTrue(o.load_structure())
+            self.assertEqual([p.name for p in o.pages],
+                             ['p0_title', 'p1_title'])
+            self.assertEqual(o.pages[0].lastmod_time, datetime(2016,2,1))
+            self.assertIs(o.pages[0].parent_entity, o.sections[0])
+
+            # only the types a command needs, not saved over the full one
+            for save_file in (db_file, json_file):
+                o = onenote.OneNote(ses_file = TEST_SES_FILE,
+                                    save_file = save_file)
+                self.assertTrue(o.load_structure(('section',)))
+                self.assertEqual((len(o.sections), o.pages), (1, []))
+                self.assertTrue(o.partial)
+                o.save_structure()
+            o = onenote.OneNote(ses_file = TEST_SES_FILE, save_file = db_file)
+            o.load_structure(('notebook', 'section', 'page'))
+            self.assertEqual(len(o.pages), 2)
+            self.assertFalse(o.partial)
+
+            os.remove(db_file)
+            with mock.patch('onenote.SAVE_FILE_DEFAULT', db_file), \
+                    mock.patch('onenote.LEGACY_SAVE_FILE', json_file):
+                o = onenote.OneNote(ses_file = TEST_SES_FILE,
+                                    save_file = db_file)
+                self.assertTrue(o.load_structure())
+            self.assertEqual(len(o.pages), 2)
+            self.assertTrue(os.path.exists(db_file))
+
+
+    def test_content_cache(self):
+        """
+        unchanged pages are served from the content cache,
+        modified pages are revalidated with their ETag
+        """
+        session = mock.Mock()
+        resp = mock.Mock()
+        resp.status_code = 200
+        resp.text = '<html>p0</html>'
+        resp.headers = {'ETag': '"v1"'}
+        session.get.return_value = resp
+
+        with tempfile.TemporaryDirectory() as tmp:
+            o = onenote.OneNote(ses_file = TEST_SES_FILE, session = session,
+                                cache_dir = tmp)
+            page = onenote.entity_from_json('page', TestPage('p0').data)
+            self.assertEqual(o.get_page_content(page), '<html>p0</html>')
+            self.assertEqual(o.get_page_content(page), '<html>p0</html>')
+            self.assertEqual(session.get.call_count, 1)
+
+            page.lastmod_time = datetime(2016,3,1)
+            resp.status_code = 304
+            resp.text = ''
+            self.assertEqual(o.get_page_content(page), '<html>p0</html>')
+            self.assertEqual(session.get.call_args[1]['headers']
+                             ['If-None-Match'], '"v1"')
+            self.assertEqual(o.get_page_content(page), '<html>p0</html>')
+            self.assertEqual(session.get.call_count, 2)
+
+    def test_content_cache_eviction(self):
+        """
+        least recently used pages are evicted over the size limit
+        """
+        import onenotecontent
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = onenotecontent.ContentCache(tmp, max_size = 25)
+            pages = [onenote.entity_from_json('page', TestPage(n).data)
+                     for n in ('p0', 'p1', 'p2')]
+            cache.put(pages[0], 'x' * 10)
+            cache.put(pages[1], 'y' * 10)
+            os.utime(cache.path('p1_id', '.html'), (0, 0))
+            cache.put(pages[2], 'z' * 10)
+
+            self.assertEqual(cache.get(pages[0]), 'x' * 10)
+            self.assertIsNone(cache.get(pages[1]))
+            self.assertEqual(cache.get(pages[2]), 'z' * 10)
+            self.assertEqual(cache.size(), 20)
+
+            # evicted below the low-water mark, the next put doesn't scan
+            with mock.patch.object(cache, '_entries') as entries:
+                cache.put(pages[1], 'y' * 2)
+                entries.assert_not_called()
+
+
+    def test_parallel_listing(self):
+        """
+        with several workers listing pages after the first are fetched
+        in parallel by $skip
+        """
+        from benchmarks.fakeserver import Account, FakeOneNoteServer
+        from onenoteauth import create_session
+        account = Account(notebooks=1, sections=3, pages=250)
+        with FakeOneNoteServer(account, latency=0.02) as server:
+            o = onenote.OneNote(ses_file = TEST_SES_FILE,
+                                base_url = server.base_url, workers = 8,
+                                session = create_session())
+            status_code, pages = o.list_entities('page')
+            o.session.close()
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual([p.id for p in pages],
+                         [p['id'] for p in account.pages])
+        # 20 per page, no request follows a nextLink of another one
+        self.assertEqual(server.requests['GET'], 13)
+
+        # count not above the first page, e.g. a page added meanwhile
+        p = {'id': 'p1', 'title': 't', 'createdTime': '2016-01-01T00:00:00Z',
+             'lastModifiedTime': '2016-01-01T00:00:00Z',
+             'parentSection': {'id': 's1', 'name': 's'}}
+        responses = [(200, {'value': [p], '@odata.count': 1,
+                            '@odata.nextLink': 'next'}),
+                     (200, {'value': [dict(p, id='p2')]})]
+        with mock.patch.object(o, 'onenote_request',
+                               side_effect=responses) as request:
+            status_code, pages = o.list_entities('page')
+        self.assertEqual(status_code, 200)
+        self.assertEqual([p.id for p in pages], ['p1', 'p2'])
+        request.assert_called_with('next')
+
+    def test_lazy_structure(self):
+        """
+        sections and pages are requested on first access of children,
+        and reused while lastModifiedTime of the parent is unchanged
+        """
+        from benchmarks.fakeserver import Account, FakeOneNoteServer
+        from onenoteauth import create_session
+        account = Account(notebooks=2, sections=4, pages=40)
+        with FakeOneNoteServer(account) as server:
+            o = onenote.OneNote(ses_file = TEST_SES_FILE,
+                                save_file = 'test_lazy.db',
+                                base_url = server.base_url,
+                                session = create_session())
+            self.assertEqual(o.get_structure(lazy = True), 200)
+            self.assertTrue(o.partial)
+            self.assertEqual(len(o.notebooks), 2)
+            self.assertEqual(server.requests['GET'], 1)
+
+            n0, n1 = o.notebooks
+            sections = n0.children
+            self.assertEqual([s.id for s in sections],
+                             [s['id'] for s in account.sections
+                              if s['parentNotebook']['id'] == n0.id])
+            pages = sections[0].children
+            self.assertEqual(server.requests['GET'], 3)
+            self.assertEqual(o.by_id(pages[0].id, 'page'), pages[0])
+            self.assertIs(pages[0].parent_entity, sections[0])
+            self.assertFalse(n1.loaded)
+            self.assertEqual(o.sections, sections)
+
+            # n0 is modified, n1 not loaded: only n0 is requested again,
+            # pages of its unchanged section are reused
+            account.notebooks[0]['lastModifiedTime'] = \
+                '2020-01-01T00:00:00Z'
+            server.reset_counters()
+            o.get_structure(lazy = True)
+            self.assertEqual([p.id for p in o.notebooks[0].children[0]
+                              .children], [p.id for p in pages])
+            self.assertEqual(server.requests['GET'], 2)
+            o.session.close()
+
+        self.assertFalse(os.path.exists('test_lazy.db'))
@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import onenote
+from onenoteauth import create_session
+from benchmarks.fakeserver import Account, FakeOneNoteServer
+
+TEST_SES_FILE = 'test_prefetch.ses'
+
+
+class PrefetchTestCase(unittest.TestCase):
+    def setUp(self):
+        ses_data = {'client_id': 't_id',
+                    'client_secret': 't_secret',
+                    'redirect_url': 't_redir',
+                    'scope': 't_scope',
+                    'access_token': '123',
+                    'refresh_token': '456'}
+        with open(TEST_SES_FILE, 'w') as f:
+            json.dump(ses_data, f)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = FakeOneNoteServer(Account(notebooks=1, sections=1,
+                                                pages=6))
+        self.server.start()
+        self.o = onenote.OneNote(ses_file=TEST_SES_FILE,
+                                 save_file=os.path.join(self.tmp.name, 'db'),
+                                 cache_dir=os.path.join(self.tmp.name, 'c'),
+                                 base_url=self.server.base_url,
+                                 session=create_session())
+        self.o.get_structure()
+        self.pages = self.o.sections[0].children
+
+    def tearDown(self):
+        self.o.stop_prefetch()
+        self.o.session.close()
+        self.server.stop()
+        self.tmp.cleanup()
+        os.remove(TEST_SES_FILE)
+
+    def wait_prefetched(self, prefetcher, count):
+        deadline = time.time() + 10
+        while prefetcher.stats()['prefetched'] < count and \
+                time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_siblings(self):
+        """
+        reading a page prefetches the next pages of its section,
+        reading them doesn't make requests
+        """
+        prefetcher = self.o.start_prefetch(count=2)
+        self.server.reset_counters()
+        self.o.get_page_content(self.pages[0])
+        self.wait_prefetched(prefetcher, 2)
+        self.assertEqual(self.server.requests['GET'], 3)
+
+        self.o.get_page_content(self.pages[1])
+        self.wait_prefetched(prefetcher, 3)
+        self.assertEqual(self.server.requests['GET'], 4)
+
+        stats = self.o.stop_prefetch()
+        self.assertIsNone(self.o.prefetcher)
+        self.assertEqual(stats['reads'], 2)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertEqual(stats['prefetched'], 3)
+        # pages 2 and 3 were never read
+        size = sum(len(self.o.content_cache.get(p).encode('utf-8'))
+                   for p in self.pages[2:4])
+        self.assertEqual(stats['wasted_bytes'], size)
+
+    def test_bounded_queue(self):
+        """
+        pages over the queue size are dropped, cancel empties the queue
+        """
+        prefetcher = self.o.start_prefetch(mode='recent', workers=0,
+                                           queue_size=2)
+        self.assertEqual(prefetcher.schedule(self.pages), 2)
+        self.assertEqual(prefetcher.stats()['dropped'], 4)
+        prefetcher.cancel()
+        self.assertTrue(prefetcher.queue.empty())
+        self.assertEqual(prefetcher.stats()['cancelled'], 2)
+        self.assertEqual(prefetcher.schedule(self.pages[:1]), 1)
+
+    def test_no_cache(self):
+        self.o.content_cache = None
+        with self.assertRaises(ValueError):
+            self.o.start_prefetch()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+import onenote
+import onenotecontent
+import onenotesearch
+
+
+def page(n, title, lastmod='2016-01-01T00:00:00Z'):
+    return onenote.OEntity('page', 'p%d' % n, title, 's0', 'section',
+                           lastmod, lastmod, [], None)
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    def test_search(self):
+        """
+        index is built from titles and cached content and updated
+        incrementally
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = onenotecontent.ContentCache(os.path.join(tmp, 'cache'))
+            pages = [page(0, 'Shopping list'), page(1, 'Travel plans'),
+                     page(2, 'Notes')]
+            cache.put(pages[1], '<html><head><title>x</title></head>'
+                                '<body><p>Train to Paris &amp; Lyon</p>'
+                                '</body></html>')
+
+            index = onenotesearch.SearchIndex(os.path.join(tmp, 'idx'))
+            self.assertEqual(index.update(pages, cache), 3)
+            self.assertEqual(index.update(pages, cache), 0)
+            self.assertEqual([r[0] for r in index.search('paris')], ['p1'])
+            self.assertEqual([r[0] for r in index.search('LIST')], ['p0'])
+            self.assertEqual(index.search('train lyon')[0][2],
+                             '[Train] to Paris & [Lyon]')
+
+            # content appeared in the cache, page is modified and deleted
+            cache.put(pages[2], '<p>paris again</p>')
+            pages[0] = page(0, 'Grocery list', '2016-02-01T00:00:00Z')
+            del pages[1]
+            self.assertEqual(index.update(pages, cache), 2)
+            self.assertEqual([r[0] for r in index.search('paris')], ['p2'])
+            self.assertEqual(index.search('shopping'), [])
+            self.assertEqual([r[1] for r in index.search('grocery')],
+                             ['Grocery list'])
+            index.close()
@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import onenote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that cached listing commands must not import
+HEAVY_MODULES = ['requests', 'urllib3', 'dateutil', 'html2text', 'markdown2',
+                 'aiohttp', 'multiprocessing']
+
+# cumulative import time of onenotecli, microseconds
+IMPORT_BUDGET = 150000
+# wall time of a cached listing command including interpreter startup
+COMMAND_BUDGET = 1.0
+
+
+def run_importtime(args, cwd):
+    '''
+    Run python -X importtime with args, return {module: cumulative us}
+    and the process result
+    '''
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                            cwd=cwd, env=env, capture_output=True,
+                            text=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+    return modules, result
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_import_time(self):
+        """
+        onenotecli imports no heavy dependencies and fits the budget
+        """
+        run_importtime(['-c', 'import onenotecli'], ROOT)  # warm up .pyc
+        modules, result = run_importtime(['-c', 'import onenotecli'], ROOT)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        for name in HEAVY_MODULES:
+            self.assertNotIn(name, modules)
+        self.assertLess(modules['onenotecli'], IMPORT_BUDGET)
+
+    def test_cached_listing(self):
+        """
+        listing from the structure cache loads no heavy dependencies
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, '.onenote.ses'), 'w') as f:
+                json.dump({'client_id': 't_id',
+                           'client_secret': 't_secret',
+                           'redirect_url': 't_redir',
+                           'scope': 't_scope',
+                           'access_token': '123',
+                           'refresh_token': '456'}, f)
+            o = onenote.OneNote(ses_file=os.path.join(tmp, '.onenote.ses'),
+                                save_file=os.path.join(tmp, '.onenote.db'))
+            t = '2016-01-01T00:00:00Z'
+            o.notebooks = [onenote.OEntity('notebook', 'n0', 'nb0', None,
+                                           None, t, t, [], None)]
+            o.save_structure()
+
+            cli = os.path.join(ROOT, 'onenotecli.py')
+            start = time.perf_counter()
+            modules, result = run_importtime([cli, '-n', '--no-daemon'], tmp)
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout, 'nb0\n')
+        for name in HEAVY_MODULES:
+            self.assertNotIn(name, modules)
+        self.assertLess(elapsed, COMMAND_BUDGET)
@@ -0,0 +1,164 @@
+import unittest
+import io
+import json
+import os
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import onenote
+import onenotestats
+from onenoteauth import create_session
+from onenotethrottle import RequestScheduler
+
+TEST_SES_FILE = 'test_stats.ses'
+
+
+def response(status, content=b'{}'):
+    r = mock.Mock()
+    r.status_code = status
+    r.headers = {}
+    r.content = content
+    r.json.return_value = json.loads(content.decode())
+    return r
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"value": []}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StatsTestCase(unittest.TestCase):
+    def setUp(self):
+        with open(TEST_SES_FILE, 'w') as f:
+            json.dump({'client_id': 't_id',
+                       'client_secret': 't_secret',
+                       'redirect_url': 't_redir',
+                       'scope': 't_scope',
+                       'access_token': 'SECRET-TOKEN',
+                       'refresh_token': None}, f)
+
+    def tearDown(self):
+        os.remove(TEST_SES_FILE)
+
+    def test_endpoint_label(self):
+        base = onenote.BASE_URL
+        label = onenotestats.endpoint_label
+        self.assertEqual(label('GET', base + 'pages?$top=100', base),
+                         'GET pages')
+        self.assertEqual(label('GET', base + 'pages/0-abc!1/content', base),
+                         'GET pages/{id}/content')
+        self.assertEqual(label('POST', base + 'sections/1-x/pages', base),
+                         'POST sections/{id}/pages')
+
+    def test_hook_records_retries(self):
+        """
+        hooks get one record per request with retries, sizes and status
+        """
+        session = mock.Mock()
+        session.get.side_effect = [response(429), response(200, b'{"a": 1}')]
+        scheduler = RequestScheduler(sleep=mock.Mock(), random=lambda: 0)
+        stats = onenotestats.RequestStats()
+        records = []
+        o = onenote.OneNote(ses_file=TEST_SES_FILE, session=session,
+                            scheduler=scheduler,
+                            request_hooks=[records.append])
+        o.add_request_hook(stats)
+
+        with self.assertLogs(level='DEBUG') as logs:
+            o.get_url('pages')
+
+        self.assertEqual(len(records), 1)
+        info = records[0]
+        self.assertEqual(info.label, 'GET pages')
+        self.assertEqual(info.status, 200)
+        self.assertEqual(info.retries, 1)
+        self.assertEqual(info.bytes_in, len(b'{}') + len(b'{"a": 1}'))
+        self.assertGreater(info.elapsed, 0)
+        self.assertNotIn('SECRET-TOKEN', '\n'.join(logs.output))
+
+        out = io.StringIO()
+        stats.print_summary(out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[1].startswith('GET pages '))
+        self.assertEqual(lines[-1].split(',')[0], '1 requests')
+
+    def test_ttfb_per_attempt(self):
+        """
+        connection setup of an earlier attempt isn't subtracted again
+        """
+        info = onenotestats.RequestInfo('GET pages', 'GET', 'url')
+        clock = [0.0]
+
+        def call(setup, elapsed):
+            def send():
+                onenotestats.add_phase('connect', setup)
+                clock[0] += elapsed
+                r = response(200)
+                r.elapsed = timedelta(seconds=elapsed)
+                return r
+            return send
+
+        with mock.patch('time.perf_counter', lambda: clock[0]):
+            info.measure(call(0.05, 0.5))
+            info.measure(call(0.0, 0.04))
+        self.assertAlmostEqual(info.connect, 0.05)
+        self.assertAlmostEqual(info.ttfb, 0.45 + 0.04)
+
+    def test_stream_download(self):
+        """
+        reading a streamed listing is recorded when the body is consumed
+        """
+        body = json.dumps({'value': []}).encode('utf-8')
+        resp = mock.MagicMock()
+        resp.status_code = 200
+        resp.headers = {}
+        resp.iter_content.return_value = [body[:5], body[5:]]
+        session = mock.Mock()
+        session.get.return_value = resp
+        records = []
+        o = onenote.OneNote(ses_file=TEST_SES_FILE, session=session,
+                            request_hooks=[records.append])
+
+        self.assertEqual(list(o.iter_pages()), [])
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].bytes_in, len(body))
+
+    def test_connection_phases(self):
+        """
+        the session adapter reports connect time of new connections only
+        """
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            records = []
+            o = onenote.OneNote(ses_file=TEST_SES_FILE,
+                                session=create_session(),
+                                base_url='http://127.0.0.1:%d/' %
+                                server.server_port,
+                                request_hooks=[records.append])
+            self.assertEqual(o.get_url('notebooks'), (200, {'value': []}))
+            self.assertEqual(o.get_url('notebooks'), (200, {'value': []}))
+            o.session.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        first, second = records
+        self.assertGreater(first.connect, 0)
+        self.assertEqual(second.connect, 0)
+        self.assertEqual(first.tls, 0)
+        self.assertEqual(first.bytes_in, len(b'{"value": []}'))
@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from onenotethrottle import RequestScheduler, FairLimiter
+
+
+def response(status, headers=None):
+    r = mock.Mock()
+    r.status_code = status
+    r.headers = headers or {}
+    return r
+
+
+class RequestSchedulerTestCase(unittest.TestCase):
+    def test_retry_after(self):
+        """
+        throttled requests are retried after Retry-After seconds
+        """
+        sleep = mock.Mock()
+        scheduler = RequestScheduler(sleep=sleep, max_concurrency=4)
+        send = mock.Mock(side_effect=[response(429, {'Retry-After': '3'}),
+                                      response(503),
+                                      response(200)])
+
+        r = scheduler.run(send)
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(sleep.call_args_list[0], mock.call(3.0))
+        stats = scheduler.stats()
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['throttled'], 2)
+        self.assertGreaterEqual(stats['throttled_time'], 3.0)
+        # halved twice, then increased once
+        self.assertAlmostEqual(stats['concurrency_limit'], 1.0 + 1.0)
+
+    def test_backoff(self):
+        """
+        without Retry-After the delay is exponential with jitter,
+        the last response is returned when retries are exhausted
+        """
+        sleep = mock.Mock()
+        scheduler = RequestScheduler(sleep=sleep, max_retries=3,
+                                     backoff_base=1.0, random=lambda: 0.5)
+        send = mock.Mock(return_value=response(504))
+
+        r = scheduler.run(send)
+
+        self.assertEqual(r.status_code, 504)
+        self.assertEqual(send.call_count, 4)
+        self.assertEqual([c[0][0] for c in sleep.call_args_list],
+                         [0.5, 1.0, 2.0])
+
+    def test_post_not_repeated(self):
+        """
+        requests that aren't idempotent are retried on 429 only
+        """
+        scheduler = RequestScheduler(sleep=mock.Mock(), random=lambda: 0)
+        send = mock.Mock(side_effect=[response(429), response(504),
+                                      response(201)])
+
+        r = scheduler.run(send, idempotent=False)
+
+        self.assertEqual(r.status_code, 504)
+        self.assertEqual(send.call_count, 2)
+
+
+class FairLimiterTestCase(unittest.TestCase):
+    def test_turns(self):
+        """
+        free slots are given to the waiting accounts in turn
+        """
+        limiter = FairLimiter(1)
+        limiter.acquire('x')
+        order = []
+
+        def request(account):
+            limiter.acquire(account)
+            order.append(account)
+            limiter.release()
+
+        threads = []
+        for i, account in enumerate(['a', 'a', 'a', 'b']):
+            t = threading.Thread(target=request, args=(account,))
+            t.start()
+            threads.append(t)
+            while sum(limiter._waiting.values()) <= i:
+                time.sleep(0.001)
+
+        limiter.release()
+        for t in threads:
+            t.join()
+        self.assertEqual(order, ['a', 'b', 'a', 'a'])
+        self.assertEqual(limiter.in_flight, 0)
@@ -0,0 +1,61 @@
+import io
+import unittest
+from unittest import mock
+
+import onenote
+import onenotetree
+
+T = '2016-01-01T00:00:00Z'
+
+
+def entity(type, id, parent_id=None):
+    return onenote.OEntity(type, id, id, parent_id, None, T, T, [], None)
+
+
+class TreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.o = onenote.OneNote(ses_file='test_tree.ses')
+        self.o.notebooks = [entity('notebook', 'n0'),
+                            entity('notebook', 'n1')]
+        self.o.sections = [entity('section', 's0', 'n0'),
+                           entity('section', 's1', 'n0'),
+                           entity('section', 's2', 'n1')]
+        self.o.pages = [entity('page', 'p0', 's0'),
+                        entity('page', 'p1', 's1'),
+                        entity('page', 'p2', 's2')]
+        self.o.create_tree()
+
+    def render(self, **kwargs):
+        out = io.StringIO()
+        onenotetree.render_tree(out, self.o, **kwargs)
+        return out.getvalue()
+
+    def test_tree(self):
+        self.assertEqual(self.render(), (
+            '├── n0\n'
+            '│   ├── s0\n'
+            '│   │   └── p0\n'
+            '│   └── s1\n'
+            '│       └── p1\n'
+            '└── n1\n'
+            '    └── s2\n'
+            '        └── p2\n'))
+
+    def test_depth_and_root(self):
+        self.assertEqual(self.render(depth=1), '├── n0\n└── n1\n')
+        roots = onenotetree.find_roots(self.o, 'n0')
+        self.assertEqual(self.render(roots=roots, depth=2),
+                         'n0\n├── s0\n└── s1\n')
+        roots = onenotetree.find_roots(self.o, 's2')
+        self.assertEqual(self.render(roots=roots), 's2\n└── p2\n')
+
+    def test_batches(self):
+        """
+        lines are written in batches, not one by one
+        """
+        out = io.StringIO()
+        out.write = mock.Mock(wraps=out.write)
+        lines = ['line %d' % i for i in range(5)]
+        self.assertEqual(onenotetree.write_lines(out, lines, batch=2), 5)
+        self.assertEqual(out.write.call_count, 3)
+        self.assertEqual(out.getvalue(), '\n'.join(lines) + '\n')